@@ -12,5 +12,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bulka_play_2.settings')
+# Под ASGI подключаются асинхронные представления (core/async_views.py)
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.DEBUG:
+    # WhiteNoise под ASGI отключён, статику при отладке отдаёт Django
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler  # noqa: E402
+
+    application = ASGIStaticFilesHandler(application)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from dotenv import load_dotenv
+import importlib.util
 import os
 from pathlib import Path
 
@@ -25,6 +26,10 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 TELEGRAM_BOT_API_KEY = os.getenv("TELEGRAM_BOT_API_KEY")
 TELEGRAM_USER_ID = os.getenv("TELEGRAM_USER_ID")
+# Адрес Bot API; для проверки воркера уведомлений можно указать локальный фейковый сервер
+TELEGRAM_API_BASE_URL = os.getenv(
+    "TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot"
+)
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv("DEBUG_MODE", "True") == "True"
 
@@ -49,9 +54,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
-    "debug_toolbar",
     "django.contrib.sites",
-    "django.contrib.sitemaps",
     "core",
 ]
 
@@ -64,9 +67,30 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "core.query_budget.QueryBudgetMiddleware",
+    "core.pricing.DiscountTableMiddleware",
 ]
 
+# Асинхронные представления (core/async_views.py); включает bulka_play_2/asgi.py
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False") == "True"
+if ASYNC_VIEWS:
+    # WhiteNoise работает только синхронно и увёл бы в поток всю цепочку
+    # после себя; под ASGI статику отдаёт веб-сервер перед приложением
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
+
+# debug_toolbar подключается только в режиме отладки и только если установлен
+DEBUG_TOOLBAR = DEBUG and importlib.util.find_spec("debug_toolbar") is not None
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
+# Доля запросов, для которых QueryBudgetMiddleware считает SQL-запросы,
+# и JSONL-файл для замеров (пустое значение — не писать)
+QUERY_BUDGET_SAMPLE_RATE = float(
+    os.getenv("QUERY_BUDGET_SAMPLE_RATE", "1.0" if DEBUG else "0.01")
+)
+QUERY_BUDGET_LOG = os.getenv("QUERY_BUDGET_LOG", str(BASE_DIR / "query_budget.jsonl"))
+
 ROOT_URLCONF = "bulka_play_2.urls"
 
 TEMPLATES = [
@@ -90,10 +114,39 @@ WSGI_APPLICATION = "bulka_play_2.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Путь к базе и каталог кэша переопределяются окружением (например,
+# серверы, которые запускает benchmark_servers, работают с временной базой)
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+        "OPTIONS": {
+            # Выполняется при каждом подключении. WAL: чтение не ждёт записи
+            # и не мешает ей; synchronous=NORMAL в WAL теряет при сбое питания
+            # только последние транзакции, но не портит базу; busy_timeout —
+            # сколько ждать блокировку записи, прежде чем вернуть
+            # "database is locked"; mmap и кэш страниц — на соединение
+            "init_command": (
+                "PRAGMA journal_mode=WAL;"
+                "PRAGMA synchronous=NORMAL;"
+                f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '20000'))};"
+                "PRAGMA mmap_size=268435456;"
+                "PRAGMA cache_size=-16000;"
+                "PRAGMA temp_store=MEMORY;"
+            ),
+            # Транзакции сразу берут блокировку записи (BEGIN IMMEDIATE): с
+            # BEGIN DEFERRED транзакция, начавшая с чтения, не может дождаться
+            # записи и сразу падает с "database is locked"
+            "transaction_mode": "IMMEDIATE",
+        },
+    }
+}
+
+# Кэш общий для всех воркеров gunicorn: в нём хранятся версии каталога и скидок
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("CACHE_LOCATION", BASE_DIR / "cache"),
     }
 }
 
@@ -135,6 +188,12 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
+# collectstatic добавляет в имена хэш содержимого, пишет манифест и сжатые
+# gzip/brotli-копии; бандлы собирает build_assets (core/assets.py)
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "core.assets.StaticFilesStorage"},
+}
 # Настройки для медиа-файлов (загружаемые пользователями)
 # URL-путь для доступа к медиа файлам
 MEDIA_URL = "/media/"
@@ -144,6 +203,16 @@ MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_FILES_DIRS = [
     BASE_DIR / "media",
 ]
+# Сколько процессов строят AVIF/WebP-копии загруженных изображений
+IMAGE_RENDITION_WORKERS = int(os.getenv("IMAGE_RENDITION_WORKERS", "2"))
+# ffmpeg для постеров и облегчённых копий видео (команда build_video_variants)
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+# Идентификатор сборки (например, хэш коммита) входит в ETag страниц. Если не
+# задан, вычисляется по времени изменения шаблонов и статики при старте
+BUILD_ID = os.getenv("BUILD_ID", "")
+# Время сборки (unix time) для Last-Modified вместе с BUILD_ID. Если не задано,
+# берётся время записи манифеста collectstatic
+BUILD_TIME = os.getenv("BUILD_TIME", "")
 # Debug Toolbar settings
 INTERNAL_IPS = [
     "127.0.0.1",
@@ -153,6 +222,9 @@ SITE_ID = 1
 # Настройки для sitemap
 SITE_DOMAIN = "bulka-play.ru"  # Домен для продакшена
 SITE_NAME = "Bulka Play 2"
+# Куда записывается готовая карта сайта и с какого адреса начинаются её ссылки
+SITEMAP_ROOT = os.getenv("SITEMAP_ROOT", BASE_DIR / "sitemap")
+SITEMAP_BASE_URL = os.getenv("SITEMAP_BASE_URL", f"https://{SITE_DOMAIN}")
 
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 20 * 1024 * 1024  # 20 MB
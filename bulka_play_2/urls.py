@@ -1,9 +1,9 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from django.contrib.sitemaps.views import sitemap
-from core.sitemaps import ProductSitemap, ArendaSitemap, NewsSitemap, StaticViewSitemap
+from core.videos import serve_video
+from core.sitemaps import serve_sitemap
 
 from core.views import (
     LandingView,
@@ -13,10 +13,26 @@ from core.views import (
     RentalCatalogView,
     ProcessOrderView,
     calculate_games,
+    player_ranges_table,
+    news_gallery,
     TwoGamesOnOneBoardView,
     AdditionalProductsView,
     AdditionalProductDetailView,
 )
+
+if settings.ASYNC_VIEWS:
+    # Под ASGI те же страницы отдают асинхронные варианты
+    from core.async_views import (
+        LandingView,
+        AboutView,
+        GameCatalogView,
+        ProductDetailView,
+        RentalCatalogView,
+        ProcessOrderView,
+        news_gallery,
+        TwoGamesOnOneBoardView,
+        AdditionalProductDetailView,
+    )
 # Защита от случайного доступа к админ-панели
 # Используется сложный путь для предотвращения случайного входа
 admin.site.site_header = "Администрирование Bulka Play 2"
@@ -26,13 +42,6 @@ admin.site.index_title = "Панель управления"
 # Сложный путь для админ-панели
 ADMIN_URL = "s3cr3t_4dm1n_bulk4_pl4y2_p4th"
 
-sitemaps = {
-    'products': ProductSitemap,
-    'arendas': ArendaSitemap,
-    'news': NewsSitemap,
-    'static': StaticViewSitemap,
-}
-
 urlpatterns = [
     path(f"{ADMIN_URL}/", admin.site.urls),
     path("", LandingView.as_view(), name="landing"),
@@ -47,15 +56,22 @@ urlpatterns = [
     ),
     path("process_order/", ProcessOrderView.as_view(), name="process_order"),
     path("calculate_games/", calculate_games, name="calculate_games"),
+    path("calculate_games/table/", player_ranges_table, name="player_ranges_table"),
+    path("news/<int:pk>/gallery/", news_gallery, name="news_gallery"),
     path(
         "additional_product_detail/<int:pk>/",
         AdditionalProductDetailView.as_view(),
         name="additional_product_detail",
     ),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    # Видео отдаются приложением и в продакшене: с поддержкой Range и ETag
+    path(f"{settings.MEDIA_URL.strip('/')}/video/<path:path>", serve_video, name="media_video"),
+    # Карта сайта заранее записана на диск (core/sitemaps.py)
+    re_path(r"^(?P<name>sitemap(?:-\d+\.xml\.gz|\.xml))$", serve_sitemap, name="sitemap"),
 ]
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+
+if settings.DEBUG_TOOLBAR:
     urlpatterns += [path('__debug__/', include('debug_toolbar.urls')),]
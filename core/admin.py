@@ -3,6 +3,8 @@ from .models import (
     Product,
     Arenda,
     Order,
+    OrderLine,
+    OrderNotification,
     News,
     ProductImage,
     Size,
@@ -18,6 +20,7 @@ from .models import (
     Discount,
     GameKitItemAdditional,
 )
+from .orders import sync_lines
 
 admin.site.register(ProductImage)
 
@@ -56,14 +59,14 @@ class ProductAdmin(admin.ModelAdmin):
     list_display = ("name", "price", "is_active", "created_at", "is_new", "is_in_stock")
     list_editable = ("is_active", "is_new", "is_in_stock")
     list_filter = ("is_active", "created_at", "is_new", "is_in_stock")
-    search_fields = ("name", "description")
+    search_fields = ("name", "sku", "description")
     filter_horizontal = ("sizes", "player_counts", "game_types", "player_ages")
 
     fieldsets = (
         (
             "Основные поля",
             {
-                "fields": ("name", "description", "price", "image"),
+                "fields": ("name", "sku", "description", "price", "image"),
             },
         ),
         (
@@ -188,28 +191,95 @@ class PlayerRangeAdmin(admin.ModelAdmin):
     search_fields = ("min_players", "max_players")
 
 
+class OrderTotalFilter(admin.SimpleListFilter):
+    title = "Сумма"
+    parameter_name = "total"
+    # Граница диапазона -> (нижняя, верхняя) в рублях
+    RANGES = {
+        "lt5000": (None, 5000),
+        "5000-15000": (5000, 15000),
+        "gte15000": (15000, None),
+    }
+
+    def lookups(self, request, model_admin):
+        return (
+            ("lt5000", "до 5 000 ₽"),
+            ("5000-15000", "5 000 – 15 000 ₽"),
+            ("gte15000", "от 15 000 ₽"),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.RANGES:
+            return queryset
+        low, high = self.RANGES[self.value()]
+        if low is not None:
+            queryset = queryset.filter(total__gte=low)
+        if high is not None:
+            queryset = queryset.filter(total__lt=high)
+        return queryset
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    can_delete = False
+    fields = (
+        "kind",
+        "name",
+        "unit_price",
+        "discount_name",
+        "discounted_price",
+        "quantity",
+        "adjustment",
+        "total",
+    )
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
+    # Состав и сумма хранятся в самом заказе, поэтому страница списка
+    # строится одним запросом без обхода связей каждой строки
     list_display = (
         "name",
         "phone",
         "order_type",
         "created_at",
-        "get_products",
-        "get_games_for_rent",
+        "items_summary",
+        "items_count",
+        "total",
     )
-    list_filter = ("order_type", "created_at")
-    search_fields = ("name", "phone", "comment")
-
-    def get_products(self, obj):
-        return ", ".join([p.name for p in obj.products.all()])
-
-    get_products.short_description = "Выбранные товары"
-
-    def get_games_for_rent(self, obj):
-        return ", ".join([g.name for g in obj.games_for_rent.all()])
-
-    get_games_for_rent.short_description = "Игры для аренды"
+    list_filter = ("order_type", "created_at", OrderTotalFilter)
+    # "^phone" — поиск по началу номера: находит заказ по части телефона
+    # без поиска подстроки по всей колонке
+    search_fields = ("name", "^phone", "comment", "items_summary")
+    readonly_fields = ("items_summary", "items_count", "total")
+    # Позиции с ценами на момент заказа только для просмотра
+    inlines = [OrderLineInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        # Полный номер ищется точным совпадением по индексу, без LIKE по всем
+        # полям; неполный — обычным поиском по началу номера
+        term = search_term.strip()
+        if term and set(term) <= set("+0123456789"):
+            by_phone = queryset.filter(phone=term)
+            if by_phone.exists():
+                return by_phone, False
+        return super().get_search_results(request, queryset, search_term)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        sync_lines(form.instance)
+
+
+@admin.register(OrderNotification)
+class OrderNotificationAdmin(admin.ModelAdmin):
+    list_display = ("order", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status",)
+    readonly_fields = ("order", "created_at", "sent_at", "last_error")
 
 
 @admin.register(News)
@@ -236,7 +306,7 @@ class AdditionalProductsAdmin(admin.ModelAdmin):
     list_display = ("name", "price", "is_active", "created_at", "is_new", "is_in_stock")
     list_editable = ("is_active", "is_new", "is_in_stock")
     list_filter = ("is_active", "created_at", "is_new", "is_in_stock")
-    search_fields = ("name", "description")
+    search_fields = ("name", "sku", "description")
 
     fieldsets = (
         (
@@ -244,6 +314,7 @@ class AdditionalProductsAdmin(admin.ModelAdmin):
             {
                 "fields": (
                     "name",
+                    "sku",
                     "description",
                     "description_2",
                     "material",
@@ -0,0 +1,314 @@
+"""Сборка статики: бандлы CSS/JS, минификация и критический CSS.
+
+BUNDLES перечисляет исходники каждого бандла в порядке подключения в
+шаблонах — от порядка зависит каскад. Команда build_assets склеивает и
+минифицирует их в static/bundles, затем collectstatic через
+StaticFilesStorage добавляет в имена хэш содержимого, пишет манифест и
+сжимает файлы gzip и brotli; WhiteNoise отдаёт такие файлы с бессрочным
+кэшированием. Минификаторы rcssmin и rjsmin необязательны: без них
+бандлы только склеиваются.
+
+Теги {% stylesheet_bundle %} и {% script_bundle %} подключают бандл,
+если он есть в манифесте, иначе — исходники по отдельности (DEBUG или
+сборка ещё не запускалась).
+"""
+
+import functools
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.storage import FileSystemStorage
+from django.template.loader import get_template
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+from . import fonts
+
+# Каталог бандлов внутри static
+BUNDLE_DIR = "bundles"
+
+# Имя бандла -> исходники в порядке подключения
+BUNDLES = {
+    "base.css": [
+        "css/main.css",
+        "css/nav.css",
+        "css/fonts.css",
+        "css/typography.css",
+        "css/pages/landing.css",
+        "css/pages/about.css",
+        "css/carousel.css",
+        "css/footer.css",
+        "css/pages/game_catalog.css",
+        "css/pages/product_detail.css",
+        "css/pages/rental_catalog.css",
+        "css/pages/modal_order.css",
+        "css/news_modal.css",
+        "css/pages/two_games_on_one_board.css",
+        "css/pages/additional_detail.css",
+    ],
+    # Стили страницы подключаются ещё раз после общих: на своей странице
+    # их правила должны перекрывать стили других страниц
+    "landing.css": ["css/pages/landing.css"],
+    "about.css": ["css/pages/about.css"],
+    "game_catalog.css": ["css/pages/game_catalog.css"],
+    "product_detail.css": ["css/pages/product_detail.css"],
+    "additional_product_detail.css": [
+        "css/pages/additional_detail.css",
+        "css/pages/product_detail.css",
+    ],
+    "rental_catalog.css": ["css/pages/rental_catalog.css"],
+    "two_games_on_one_board.css": ["css/pages/two_games_on_one_board.css"],
+    "product_modal.css": ["css/product_modal.css"],
+    "base.js": ["js/main.js", "js/news_modal.js", "js/rental_calculator.js"],
+    "product_modal.js": ["js/product_modal.js"],
+}
+
+# Исходник -> сгенерированная замена, которая идёт в бандл, если собрана
+GENERATED_SOURCES = {fonts.SOURCE_CSS: fonts.OUTPUT_CSS}
+
+# Страница -> (бандлы её стилей, шаблоны первого экрана). Шаблон
+# страницы читается до метки CRITICAL_END
+CRITICAL_PAGES = {
+    "landing": (
+        ["base.css", "landing.css"],
+        ["includes/include_nav_menu.html", "landing.html"],
+    ),
+}
+CRITICAL_END = "{# конец первого экрана #}"
+# Элементы, которые есть на любой странице
+ALWAYS_PRESENT = {"html", "body", "*", ":root"}
+
+_URL_RE = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+_CLASS_RE = re.compile(r"""\bclass\s*=\s*(['"])(.*?)\1""", re.S)
+_ID_RE = re.compile(r"""\bid\s*=\s*(['"])(.*?)\1""", re.S)
+_TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)")
+_TEMPLATE_TAG_RE = re.compile(r"{%.*?%}|{{.*?}}|{#.*?#}", re.S)
+_PSEUDO_RE = re.compile(r"::?[a-zA-Z-]+(\([^)]*\))?|\[[^\]]*\]")
+_SELECTOR_TOKEN_RE = re.compile(r"([.#]?)(-?[_a-zA-Z][_a-zA-Z0-9-]*)")
+
+
+def bundle_path(name):
+    return f"{BUNDLE_DIR}/{name}"
+
+
+def critical_path(page):
+    return f"{BUNDLE_DIR}/critical-{page}.css"
+
+
+def is_built(path):
+    """Есть ли файл в манифесте collectstatic (вне DEBUG)"""
+    if settings.DEBUG:
+        return False
+    hashed_files = getattr(staticfiles_storage, "hashed_files", {})
+    return staticfiles_storage.hash_key(path) in hashed_files
+
+
+def urls(name):
+    """Адреса, которыми подключается бандл: он сам или его исходники"""
+    path = bundle_path(name)
+    if is_built(path):
+        return [staticfiles_storage.url(path)]
+    return [staticfiles_storage.url(source) for source in BUNDLES[name]]
+
+
+def font_preload_urls():
+    """Адреса шрифтов для <link rel="preload">, если они собраны"""
+    paths = [path for path in fonts.preload_paths() if is_built(path)]
+    return [staticfiles_storage.url(path) for path in paths]
+
+
+@functools.cache
+def critical_css(page):
+    """Критический CSS страницы из собранной статики или пустая строка"""
+    path = critical_path(page)
+    if not is_built(path):
+        return ""
+    with staticfiles_storage.open(staticfiles_storage.stored_name(path)) as f:
+        return f.read().decode()
+
+
+# Сборка
+
+
+def minify(kind, text):
+    """Минифицирует CSS или JS; без rcssmin/rjsmin возвращает текст как есть"""
+    try:
+        if kind == "css":
+            from rcssmin import cssmin as minifier
+        else:
+            from rjsmin import jsmin as minifier
+    except ImportError:
+        return text
+    return minifier(text)
+
+
+def minifier_available(kind):
+    return minify(kind, "a {  }") != "a {  }"
+
+
+def _read_source(source):
+    path = finders.find(source)
+    if path is None:
+        raise FileNotFoundError(f"Нет исходника статики {source}")
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _absolute_urls(css, source):
+    # Относительные url() считаются от файла-исходника, а бандл лежит в
+    # другом каталоге: переводим их в абсолютные адреса статики
+    base = posixpath.dirname(source)
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(("/", "data:", "http:", "https:", "#")):
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(base, url))
+        return f"url({quote}{settings.STATIC_URL.rstrip('/')}/{resolved}{quote})"
+
+    return _URL_RE.sub(replace, css)
+
+
+def build_bundle(name):
+    """Склеенный и минифицированный текст бандла и размер исходников"""
+    kind = name.rsplit(".", 1)[1]
+    parts, source_size = [], 0
+    for source in BUNDLES[name]:
+        generated = GENERATED_SOURCES.get(source)
+        if generated and finders.find(generated):
+            source = generated
+        text = _read_source(source)
+        source_size += len(text.encode())
+        if kind == "css":
+            text = _absolute_urls(text, source)
+        # Точка с запятой между файлами: скрипт без неё в конце
+        # склеился бы со следующим
+        parts.append(text if kind == "css" else text.rstrip() + "\n;")
+    return minify(kind, "\n".join(parts)), source_size
+
+
+# Критический CSS
+
+
+def page_tokens(templates):
+    """Теги, классы и id из исходников шаблонов первого экрана"""
+    tokens = set(ALWAYS_PRESENT)
+    for template_name in templates:
+        with open(get_template(template_name).origin.name, encoding="utf-8") as f:
+            source = f.read().split(CRITICAL_END, 1)[0]
+        source = _TEMPLATE_TAG_RE.sub(" ", source)
+        tokens.update(tag.lower() for tag in _TAG_RE.findall(source))
+        for _, value in _CLASS_RE.findall(source):
+            tokens.update("." + name for name in value.split())
+        for _, value in _ID_RE.findall(source):
+            tokens.update("#" + name for name in value.split())
+    return tokens
+
+
+def _split_rules(css):
+    """Правила верхнего уровня: (прелюдия, тело) или (at-правило, None)"""
+    rules, start, depth, quote = [], 0, 0, None
+    body_start = None
+    for index, char in enumerate(css):
+        if quote:
+            if char == quote and css[index - 1] != "\\":
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "{":
+            if depth == 0:
+                body_start = index
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                rules.append((css[start:body_start].strip(), css[body_start + 1 : index]))
+                start = index + 1
+        elif char == ";" and depth == 0:
+            rules.append((css[start:index].strip(), None))
+            start = index + 1
+    return rules
+
+
+def _selector_matches(selector, tokens):
+    selector = _PSEUDO_RE.sub(" ", selector)
+    for compound in re.split(r"[\s>+~]+", selector.strip()):
+        for prefix, name in _SELECTOR_TOKEN_RE.findall(compound):
+            token = prefix + (name if prefix else name.lower())
+            if token not in tokens:
+                return False
+    return True
+
+
+def _critical_rules(css, tokens):
+    kept = []
+    for prelude, body in _split_rules(css):
+        if body is None:
+            continue
+        if prelude.startswith(("@media", "@supports")):
+            inner = _critical_rules(body, tokens)
+            if inner:
+                kept.append(f"{prelude}{{{''.join(inner)}}}")
+        elif prelude.startswith("@"):
+            # @font-face и @keyframes добавляются ниже, по использованию
+            continue
+        elif any(_selector_matches(selector, tokens) for selector in prelude.split(",")):
+            kept.append(f"{prelude}{{{body}}}")
+    return kept
+
+
+def _used_at_rules(css, kept):
+    """@font-face и @keyframes, на которые ссылаются отобранные правила"""
+    text = "".join(kept)
+    families = {
+        family.strip().strip("'\"").lower()
+        for value in re.findall(r"font-family:([^;}]+)", text)
+        for family in value.split(",")
+    }
+    animations = set(re.findall(r"animation(?:-name)?:\s*([-\w]+)", text))
+    used = []
+    for prelude, body in _split_rules(css):
+        if body is None:
+            continue
+        if prelude == "@font-face":
+            match = re.search(r"font-family:\s*['\"]?([^;'\"}]+)", body)
+            if match and match.group(1).strip().lower() in families:
+                used.append(f"{prelude}{{{body}}}")
+        elif prelude.startswith(("@keyframes", "@-webkit-keyframes")):
+            if prelude.split()[-1] in animations:
+                used.append(f"{prelude}{{{body}}}")
+    return used
+
+
+def build_critical(css, templates):
+    """Правила css, которые могут применяться к первому экрану страницы.
+
+    Правило попадает в критический CSS, если все классы, id и теги
+    хотя бы одного его селектора встречаются в шаблонах первого экрана.
+    Отбор по исходникам шаблонов, а не по отрисовке, поэтому берёт
+    с запасом: классы из условных веток шаблона тоже считаются.
+    """
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    kept = _critical_rules(css, page_tokens(templates))
+    # Стили страницы есть и в общем бандле: из повторов остаётся
+    # последний, как в каскаде
+    kept = list(reversed(dict.fromkeys(reversed(kept))))
+    return minify("css", "".join(_used_at_rules(css, kept) + kept))
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """Хэшированные и сжатые файлы WhiteNoise без обязательного манифеста.
+
+    Пока collectstatic не запускался или файла нет в манифесте, адрес
+    строится без хэша, как у обычного хранилища, а не падает с ошибкой.
+    """
+
+    def url(self, name, force=False):
+        try:
+            return super().url(name, force)
+        except ValueError:
+            # Нет записи в манифесте: хэш, посчитанный на лету, указал бы
+            # на файл, которого collectstatic не записал
+            return FileSystemStorage.url(self, name)
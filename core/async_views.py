@@ -0,0 +1,54 @@
+"""Асинхронные варианты страниц для запуска под ASGI.
+
+urls.py подключает их вместо core.views, если включена настройка
+ASYNC_VIEWS (её включает bulka_play_2/asgi.py). Отпечаток страницы,
+проверка 304 и запись кэша страниц читаются без занятия потока; в поток
+уходят только построение страницы и запись заказа — ORM синхронный, и
+все запросы одного ответа выполняются в потоке этого запроса.
+Уведомление о заказе пишется в outbox в транзакции заказа и отправляется
+run_telegram_worker, ответ его не ждёт.
+"""
+
+from asgiref.sync import sync_to_async
+
+from . import views
+from .page_cache import AsyncCachedPageMixin, AsyncConditionalPageMixin, aserve
+
+
+class LandingView(AsyncCachedPageMixin, views.LandingView):
+    pass
+
+
+class AboutView(AsyncCachedPageMixin, views.AboutView):
+    pass
+
+
+class GameCatalogView(AsyncConditionalPageMixin, views.GameCatalogView):
+    pass
+
+
+class ProductDetailView(AsyncConditionalPageMixin, views.ProductDetailView):
+    pass
+
+
+class AdditionalProductDetailView(AsyncConditionalPageMixin, views.AdditionalProductDetailView):
+    pass
+
+
+class RentalCatalogView(AsyncCachedPageMixin, views.RentalCatalogView):
+    pass
+
+
+class TwoGamesOnOneBoardView(AsyncCachedPageMixin, views.TwoGamesOnOneBoardView):
+    pass
+
+
+class ProcessOrderView(views.ProcessOrderView):
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(views.order_response)(request.POST)
+
+
+async def news_gallery(request, pk):
+    return await aserve(
+        request, ("news",), sync_to_async(lambda: views.render_news_gallery(request, pk))
+    )
@@ -0,0 +1,52 @@
+"""Фоновая перестройка производных данных (карта сайта, рекомендации)."""
+
+import logging
+import threading
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class Rebuilder:
+    """Фоновая перестройка: один поток, изменения за проход копятся в флаг"""
+
+    def __init__(self, name, build, description):
+        self.name = name
+        self.build = build
+        # Что перестраивается — для журнала ошибок
+        self.description = description
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._running = False
+        self._thread = None
+
+    def schedule(self):
+        with self._lock:
+            self._dirty = True
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._dirty:
+                        self._running = False
+                        return
+                    self._dirty = False
+                try:
+                    self.build()
+                except Exception:
+                    logger.exception("Не удалось перестроить %s", self.description)
+        finally:
+            # У потока своё соединение с базой, его нужно закрыть
+            connection.close()
@@ -0,0 +1,267 @@
+"""Общие инструменты для команд-бенчмарков.
+
+Бенчмарки работают во временной базе, которая создаётся рядом с рабочей и
+удаляется после замера, поэтому их можно запускать и на боевом сервере.
+"""
+
+import contextlib
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from . import pricing, recommendations, sitemaps
+
+
+# Отдельный кэш, чтобы версии и страницы синтетического каталога не
+# попали в общий кэш работающего сайта
+ISOLATED_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmarks",
+    }
+}
+
+
+@contextlib.contextmanager
+def throwaway_database():
+    """Создаёт временную файловую базу SQLite со всеми миграциями.
+
+    Файловая (а не in-memory) база нужна, чтобы её видели все потоки
+    бенчмарка. На время замера кэш подменяется локальным, а карта сайта
+    пишется во временный каталог.
+    """
+    with tempfile.TemporaryDirectory(
+        prefix="bench_sitemap_", ignore_cleanup_errors=True
+    ) as sitemap_root, override_settings(CACHES=ISOLATED_CACHES, SITEMAP_ROOT=sitemap_root):
+        # Локальный кэш живёт до конца процесса: версии прошлой временной
+        # базы не должны достаться следующей
+        cache.clear()
+        try:
+            with _throwaway_database() as path:
+                try:
+                    yield path
+                finally:
+                    # Фоновые карта сайта, рекомендации и цены читают временную базу
+                    sitemaps.wait_for_rebuild()
+                    recommendations.wait_for_rebuild()
+                    pricing.wait_for_refresh()
+        finally:
+            cache.clear()
+
+
+@contextlib.contextmanager
+def _throwaway_database():
+    fd, path = tempfile.mkstemp(prefix="bench_", suffix=".sqlite3")
+    os.close(fd)
+    settings_dict = connection.settings_dict
+    old_test_settings = settings_dict.get("TEST", {})
+    settings_dict["TEST"] = {**old_test_settings, "NAME": path}
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield path
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        settings_dict["TEST"] = old_test_settings
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+class Measurement:
+    """Время и SQL-запросы одного вызова"""
+
+    def __init__(self, seconds, queries):
+        self.seconds = seconds
+        self.queries = queries
+
+
+def measure(func, *args, **kwargs):
+    """Выполняет func и возвращает (результат, Measurement)"""
+    with CaptureQueriesContext(connection) as captured:
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - started
+    return result, Measurement(seconds, len(captured.captured_queries))
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+WORDS = (
+    "шахматы шашки нарды домино лото башня лабиринт головоломка пазл мозаика "
+    "кубик пирамида дуб берёза сосна клён логика стратегия память семья"
+).split()
+
+
+def _bulk_link(field, pairs):
+    """Пакетно заполняет связующую таблицу ManyToMany-поля field"""
+    through = field.remote_field.through
+    source = field.m2m_field_name() + "_id"
+    target = field.m2m_reverse_field_name() + "_id"
+    through.objects.bulk_create(
+        (through(**{source: a, target: b}) for a, b in pairs), batch_size=5000
+    )
+
+
+def populate_catalog(products, seed=1):
+    """Заполняет пустую базу синтетическим каталогом из products игр.
+
+    Кроме игр создаются значения фильтров и связи с ними, фото, аренды,
+    допы, новости, диапазоны игроков, пересекающиеся скидки и заказы.
+    Всё пишется пакетными вставками без сигналов, поэтому поисковый
+    индекс перестраивается в конце отдельно.
+    """
+    from . import search
+    from .models import (
+        AdditionalProducts,
+        Arenda,
+        Discount,
+        GameType,
+        News,
+        NewsImage,
+        Order,
+        PlayerAge,
+        PlayerCount,
+        PlayerRange,
+        Product,
+        ProductImage,
+        Size,
+    )
+
+    rng = random.Random(seed)
+
+    def text(words):
+        return " ".join(rng.choice(WORDS) for _ in range(words))
+
+    sizes = Size.objects.bulk_create(Size(name=f"{n}x{n} см") for n in (30, 40, 46, 60))
+    counts = PlayerCount.objects.bulk_create(PlayerCount(count=n) for n in range(2, 9))
+    ages = PlayerAge.objects.bulk_create(PlayerAge(age=f"{n}+") for n in (3, 6, 10, 14))
+    types = GameType.objects.bulk_create(
+        GameType(name=name) for name in ("Логическая", "Семейная", "Стратегия", "На ловкость")
+    )
+
+    Product.objects.bulk_create(
+        (
+            Product(
+                name=f"{text(2).capitalize()} {i}",
+                description=text(30),
+                game_rules=text(40),
+                additional_info=text(8),
+                price=Decimal(rng.randrange(1000, 20000)),
+                image="products/x.jpg",
+                is_new=rng.random() < 0.1,
+                is_active=rng.random() < 0.95,
+            )
+            for i in range(products)
+        ),
+        batch_size=2000,
+    )
+    product_ids = list(Product.objects.values_list("pk", flat=True))
+
+    for field, values, per_product in (
+        (Product._meta.get_field("sizes"), sizes, 2),
+        (Product._meta.get_field("player_counts"), counts, 3),
+        (Product._meta.get_field("player_ages"), ages, 1),
+        (Product._meta.get_field("game_types"), types, 2),
+    ):
+        _bulk_link(
+            field,
+            (
+                (pk, value.pk)
+                for pk in product_ids
+                for value in rng.sample(values, per_product)
+            ),
+        )
+    ProductImage.objects.bulk_create(
+        (ProductImage(product_id=pk, image="product_images/x.jpg") for pk in product_ids for _ in range(2)),
+        batch_size=5000,
+    )
+
+    Arenda.objects.bulk_create(
+        Arenda(
+            name=f"Аренда {i}",
+            description=text(20),
+            price=Decimal(rng.randrange(3000, 15000)),
+            image="products/a.jpg",
+            game_count=rng.randrange(3, 15),
+        )
+        for i in range(max(3, products // 100))
+    )
+    arenda_ids = list(Arenda.objects.values_list("pk", flat=True))
+    AdditionalProducts.objects.bulk_create(
+        (
+            AdditionalProducts(
+                name=f"Доп {i}",
+                description=text(15),
+                price=Decimal(rng.randrange(300, 3000)),
+                image="products/b.jpg",
+            )
+            for i in range(max(5, products // 20))
+        ),
+        batch_size=2000,
+    )
+    additional_ids = list(AdditionalProducts.objects.values_list("pk", flat=True))
+
+    news_items = News.objects.bulk_create(
+        News(name=f"Мероприятие {i}", image="news/n.jpg") for i in range(10)
+    )
+    NewsImage.objects.bulk_create(
+        NewsImage(news=news, image="news/m.jpg") for news in news_items for _ in range(10)
+    )
+
+    PlayerRange.objects.bulk_create(
+        PlayerRange(min_players=low, max_players=high, min_game_count=low // 3 + 1, max_game_count=high // 2)
+        for low, high in ((2, 5), (6, 10), (11, 15), (16, 25), (26, 100))
+    )
+
+    # Две действующие скидки с общими товарами и одна истёкшая
+    today = timezone.localdate()
+    discounts = (
+        ("Сезонная", "percentage", 15, 0.3, today - timedelta(days=5), today + timedelta(days=5)),
+        ("Фиксированная", "fixed", 500, 0.2, today - timedelta(days=1), today + timedelta(days=30)),
+        ("Прошлая", "percentage", 50, 0.5, today - timedelta(days=60), today - timedelta(days=30)),
+    )
+    for name, kind, value, share, start, end in discounts:
+        discount = Discount.objects.create(
+            name=name, discount_type=kind, value=Decimal(value), start_date=start, end_date=end
+        )
+        _bulk_link(
+            Discount._meta.get_field("products"),
+            ((discount.pk, pk) for pk in product_ids if rng.random() < share),
+        )
+        _bulk_link(
+            Discount._meta.get_field("arendas"),
+            ((discount.pk, pk) for pk in arenda_ids if rng.random() < share),
+        )
+        _bulk_link(
+            Discount._meta.get_field("additional_products"),
+            ((discount.pk, pk) for pk in additional_ids if rng.random() < share),
+        )
+
+    orders = Order.objects.bulk_create(
+        (
+            Order(name=f"Клиент {i}", phone="+79990000000", order_type=rng.choice(("buy", "rent")))
+            for i in range(max(10, products // 10))
+        ),
+        batch_size=2000,
+    )
+    _bulk_link(
+        Order._meta.get_field("products"),
+        ((order.pk, pk) for order in orders for pk in rng.sample(product_ids, min(2, len(product_ids)))),
+    )
+
+    search.rebuild_index()
@@ -0,0 +1,113 @@
+"""Кэшированные HTML-фрагменты карточек товаров, аренды и допов.
+
+Карточка вида variant рендерится шаблоном includes/cards/<variant>.html и
+хранится в кэше по ключу из позиции (модель, pk, updated_at), дня и версии
+скидок, версии копий изображений и сборки шаблонов. Ключ меняется вместе
+со всем, что влияет на разметку, поэтому фрагменты не сбрасываются
+явно — старые просто истекают.
+
+Список карточек читает все фрагменты одним get_many и рендерит только
+недостающие. Фрагменты, уже прочитанные воркером, лежат и в его памяти:
+по ключу содержимое не меняется, так что повторная страница собирается
+склейкой строк без обращения к кэшу.
+
+static_fragment — то же для неизменных между выкладками шаблонов
+(меню, подвал): они рендерятся один раз на сборку. В DEBUG фрагменты
+не кэшируются.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .page_cache import build_info
+from .pricing import get_discount_table
+from .renditions import RENDITIONS_NAMESPACE
+from .versioning import get_version
+
+CARD_TIMEOUT = 60 * 60 * 24 * 7
+# Сколько фрагментов воркер держит в памяти
+LOCAL_LIMIT = 5000
+
+# Страница подробностей позиции по её модели
+DETAIL_URLS = {
+    "product": "product_detail",
+    "additionalproducts": "additional_product_detail",
+}
+
+_local = {}
+
+
+def _remember(key, html):
+    if len(_local) >= LOCAL_LIMIT:
+        _local.clear()
+    _local[key] = html
+
+
+def _card_key(variant, item, epoch):
+    raw = f"{variant}:{item._meta.model_name}:{item.pk}:{item.updated_at.isoformat()}:{epoch}"
+    return "card:" + hashlib.md5(raw.encode()).hexdigest()
+
+
+def _render(template, item, table):
+    return template.render(
+        {
+            "item": item,
+            "price": table.resolve(item),
+            "kind": item._meta.model_name,
+            "detail_url": DETAIL_URLS.get(item._meta.model_name),
+        }
+    )
+
+
+def render_cards(items, variant):
+    """HTML карточек items вида variant одной строкой"""
+    items = list(items)
+    if not items:
+        return ""
+    table = get_discount_table()
+    template = get_template(f"includes/cards/{variant}.html")
+    if settings.DEBUG:
+        # При разработке шаблоны меняются без смены сборки
+        return mark_safe("".join(_render(template, item, table) for item in items))
+    # День входит отдельно: в полночь цены меняются раньше, чем фоновый
+    # пересчёт поднимет версию скидок
+    epoch = (
+        f"{table.day.isoformat()}:{table.version}:"
+        f"{get_version(RENDITIONS_NAMESPACE)}:{build_info()[0]}"
+    )
+    keys = [_card_key(variant, item, epoch) for item in items]
+
+    # Одно обращение на ключ: между "in" и [key] другой поток мог очистить _local
+    found = {}
+    for key in keys:
+        html = _local.get(key)
+        if html is not None:
+            found[key] = html
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key, html in cache.get_many(missing).items():
+            found[key] = html
+            _remember(key, html)
+
+    rendered = {}
+    for key, item in zip(keys, items):
+        if key not in found:
+            found[key] = rendered[key] = _render(template, item, table)
+            _remember(key, found[key])
+    if rendered:
+        cache.set_many(rendered, CARD_TIMEOUT)
+    return mark_safe("".join(found[key] for key in keys))
+
+
+def static_fragment(template_name):
+    """HTML шаблона без переменных контекста, один раз на сборку"""
+    key = f"fragment:{template_name}:{build_info()[0]}"
+    html = _local.get(key)
+    if html is None or settings.DEBUG:
+        html = get_template(template_name).render({})
+        _remember(key, html)
+    return mark_safe(html)
@@ -0,0 +1,152 @@
+"""Неизменяемый снимок каталога, общий для всех публичных страниц.
+
+Снимок строится один раз на воркер и перестраивается только тогда, когда
+сигнал об изменении модели каталога меняет версию каталога. Цены со скидками
+пересчитываются отдельно, при смене таблицы скидок, без перечитывания
+каталога.
+"""
+
+import dataclasses
+import threading
+from functools import cached_property
+from typing import Optional
+
+from .facets import FACETS, FacetIndex
+from .pricing import get_discount_table
+from .versioning import bump_version, get_version
+
+CATALOG_NAMESPACE = "catalog"
+
+
+@dataclasses.dataclass(frozen=True)
+class CatalogSnapshot:
+    version: str
+    # Активные позиции в порядке "-created_at", как их показывает сайт
+    products: tuple
+    arenda: tuple
+    additional_products: tuple
+    # Значения фильтров каталога игр
+    sizes: tuple
+    player_counts: tuple
+    player_ages: tuple
+    game_types: tuple
+    # param фильтра -> пары (pk товара, pk значения) для активных товаров
+    facet_links: dict = dataclasses.field(default_factory=dict)
+    # Таблица скидок, по которой посчитаны prices
+    discount_table: Optional[object] = None
+    # (model_name, pk) -> ResolvedPrice
+    prices: dict = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def load(cls, version):
+        from .models import (
+            AdditionalProducts,
+            Arenda,
+            GameType,
+            PlayerAge,
+            PlayerCount,
+            Product,
+            Size,
+        )
+
+        return cls(
+            version=version,
+            products=tuple(
+                Product.objects.filter(is_active=True).order_by("-created_at")
+            ),
+            arenda=tuple(
+                Arenda.objects.filter(is_active=True)
+                .select_related("specific_game")
+                .order_by("-created_at")
+            ),
+            additional_products=tuple(
+                AdditionalProducts.objects.filter(is_active=True).order_by(
+                    "-created_at"
+                )
+            ),
+            sizes=tuple(Size.objects.all()),
+            player_counts=tuple(PlayerCount.objects.all()),
+            player_ages=tuple(PlayerAge.objects.all()),
+            game_types=tuple(GameType.objects.all()),
+            facet_links={
+                param: _facet_links(getattr(Product, field).field)
+                for param, field, _ in FACETS
+            },
+        )
+
+    def with_prices(self, discount_table):
+        """Возвращает копию снимка с ценами, посчитанными по discount_table"""
+        prices = {}
+        for items in (self.products, self.arenda, self.additional_products):
+            prices.update(discount_table.resolve_many(items))
+        return dataclasses.replace(self, discount_table=discount_table, prices=prices)
+
+    def price_of(self, item):
+        """Цена позиции со скидкой (ResolvedPrice)"""
+        resolved = self.prices.get((item._meta.model_name, item.pk))
+        if resolved is None:
+            resolved = self.discount_table.resolve(item)
+        return resolved
+
+    @cached_property
+    def facet_index(self):
+        return FacetIndex.build(
+            self.products,
+            {
+                "size": self.sizes,
+                "players": self.player_counts,
+                "age": self.player_ages,
+                "type": self.game_types,
+            },
+            self.facet_links,
+        )
+
+    @cached_property
+    def products_by_pk(self):
+        return {product.pk: product for product in self.products}
+
+    @cached_property
+    def additional_products_by_pk(self):
+        return {item.pk: item for item in self.additional_products}
+
+
+def _facet_links(field):
+    """Пары (pk товара, pk значения) связующей таблицы фильтра одним запросом"""
+    return tuple(
+        field.remote_field.through.objects.filter(product__is_active=True).values_list(
+            "product_id", f"{field.m2m_reverse_field_name()}_id"
+        )
+    )
+
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+def get_catalog():
+    """Возвращает актуальный снимок каталога"""
+    global _snapshot
+    version = get_version(CATALOG_NAMESPACE)
+    discount_table = get_discount_table()
+
+    snapshot = _snapshot
+    if (
+        snapshot is not None
+        and snapshot.version == version
+        and snapshot.discount_table is discount_table
+    ):
+        return snapshot
+
+    with _lock:
+        snapshot = _snapshot
+        if snapshot is None or snapshot.version != version:
+            snapshot = CatalogSnapshot.load(version)
+        if snapshot.discount_table is not discount_table:
+            snapshot = snapshot.with_prices(discount_table)
+        _snapshot = snapshot
+    return snapshot
+
+
+def invalidate_catalog():
+    """Сбрасывает снимок каталога во всех воркерах"""
+    bump_version(CATALOG_NAMESPACE)
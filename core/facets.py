@@ -0,0 +1,100 @@
+"""Фасетный индекс каталога игр.
+
+Каждому значению фильтра (размер, количество игроков, возраст, вид игры)
+соответствует битовая маска товаров: бит i означает i-й товар снимка
+каталога. Фильтрация — побитовое И масок, количество игр для каждого
+варианта фильтра — число единиц в маске. Индекс строится из снимка
+каталога и перестраивается вместе с ним.
+"""
+
+from typing import NamedTuple
+
+# GET-параметр, поле Product и атрибут, из которого берётся значение фильтра
+FACETS = (
+    ("size", "sizes", "name"),
+    ("players", "player_counts", "count"),
+    ("age", "player_ages", "age"),
+    ("type", "game_types", "name"),
+)
+
+
+class FacetOption(NamedTuple):
+    value: str
+    count: int
+    selected: bool
+
+
+class FacetIndex:
+    def __init__(self, products, masks):
+        self.products = products
+        self.all_mask = (1 << len(products)) - 1
+        self._position = {product.pk: i for i, product in enumerate(products)}
+        # param -> {значение: маска}, значения в порядке вывода в фильтре
+        self._masks = masks
+
+    @classmethod
+    def build(cls, products, values, links):
+        """Строит индекс.
+
+        values — param -> объекты значений фильтра (Size, PlayerCount, ...),
+        links — param -> пары (pk товара, pk значения) из связующей таблицы.
+        """
+        position = {product.pk: i for i, product in enumerate(products)}
+        masks = {}
+        for param, _, attr in FACETS:
+            by_pk = {obj.pk: str(getattr(obj, attr)) for obj in values[param]}
+            param_masks = dict.fromkeys(by_pk.values(), 0)
+            for product_id, value_id in links[param]:
+                index = position.get(product_id)
+                if index is not None and value_id in by_pk:
+                    param_masks[by_pk[value_id]] |= 1 << index
+            masks[param] = param_masks
+        return cls(products, masks)
+
+    def mask_for_pks(self, pks):
+        """Маска товаров с указанными pk (например, результата поиска)"""
+        mask = 0
+        for pk in pks:
+            index = self._position.get(pk)
+            if index is not None:
+                mask |= 1 << index
+        return mask
+
+    def filter(self, selected, base_mask=None):
+        """Маска товаров, подходящих под все выбранные фильтры.
+
+        selected — param -> значение из GET; пустые значения не фильтруют.
+        """
+        mask = self.all_mask if base_mask is None else base_mask
+        for param, value in selected.items():
+            if value:
+                mask &= self._masks.get(param, {}).get(value, 0)
+        return mask
+
+    def options(self, selected, base_mask=None):
+        """Варианты каждого фильтра с количеством подходящих игр.
+
+        Для фильтра считается число игр при его варианте и остальных уже
+        выбранных фильтрах — столько игр и покажет каталог, если выбрать
+        этот вариант.
+        """
+        result = {}
+        for param, _, _ in FACETS:
+            others = {key: value for key, value in selected.items() if key != param}
+            mask = self.filter(others, base_mask)
+            result[param] = [
+                FacetOption(value, (mask & option_mask).bit_count(), value == selected.get(param))
+                for value, option_mask in self._masks[param].items()
+            ]
+        return result
+
+    def items(self, mask):
+        """Товары маски в порядке снимка каталога"""
+        bits = bin(mask)[:1:-1]
+        products = self.products
+        result = []
+        index = bits.find("1")
+        while index != -1:
+            result.append(products[index])
+            index = bits.find("1", index + 1)
+        return result
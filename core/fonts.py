@@ -0,0 +1,146 @@
+"""Подмножества шрифтов сайта.
+
+Команда subset_fonts читает @font-face из css/fonts.css, собирает
+символы, которые встречаются в шаблонах, скриптах и текстах каталога, и
+для каждого начертания пишет woff2 только с этими глифами — отдельно
+для латиницы и кириллицы — в static/fonts. Получившийся fonts/fonts.css
+с unicode-range и font-display: swap build_assets кладёт в общий бандл
+вместо исходного: браузер загружает только нужные ему части.
+
+Базовая латиница и кириллица входят в подмножества всегда, чтобы новый
+товар не показал буквы запасным шрифтом до следующей сборки.
+"""
+
+import functools
+import re
+
+from django.contrib.staticfiles import finders
+
+SOURCE_CSS = "css/fonts.css"
+OUTPUT_DIR = "fonts"
+OUTPUT_CSS = f"{OUTPUT_DIR}/fonts.css"
+
+# Части шрифта: имя -> диапазоны кодов символов
+SUBSETS = {
+    "latin": [
+        (0x0000, 0x00FF),
+        (0x0131, 0x0131),
+        (0x0152, 0x0153),
+        (0x02C6, 0x02C6),
+        (0x02DA, 0x02DA),
+        (0x02DC, 0x02DC),
+        (0x2000, 0x206F),
+        (0x20AC, 0x20AC),
+        (0x2122, 0x2122),
+        (0x2212, 0x2212),
+    ],
+    "cyrillic": [
+        # Ударение и бреве: «й», набранная как «и» с бреве
+        (0x0301, 0x0301),
+        (0x0306, 0x0306),
+        (0x0400, 0x045F),
+        (0x0490, 0x0491),
+        (0x04B0, 0x04B1),
+        (0x20BD, 0x20BD),
+        (0x2116, 0x2116),
+    ],
+}
+# Символы, которые нужны всегда, даже если их пока нет в текстах
+ALWAYS = {chr(code) for code in [*range(0x20, 0x7F), 0xA0, *range(0x400, 0x460)]}
+
+# Модели, тексты которых выводятся на страницах
+CATALOG_MODELS = [
+    "Size",
+    "GameType",
+    "PlayerAge",
+    "GameKitItem",
+    "GameKitItemAdditional",
+    "Product",
+    "AdditionalProducts",
+    "Arenda",
+    "News",
+    "Discount",
+]
+
+# Начертания первого экрана (заголовок и текст главной): их кириллица
+# загружается сразу, не дожидаясь CSS
+PRELOAD_FACES = [("Unbounded", 700, "normal"), ("Mont", 400, "normal")]
+
+_FACE_RE = re.compile(r"@font-face\s*{([^}]*)}")
+_DESCRIPTOR_RE = re.compile(r"([-a-z]+)\s*:\s*([^;]+)")
+_WOFF2_RE = re.compile(r"""url\(\s*['"]?([^'")]+\.woff2)['"]?\s*\)""")
+
+
+def parse_faces(css):
+    """@font-face из css: словари с family, weight, style, src и остальными описателями"""
+    faces = []
+    for body in _FACE_RE.findall(css):
+        descriptors = {
+            name.strip(): value.strip() for name, value in _DESCRIPTOR_RE.findall(body)
+        }
+        weights = [int(value) for value in descriptors.get("font-weight", "400").split()]
+        faces.append(
+            {
+                "family": descriptors["font-family"].strip("'\""),
+                "weight": (weights[0], weights[-1]),
+                "style": descriptors.get("font-style", "normal"),
+                "src": _WOFF2_RE.findall(descriptors.get("src", "")),
+                "unicode_range": descriptors.get("unicode-range"),
+            }
+        )
+    return faces
+
+
+def face_for(faces, family, weight, style):
+    """Начертание, которое браузер выберет: из подходящих — последнее в CSS"""
+    matching = [
+        face
+        for face in faces
+        if face["family"] == family
+        and face["style"] == style
+        and face["weight"][0] <= weight <= face["weight"][1]
+    ]
+    return matching[-1] if matching else None
+
+
+def subset_of(char):
+    code = ord(char)
+    for name, ranges in SUBSETS.items():
+        if any(start <= code <= end for start, end in ranges):
+            return name
+    return "other"
+
+
+def unicode_range(codes):
+    """Значение unicode-range для набора кодов: U+41-5A,U+430,..."""
+    parts, codes = [], sorted(codes)
+    start = previous = codes[0]
+    for code in codes[1:] + [None]:
+        if code is not None and code == previous + 1:
+            previous = code
+            continue
+        parts.append(f"U+{start:X}" if start == previous else f"U+{start:X}-{previous:X}")
+        if code is not None:
+            start = previous = code
+    return ",".join(parts)
+
+
+def static_path(url):
+    """Имя файла статики по адресу /static/... из CSS"""
+    return url.split("/static/", 1)[1]
+
+
+@functools.cache
+def preload_paths():
+    """Файлы статики с кириллицей начертаний PRELOAD_FACES, если шрифты собраны"""
+    path = finders.find(OUTPUT_CSS)
+    if path is None:
+        return []
+    with open(path, encoding="utf-8") as f:
+        faces = [face for face in parse_faces(f.read()) if ".cyrillic." in "".join(face["src"])]
+    paths = []
+    for family, weight, style in PRELOAD_FACES:
+        face = face_for(faces, family, weight, style)
+        if face is not None:
+            paths.append(static_path(face["src"][0]))
+    return paths
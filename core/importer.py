@@ -0,0 +1,623 @@
+"""Потоковый импорт прайс-листов CSV/XLSX в Product и AdditionalProducts.
+
+Строки читаются по одной и обрабатываются пачками: для пачки одним
+запросом выбираются уже известные позиции по артикулу (sku), меняются
+только поля из колонок файла, которые действительно отличаются, и всё
+пишется через bulk_create/bulk_update. Поэтому память не растёт с
+размером файла, а число запросов — один-два на пачку, а не на строку.
+
+Значения фильтров (размеры, количество игроков, возрасты, виды игр)
+сопоставляются через словари, загруженные один раз на импорт; новые
+значения создаются при первой встрече. Массовые операции не вызывают
+сигналы, поэтому цены со скидками, кэши каталога, страниц и поисковый
+индекс обновляются один раз в конце импорта (и если он прервался).
+
+Каждая пачка коммитится отдельной транзакцией: блокировка записи SQLite
+держится на одну пачку, и заказы не ждут весь импорт. Запуск записывается
+в PriceListImport вместе с числом применённых строк, а каждая изменённая
+позиция — в PriceListImportChange с прежними значениями. Прерванный
+импорт того же файла продолжается с resume=True, а rollback_import
+возвращает позиции к состоянию до запуска. dry_run откатывает каждую
+пачку и запуск не записывает.
+"""
+
+import csv
+import hashlib
+import io
+import posixpath
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import renditions, search, sitemaps
+from .catalog import invalidate_catalog
+from .models import (
+    AdditionalProducts,
+    GameType,
+    PlayerAge,
+    PlayerCount,
+    PriceListImport,
+    PriceListImportChange,
+    Product,
+    Size,
+)
+from .page_cache import invalidate_pages
+from .pricing import refresh_effective_prices
+
+CHUNK_SIZE = 1000
+# Разделитель нескольких значений фильтра в одной ячейке: "2; 4; 6"
+MULTI_VALUE_SEPARATOR = ";"
+
+# Колонки, которые можно загрузить, для каждой модели
+IMPORT_FIELDS = {
+    Product: (
+        "name", "description", "price", "image", "is_new", "is_in_stock",
+        "is_active", "game_rules", "additional_info",
+    ),
+    AdditionalProducts: (
+        "name", "description", "description_2", "material", "price",
+        "price_prefix", "image", "is_new", "is_in_stock", "is_active",
+    ),
+}
+# Поля, без которых новую позицию не создать
+REQUIRED_FIELDS = ("name", "price")
+# Пустая ячейка в этих колонках не стирает значение, а оставляет текущее
+KEEP_IF_EMPTY = ("name", "price", "image")
+
+# M2M-поле товара -> (модель значения, поле с текстом значения)
+FACET_FIELDS = {
+    "sizes": (Size, "name"),
+    "player_counts": (PlayerCount, "count"),
+    "player_ages": (PlayerAge, "age"),
+    "game_types": (GameType, "name"),
+}
+
+TRUE_VALUES = {"1", "да", "true", "yes", "y", "+", "есть"}
+FALSE_VALUES = {"0", "нет", "false", "no", "n", "-", ""}
+
+
+class PriceListError(Exception):
+    """Файл нельзя импортировать целиком (нет колонки артикула, неизвестный формат)"""
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deactivated: int = 0
+    facet_values_created: int = 0
+    # (номер строки, сообщение); номер считается с заголовком как строкой 1
+    errors: list = field(default_factory=list)
+
+
+def read_csv(file, delimiter=None):
+    """Строки CSV как словари; разделитель определяется по заголовку"""
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    header = text.readline()
+    if delimiter is None:
+        delimiter = ";" if header.count(";") > header.count(",") else ","
+    columns = next(csv.reader([header], delimiter=delimiter))
+    yield from csv.DictReader(text, fieldnames=columns, delimiter=delimiter)
+
+
+def read_xlsx(file):
+    """Строки первого листа XLSX как словари; нужен openpyxl"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError as error:
+        raise PriceListError("Для чтения XLSX установите openpyxl") from error
+
+    # read_only читает лист потоком, не загружая книгу в память целиком
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        columns = [str(value or "").strip() for value in next(rows, ())]
+        for values in rows:
+            if any(value is not None for value in values):
+                yield dict(zip(columns, values))
+    finally:
+        workbook.close()
+
+
+def file_checksum(file):
+    """SHA-256 файла; читает его потоком и возвращает в начало"""
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def read_rows(path, file):
+    extension = posixpath.splitext(path)[1].lower()
+    if extension == ".csv":
+        return read_csv(file)
+    if extension == ".xlsx":
+        return read_xlsx(file)
+    raise PriceListError(f"Неизвестный формат файла {extension or path}: нужен .csv или .xlsx")
+
+
+def _column_map(model, columns):
+    """Заголовок файла -> поле модели; понимает и имя поля, и verbose_name"""
+    names = {"sku": "sku"}
+    for name in IMPORT_FIELDS[model]:
+        names[name] = name
+    if model is Product:
+        names.update({name: name for name in FACET_FIELDS})
+    for name in list(names.values()):
+        names[str(model._meta.get_field(name).verbose_name)] = name
+
+    lookup = {key.lower(): value for key, value in names.items()}
+    return {
+        column: lookup[column.strip().lower()]
+        for column in columns
+        if column and column.strip().lower() in lookup
+    }
+
+
+def _text(value):
+    if value is None:
+        return ""
+    # XLSX отдаёт целые числа как float: 4.0 -> "4"
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _parse_price(value):
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value)).quantize(Decimal("0.01"))
+    text = _text(value).replace("\xa0", "").replace(" ", "").replace(",", ".")
+    try:
+        return Decimal(text).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise ValueError(f"не удалось разобрать цену {value!r}")
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = _text(value).lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"не удалось разобрать флаг {value!r}")
+
+
+def _parse(name, value):
+    if name == "price":
+        return _parse_price(value)
+    if name.startswith("is_"):
+        return _parse_bool(value)
+    return _text(value)
+
+
+def _stored(value):
+    """Значение поля в виде, пригодном для JSON и обратного присваивания"""
+    return value.name if hasattr(value, "name") and hasattr(value, "storage") else value
+
+
+def _same(current, value):
+    # Пустые текстовые поля в базе бывают и NULL, и "" — это одно и то же
+    if current is None:
+        current = ""
+    return current == value
+
+
+class FacetLookup:
+    """Значения фильтров, загруженные один раз: текст -> pk"""
+
+    def __init__(self):
+        self.values = {}
+        for name, (model, attr) in FACET_FIELDS.items():
+            self.values[name] = {
+                str(value).strip().lower(): pk
+                for pk, value in model.objects.values_list("pk", attr)
+            }
+        self.created = 0
+
+    def resolve(self, name, cell):
+        model, attr = FACET_FIELDS[name]
+        pks = set()
+        for raw in _text(cell).split(MULTI_VALUE_SEPARATOR):
+            value = raw.strip()
+            if not value:
+                continue
+            key = value.lower()
+            pk = self.values[name].get(key)
+            if pk is None:
+                if attr == "count":
+                    try:
+                        value = int(value)
+                    except ValueError:
+                        raise ValueError(f"количество игроков {raw!r} не число")
+                # bulk_create не вызывает сигналы: кэш сбросится один раз после импорта
+                pk = model.objects.bulk_create([model(**{attr: value})])[0].pk
+                self.values[name][key] = pk
+                self.created += 1
+            pks.add(pk)
+        return pks
+
+
+class PriceListImporter:
+    def __init__(self, model=Product, chunk_size=CHUNK_SIZE, deactivate_missing=False):
+        if model not in IMPORT_FIELDS:
+            raise PriceListError(f"Импорт в {model.__name__} не поддерживается")
+        self.model = model
+        self.chunk_size = chunk_size
+        self.deactivate_missing = deactivate_missing
+        self.result = ImportResult()
+        self.touched = []
+        self.images = []
+        self.seen = set()
+        self._reported_errors = 0
+
+    def run(self, rows, dry_run=False, file_name="", checksum="", resume=False):
+        """Импортирует строки пачками, каждую в своей транзакции.
+
+        resume продолжает последний прерванный запуск с тем же файлом
+        (по checksum): уже применённые строки пропускаются.
+        """
+        self.dry_run = dry_run
+        self.facets = FacetLookup() if self.model is Product else None
+        self.record = None
+        try:
+            chunk = []
+            columns = None
+            skip = 0
+            for number, row in enumerate(rows, start=2):
+                if columns is None:
+                    columns = _column_map(self.model, row.keys())
+                    if "sku" not in columns.values():
+                        raise PriceListError("В файле нет колонки с артикулом (sku)")
+                    if not dry_run:
+                        self.record = self._start(file_name, checksum, resume)
+                        skip = self.record.rows
+                values = {columns[key]: value for key, value in row.items() if key in columns}
+                if number - 2 < skip:
+                    # Строка применена прерванным запуском; артикул нужен для
+                    # проверки повторов и --deactivate-missing
+                    self.seen.add(_text(values.get("sku")))
+                    continue
+                chunk.append((number, values))
+                if len(chunk) >= self.chunk_size:
+                    self._commit(chunk)
+                    chunk = []
+            if chunk:
+                self._commit(chunk)
+            if self.deactivate_missing:
+                self._deactivate_missing()
+            if self.facets is not None:
+                self.result.facet_values_created = self.facets.created
+        except BaseException as error:
+            if self.record is not None:
+                self._finish(PriceListImport.Status.FAILED, repr(error))
+            raise
+        finally:
+            if self.touched:
+                # Применённые пачки уже в базе, даже если импорт прервался
+                refresh_derived(self.model, self.touched, self.images)
+        if self.record is not None:
+            self._finish(PriceListImport.Status.COMPLETED)
+        return self.result
+
+    def _start(self, file_name, checksum, resume):
+        kind = self.model._meta.model_name
+        if not resume:
+            return PriceListImport.objects.create(
+                kind=kind,
+                file_name=file_name,
+                checksum=checksum,
+                deactivate_missing=self.deactivate_missing,
+            )
+        record = (
+            PriceListImport.objects.filter(
+                kind=kind,
+                checksum=checksum,
+                status__in=[PriceListImport.Status.RUNNING, PriceListImport.Status.FAILED],
+            )
+            .order_by("-pk")
+            .first()
+        )
+        if record is None:
+            raise PriceListError("Нет прерванного импорта этого файла, продолжать нечего")
+        result = self.result
+        result.rows, result.created, result.updated = record.rows, record.created, record.updated
+        result.unchanged, result.deactivated = record.unchanged, record.deactivated
+        record.status = PriceListImport.Status.RUNNING
+        record.deactivate_missing = self.deactivate_missing
+        record.save(update_fields=["status", "deactivate_missing"])
+        return record
+
+    def _save_progress(self):
+        record, result = self.record, self.result
+        record.rows = result.rows
+        record.created = result.created
+        record.updated = result.updated
+        record.unchanged = result.unchanged
+        record.deactivated = result.deactivated
+        record.error_count += len(result.errors) - self._reported_errors
+        self._reported_errors = len(result.errors)
+        record.save(
+            update_fields=[
+                "rows", "created", "updated", "unchanged", "deactivated", "error_count",
+            ]
+        )
+
+    def _finish(self, status, error=""):
+        record = self.record
+        record.status = status
+        record.last_error = error
+        record.finished_at = timezone.now()
+        record.save(update_fields=["status", "last_error", "finished_at"])
+
+    def _commit(self, chunk):
+        """Применяет пачку одной транзакцией вместе с журналом изменений и прогрессом"""
+        touched, images = len(self.touched), len(self.images)
+        with transaction.atomic():
+            changes = self._apply(chunk)
+            if self.dry_run:
+                transaction.set_rollback(True)
+            else:
+                self._record(changes)
+        if self.dry_run:
+            # Откаченные позиции обновлять не нужно
+            del self.touched[touched:], self.images[images:]
+
+    def _record(self, changes):
+        if self.record is None:
+            return
+        PriceListImportChange.objects.bulk_create(
+            [
+                PriceListImportChange(run=self.record, item_id=pk, action=action, previous=previous)
+                for pk, action, previous in changes
+            ],
+            batch_size=self.chunk_size,
+        )
+        self._save_progress()
+
+    def _apply(self, chunk):
+        """Применяет пачку; возвращает (pk, действие, прежние значения) изменённых позиций"""
+        result = self.result
+        parsed = {}
+        for number, row in chunk:
+            result.rows += 1
+            sku = _text(row.pop("sku", None))
+            if not sku:
+                result.errors.append((number, "пустой артикул"))
+                continue
+            if sku in self.seen:
+                result.errors.append((number, f"артикул {sku} уже встречался в файле"))
+                continue
+            try:
+                values = {
+                    name: _parse(name, value)
+                    for name, value in row.items()
+                    if name not in FACET_FIELDS
+                    and not (name in KEEP_IF_EMPTY and _text(value) == "")
+                }
+                links = {
+                    name: self.facets.resolve(name, value)
+                    for name, value in row.items()
+                    if name in FACET_FIELDS
+                }
+            except ValueError as error:
+                result.errors.append((number, f"{sku}: {error}"))
+                continue
+            self.seen.add(sku)
+            parsed[sku] = (number, values, links)
+
+        existing = {
+            item.sku: item for item in self.model.objects.filter(sku__in=parsed)
+        }
+        now = timezone.now()
+        to_create, to_update, changed_fields = [], [], set()
+        links_by_item = {}
+        previous = {}
+
+        for sku, (number, values, links) in parsed.items():
+            item = existing.get(sku)
+            if item is None:
+                missing = [name for name in REQUIRED_FIELDS if values.get(name) in (None, "")]
+                if missing:
+                    result.errors.append(
+                        (number, f"{sku}: для новой позиции нужны {', '.join(missing)}")
+                    )
+                    continue
+                item = self.model(sku=sku, **values)
+                to_create.append(item)
+                if item.image:
+                    self.images.append(item.image.name)
+            else:
+                fields = [
+                    name for name, value in values.items() if not _same(getattr(item, name), value)
+                ]
+                if fields:
+                    previous[item.pk] = {name: _stored(getattr(item, name)) for name in fields}
+                    for name in fields:
+                        setattr(item, name, values[name])
+                    item.updated_at = now
+                    changed_fields.update(fields)
+                    to_update.append(item)
+                    if "image" in fields and item.image:
+                        self.images.append(item.image.name)
+            links_by_item[sku] = (item, links)
+
+        # bulk_create не вызывает save(), поэтому auto_now-поля заполняем сами
+        for item in to_create:
+            item.created_at = item.updated_at = now
+        self.model.objects.bulk_create(to_create, batch_size=self.chunk_size)
+        if to_update:
+            self.model.objects.bulk_update(
+                to_update, [*changed_fields, "updated_at"], batch_size=self.chunk_size
+            )
+
+        created = {item.pk for item in to_create}
+        previous_links = self._apply_links(links_by_item.values())
+        updated = ({item.pk for item in to_update} | set(previous_links)) - created
+        result.created += len(created)
+        result.updated += len(updated)
+        result.unchanged += len(links_by_item) - len(created) - len(updated)
+        self.touched.extend(created | updated)
+        return [(pk, PriceListImportChange.Action.CREATED, {}) for pk in created] + [
+            (
+                pk,
+                PriceListImportChange.Action.UPDATED,
+                {"fields": previous.get(pk, {}), "links": previous_links.get(pk, {})},
+            )
+            for pk in updated
+        ]
+
+    def _apply_links(self, items):
+        """Приводит M2M-фильтры пачки к значениям из файла.
+
+        Возвращает для изменённых товаров прежние наборы: pk -> {поле: [pk значений]}.
+        """
+        changed = defaultdict(dict)
+        wanted = defaultdict(dict)
+        for item, links in items:
+            for name, pks in links.items():
+                wanted[name][item.pk] = pks
+
+        for name, targets in wanted.items():
+            through = getattr(self.model, name).through
+            target_field = f"{FACET_FIELDS[name][0]._meta.model_name}_id"
+            current = defaultdict(set)
+            for item_id, value_id in through.objects.filter(
+                product_id__in=targets
+            ).values_list("product_id", target_field):
+                current[item_id].add(value_id)
+
+            differ = [pk for pk, pks in targets.items() if current[pk] != pks]
+            if not differ:
+                continue
+            # Набор связей товара заменяется целиком: это два запроса на пачку
+            through.objects.filter(product_id__in=differ).delete()
+            through.objects.bulk_create(
+                [
+                    through(product_id=pk, **{target_field: value_id})
+                    for pk in differ
+                    for value_id in targets[pk]
+                ],
+                batch_size=self.chunk_size,
+            )
+            for pk in differ:
+                changed[pk][name] = sorted(current[pk])
+        return changed
+
+    def _deactivate_missing(self):
+        """Скрывает позиции с артикулом, которых нет в файле"""
+        missing = list(
+            self.model.objects.filter(sku__isnull=False, is_active=True)
+            .exclude(sku="")
+            .values_list("pk", "sku")
+        )
+        pks = [pk for pk, sku in missing if sku not in self.seen]
+        self.result.deactivated += len(pks)
+        if self.dry_run:
+            return
+        for start in range(0, len(pks), self.chunk_size):
+            batch = pks[start : start + self.chunk_size]
+            with transaction.atomic():
+                self.model.objects.filter(pk__in=batch).update(
+                    is_active=False, updated_at=timezone.now()
+                )
+                self._record(
+                    [(pk, PriceListImportChange.Action.DEACTIVATED, {}) for pk in batch]
+                )
+            self.touched.extend(batch)
+
+
+def refresh_derived(model, pks, images=()):
+    """Цены, кэши, поиск, карта сайта и копии изображений после изменения позиций пачками"""
+    refresh_effective_prices({model: pks})
+    invalidate_catalog()
+    invalidate_pages(model._meta.model_name)
+    search.reindex_items(model, pks)
+    if model._meta.model_name in sitemaps.DEPENDENCIES:
+        # Команда завершится раньше фонового потока, поэтому карта строится сразу
+        sitemaps.build_sitemap()
+    page = dict(renditions.image_models())[model]
+    for name in images:
+        renditions.schedule(name, page)
+
+
+def rollback_import(record, chunk_size=CHUNK_SIZE):
+    """Возвращает позиции к состоянию до запуска импорта record; пачками, как и импорт.
+
+    Созданные позиции удаляются, изменённые получают прежние значения полей и
+    фильтров, скрытые снова показываются. Правки, сделанные после импорта в
+    тех же полях, тоже откатываются. Созданные импортом значения фильтров
+    остаются. Возвращает число позиций.
+    """
+    if record.status == PriceListImport.Status.ROLLED_BACK:
+        raise PriceListError(f"Импорт #{record.pk} уже откачен")
+    model = next(
+        model for model in IMPORT_FIELDS if model._meta.model_name == record.kind
+    )
+    restored, total = [], 0
+    while True:
+        batch = list(record.changes.order_by("pk")[:chunk_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            _rollback_changes(model, batch)
+            PriceListImportChange.objects.filter(pk__in=[change.pk for change in batch]).delete()
+        total += len(batch)
+        restored.extend(
+            change.item_id
+            for change in batch
+            if change.action != PriceListImportChange.Action.CREATED
+        )
+    record.status = PriceListImport.Status.ROLLED_BACK
+    record.finished_at = timezone.now()
+    record.save(update_fields=["status", "finished_at"])
+    refresh_derived(model, restored)
+    return total
+
+
+def _rollback_changes(model, changes):
+    Action = PriceListImportChange.Action
+    now = timezone.now()
+    by_action = defaultdict(list)
+    for change in changes:
+        by_action[change.action].append(change)
+
+    # Удаление идёт через сигналы: цены, поиск и кэши позиций обновятся сами
+    model.objects.filter(pk__in=[change.item_id for change in by_action[Action.CREATED]]).delete()
+    model.objects.filter(
+        pk__in=[change.item_id for change in by_action[Action.DEACTIVATED]]
+    ).update(is_active=True, updated_at=now)
+
+    updated = by_action[Action.UPDATED]
+    items = model.objects.in_bulk([change.item_id for change in updated])
+    fields, links = set(), defaultdict(dict)
+    for change in updated:
+        item = items.get(change.item_id)
+        if item is None:
+            continue
+        for name, value in change.previous.get("fields", {}).items():
+            setattr(item, name, value)
+            fields.add(name)
+        item.updated_at = now
+        for name, pks in change.previous.get("links", {}).items():
+            links[name][item.pk] = pks
+    if items:
+        model.objects.bulk_update(items.values(), [*fields, "updated_at"])
+    for name, targets in links.items():
+        through = getattr(model, name).through
+        target_field = f"{FACET_FIELDS[name][0]._meta.model_name}_id"
+        through.objects.filter(product_id__in=targets).delete()
+        through.objects.bulk_create(
+            [
+                through(product_id=pk, **{target_field: value_id})
+                for pk, value_ids in targets.items()
+                for value_id in value_ids
+            ]
+        )
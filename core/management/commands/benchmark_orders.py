@@ -0,0 +1,117 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import QueryDict
+
+from core.benchmarks import measure, percentile, throwaway_database
+from core.models import AdditionalProducts, Arenda, Order, Product
+from core.orders import create_order
+
+
+def legacy_create_order(data):
+    """Прежний путь записи заказа: create, отдельный set() на связь и save()"""
+    order = Order.objects.create(
+        name=data.get("name"),
+        phone=data.get("phone"),
+        order_type=data.get("order_type"),
+        comment=data.get("comment", ""),
+        double_game_count=data.get("double_game_count", 1),
+    )
+    if data.get("order_type") in ("buy", "double_buy"):
+        order.products.set(data.getlist("buy_games"))
+        order.additional_products.set(data.getlist("additional_goods"))
+        order.delivery_address = data.get("delivery_address")
+        order.engraving = data.get("engraving", "no")
+    elif data.get("order_type") == "rent":
+        order.games_for_rent.set(data.getlist("rent_games"))
+        order.arenda.set([data.get("rent_type")])
+        order.date = data.get("rent_date")
+        order.delivery_address = data.get("rent_address")
+    order.save()
+    return order
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет запись заказов во временной базе: число SQL-запросов и "
+        "задержку на заказ при параллельной отправке."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--legacy",
+            action="store_true",
+            help="Замерить прежний путь записи (без транзакции и пакетных вставок)",
+        )
+
+    def handle(self, *args, **options):
+        write = legacy_create_order if options["legacy"] else create_order
+
+        with throwaway_database():
+            payloads = self.make_payloads(options["orders"])
+
+            def submit(data):
+                try:
+                    return measure(write, data)[1]
+                except Exception as e:
+                    return e
+                finally:
+                    connection.close()
+
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+                outcomes = list(pool.map(submit, payloads))
+
+            results = [o for o in outcomes if not isinstance(o, Exception)]
+            errors = [str(o) for o in outcomes if isinstance(o, Exception)]
+
+            stored = Order.objects.count()
+
+        latencies = [result.seconds * 1000 for result in results] or [0]
+        queries = [result.queries for result in results] or [0]
+        report = {
+            "path": "legacy" if options["legacy"] else "bulk",
+            "orders": len(payloads),
+            "stored": stored,
+            "errors": len(errors),
+            "error_samples": sorted(set(errors))[:3],
+            "concurrency": options["concurrency"],
+            "queries_per_order": sum(queries) / len(queries),
+            "latency_ms_p50": round(percentile(latencies, 50), 2),
+            "latency_ms_p95": round(percentile(latencies, 95), 2),
+            "latency_ms_max": round(max(latencies), 2),
+        }
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+
+    def make_payloads(self, count):
+        products = [
+            Product.objects.create(name=f"Игра {i}", price=Decimal(1000), image="x.jpg")
+            for i in range(20)
+        ]
+        additional = [
+            AdditionalProducts.objects.create(name=f"Доп {i}", price=Decimal(500), image="x.jpg")
+            for i in range(5)
+        ]
+        arenda = Arenda.objects.create(
+            name="Аренда", description="", price=Decimal(5000), image="x.jpg"
+        )
+
+        payloads = []
+        for i in range(count):
+            data = QueryDict(mutable=True)
+            data.update({"name": f"Клиент {i}", "phone": "+79990000000"})
+            if i % 2:
+                data["order_type"] = "rent"
+                data["rent_type"] = str(arenda.pk)
+                data["rent_date"] = "2030-01-01"
+                data.setlist("rent_games", [str(p.pk) for p in products[i % 10 : i % 10 + 3]])
+            else:
+                data["order_type"] = "buy"
+                data.setlist("buy_games", [str(p.pk) for p in products[i % 10 : i % 10 + 3]])
+                data.setlist("additional_goods", [str(a.pk) for a in additional[:2]])
+            payloads.append(data)
+        return payloads
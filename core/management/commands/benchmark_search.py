@@ -0,0 +1,100 @@
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core import search
+from core.benchmarks import percentile, throwaway_database
+from core.models import Product
+
+# Настоящие слова каталога разбавлены сгенерированными, частоты — по закону Ципфа,
+# чтобы запросы находили от единиц до тысяч товаров, как в живом каталоге
+CATALOG_WORDS = (
+    "шахматы шашки нарды домино лото ёлочка йога башня лабиринт головоломка "
+    "пазл мозаика крестики нолики кубик пирамида дуб берёза сосна клён "
+    "логика стратегия память скорость семья дети взрослые подарок ручная работа "
+    "деревянная доска фигуры поле кости карточки правила ход игрок победа"
+).split()
+SYLLABLES = "ба ва га да же за ки ло ми но пу ра са то фу ха це чи ша ще ю я ё й".split()
+VOCABULARY_SIZE = 20000
+
+QUERIES = ("шахм", "Ёлочка", "ДЕРЕВЯННАЯ доска", "берёза подарок", "йога", "лабиринт логика")
+
+
+def legacy_search(query):
+    """Прежний поиск каталога: четыре варианта name__icontains"""
+    return list(
+        Product.objects.filter(
+            Q(name__icontains=query) |
+            Q(name__icontains=query.capitalize()) |
+            Q(name__icontains=query.upper()) |
+            Q(name__icontains=query.lower())
+        ).values_list("pk", flat=True)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает полнотекстовый поиск FTS5 с прежним поиском через icontains "
+        "на синтетическом каталоге во временной базе."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50000)
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        vocabulary = list(CATALOG_WORDS)
+        while len(vocabulary) < VOCABULARY_SIZE:
+            vocabulary.append("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+        rng.shuffle(vocabulary)
+        weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+        def text(words):
+            return " ".join(rng.choices(vocabulary, weights, k=words))
+
+        with throwaway_database():
+            Product.objects.bulk_create(
+                (
+                    Product(
+                        name=text(3).capitalize(),
+                        description=text(40),
+                        game_rules=text(60),
+                        additional_info=text(10),
+                        price=Decimal(rng.randrange(500, 10000)),
+                        image="products/x.jpg",
+                    )
+                    for _ in range(options["products"])
+                ),
+                batch_size=2000,
+            )
+            started = time.perf_counter()
+            search.rebuild_index()
+            index_seconds = time.perf_counter() - started
+
+            report = {
+                "products": options["products"],
+                "index_build_s": round(index_seconds, 2),
+                "queries": {},
+            }
+            for query in QUERIES:
+                row = {}
+                for label, func in (("icontains", legacy_search), ("fts5", search.search)):
+                    timings = []
+                    for _ in range(options["repeat"]):
+                        started = time.perf_counter()
+                        found = func(query)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    row[label] = {
+                        "matches": len(found),
+                        "ms_p50": round(percentile(timings, 50), 2),
+                        "ms_p95": round(percentile(timings, 95), 2),
+                    }
+                report["queries"][query] = row
+
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
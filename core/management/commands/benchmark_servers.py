@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from core.benchmarks import percentile, populate_catalog, throwaway_database
+from core.models import News, Product
+
+# Команды запуска серверов; {workers} и {port} подставляются
+DEFAULT_SERVERS = {
+    "wsgi": "gunicorn bulka_play_2.wsgi:application --workers {workers} --threads 4 --bind 127.0.0.1:{port}",
+    "asgi": "uvicorn bulka_play_2.asgi:application --workers {workers} --port {port}",
+}
+# Сколько секунд ждать, пока сервер начнёт принимать соединения
+STARTUP_TIMEOUT = 30
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f"Сервер завершился с кодом {process.returncode}")
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.2)
+    raise CommandError(f"Сервер не открыл порт {port} за {STARTUP_TIMEOUT} с")
+
+
+def requests_plan(order_share):
+    """(метод, путь, тело) запросов, которые клиенты отправляют по кругу"""
+    product = Product.objects.filter(is_active=True).order_by("pk").first()
+    news = News.objects.order_by("pk").first()
+    plan = [
+        ("GET", reverse("landing"), None),
+        ("GET", reverse("game_catalog"), None),
+        ("GET", reverse("game_catalog") + "?sort=price_asc", None),
+        ("GET", reverse("product_detail", args=[product.pk]), None),
+        ("GET", reverse("rental_catalog"), None),
+        ("GET", reverse("news_gallery", args=[news.pk]), None),
+    ]
+    if order_share > 0:
+        body = urlencode(
+            {
+                "order_type": "buy",
+                "name": "Бенчмарк",
+                "phone": "+79990000000",
+                "buy_games": product.pk,
+            }
+        )
+        orders = max(1, round(len(plan) * order_share / (1 - order_share)))
+        plan += [("POST", reverse("process_order"), body)] * orders
+    return plan
+
+
+async def _request(host, port, method, path, body, timeout):
+    """Один HTTP/1.1-запрос на новом соединении; возвращает код ответа"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        payload = body.encode() if body else b""
+        head = [f"{method} {path} HTTP/1.1", f"Host: {host}", "Connection: close"]
+        if body:
+            head += [
+                "Content-Type: application/x-www-form-urlencoded",
+                f"Content-Length: {len(payload)}",
+            ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        # Ответ дочитывается целиком: в задержку входит передача страницы
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def run_level(url, plan, concurrency, total, timeout):
+    """total запросов из concurrency клиентов; задержки, ошибки и длительность"""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    latencies, errors = [], {}
+    counter = iter(range(total))
+
+    async def client():
+        for number in counter:
+            method, path, body = plan[number % len(plan)]
+            started = time.perf_counter()
+            try:
+                status = await _request(host, port, method, path, body, timeout)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError) as error:
+                errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+                continue
+            if status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "ok": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(max(latencies, default=0), 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный замер WSGI- и ASGI-развёртывания: при 50–500 "
+        "одновременных клиентах считает пропускную способность, задержку "
+        "p50/p95/p99 и ошибки. Серверы либо запускаются локально на "
+        "временной базе с синтетическим каталогом (--scale), либо "
+        "указываются адресами уже работающих (--target имя=URL). Генератор "
+        "нагрузки работает на той же машине и делит с серверами процессор."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            default=[],
+            help="имя=URL работающего сервера; без --target запускаются gunicorn и uvicorn",
+        )
+        parser.add_argument("--scale", type=int, default=1000, help="Игр во временной базе")
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--wsgi-command", default=DEFAULT_SERVERS["wsgi"])
+        parser.add_argument("--asgi-command", default=DEFAULT_SERVERS["asgi"])
+        parser.add_argument("--concurrency", default="50,100,250,500")
+        parser.add_argument("--requests", type=int, default=2000, help="Запросов на уровень")
+        parser.add_argument(
+            "--orders",
+            type=float,
+            default=0.1,
+            help="Доля POST-заказов в нагрузке (заказы пишутся в базу сервера)",
+        )
+        parser.add_argument("--timeout", type=float, default=30.0)
+        parser.add_argument("--output", default="benchmark_servers.json")
+
+    def handle(self, *args, **options):
+        if options["target"]:
+            targets = dict(item.split("=", 1) for item in options["target"])
+            report = self.run_targets(targets, options)
+        else:
+            with throwaway_database() as path, tempfile.TemporaryDirectory(
+                ignore_cleanup_errors=True
+            ) as cache_dir:
+                populate_catalog(options["scale"], seed=1)
+                report = self.run_spawned(path, cache_dir, options)
+
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(f"Результат записан в {options['output']}")
+
+    def run_spawned(self, database, cache_dir, options):
+        env = {
+            **os.environ,
+            "SQLITE_PATH": database,
+            "CACHE_LOCATION": cache_dir,
+            "SITEMAP_ROOT": os.path.join(cache_dir, "sitemap"),
+            "DEBUG_MODE": "False",
+            "QUERY_BUDGET_SAMPLE_RATE": "0",
+        }
+        report = {}
+        for name, key in (("wsgi", "wsgi_command"), ("asgi", "asgi_command")):
+            port = _free_port()
+            command = shlex.split(options[key].format(workers=options["workers"], port=port))
+            process = subprocess.Popen(
+                command, env=env, stdout=subprocess.DEVNULL, stderr=sys.stderr
+            )
+            try:
+                _wait_for_port(port, process)
+                report.update(self.run_targets({name: f"http://127.0.0.1:{port}"}, options))
+            finally:
+                process.terminate()
+                try:
+                    process.wait(timeout=STARTUP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    # Сервер дорабатывает очередь запросов, от которых клиенты уже отказались
+                    process.kill()
+                    process.wait()
+        return report
+
+    def run_targets(self, targets, options):
+        plan = requests_plan(options["orders"])
+        levels = [int(value) for value in options["concurrency"].split(",") if value]
+        report = {}
+        for name, url in targets.items():
+            # Прогрев: первый запрос каждой страницы строит кэш воркера
+            asyncio.run(run_level(url, plan, 1, len(plan) * options["workers"], options["timeout"]))
+            report[name] = {}
+            for concurrency in levels:
+                result = asyncio.run(
+                    run_level(url, plan, concurrency, options["requests"], options["timeout"])
+                )
+                report[name][str(concurrency)] = result
+                self.stdout.write(
+                    f"{name} x{concurrency}: {result['rps']} запр/с, p50 {result['p50_ms']} мс, "
+                    f"p95 {result['p95_ms']} мс, p99 {result['p99_ms']} мс, ошибок {sum(result['errors'].values())}"
+                )
+        return report
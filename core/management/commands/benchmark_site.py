@@ -0,0 +1,189 @@
+import json
+import platform
+import time
+import tracemalloc
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+
+from core.benchmarks import percentile, populate_catalog, throwaway_database
+from core.models import AdditionalProducts, News, Product
+from core.query_budget import QueryRecorder
+
+# Разделы, которые бенчмарк сознательно не открывает
+SKIPPED_URLS = {"djdt"}
+# Разница p50 меньше этого порога считается шумом, а не регрессией
+NOISE_MS = 1.0
+
+
+def scenarios():
+    """(имя URL, метод, путь, данные) для каждой страницы из urls.py"""
+    product = Product.objects.filter(is_active=True).order_by("pk").first()
+    additional = AdditionalProducts.objects.order_by("pk").first()
+    news = News.objects.order_by("pk").first()
+    order = {
+        "order_type": "buy",
+        "name": "Бенчмарк",
+        "phone": "+79990000000",
+        "buy_games": [product.pk],
+        "additional_goods": [additional.pk],
+    }
+    return [
+        ("landing", "get", reverse("landing"), None),
+        ("about", "get", reverse("about"), None),
+        ("game_catalog", "get", reverse("game_catalog"), None),
+        ("game_catalog:filtered", "get", reverse("game_catalog"), {"size": "46x46 см", "sort": "price_asc"}),
+        ("game_catalog:search", "get", reverse("game_catalog"), {"search": "шахм"}),
+        ("product_detail", "get", reverse("product_detail", args=[product.pk]), None),
+        ("rental_catalog", "get", reverse("rental_catalog"), None),
+        ("two_games_on_one_board", "get", reverse("two_games_on_one_board"), None),
+        ("additional_product_detail", "get", reverse("additional_product_detail", args=[additional.pk]), None),
+        ("calculate_games", "get", reverse("calculate_games"), {"guests": 12}),
+        ("player_ranges_table", "get", reverse("player_ranges_table"), None),
+        ("news_gallery", "get", reverse("news_gallery", args=[news.pk]), None),
+        ("media_video", "get", reverse("media_video", args=["about_horizontal.mp4"]), None),
+        ("process_order", "post", reverse("process_order"), order),
+        ("sitemap", "get", reverse("sitemap", args=["sitemap.xml"]), None),
+    ]
+
+
+def _url_names(patterns, prefix=""):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            namespace = pattern.namespace
+            if namespace in SKIPPED_URLS or namespace == "admin":
+                continue
+            yield from _url_names(pattern.url_patterns, f"{namespace}:" if namespace else prefix)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield prefix + pattern.name
+
+
+def _content_length(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+class Command(BaseCommand):
+    help = (
+        "Заполняет временную базу синтетическими каталогами разного размера и "
+        "замеряет все страницы сайта: задержку p50/p95, число SQL-запросов, "
+        "пиковую память и размер ответа. Результат пишется в JSON, который "
+        "можно сравнить с сохранённым замером через --baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", default="100,1000,10000,50000")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", default="benchmark_site.json")
+        parser.add_argument("--baseline", help="JSON прошлого замера для сравнения")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Доля роста p50, начиная с которой изменение считается регрессией",
+        )
+
+    def handle(self, *args, **options):
+        scales = [int(value) for value in options["scales"].split(",") if value]
+        report = {
+            "meta": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "repeat": options["repeat"],
+                "seed": options["seed"],
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "scales": {},
+        }
+        for scale in scales:
+            with throwaway_database():
+                started = time.perf_counter()
+                populate_catalog(scale, seed=options["seed"])
+                self.stdout.write(f"{scale} игр: каталог за {time.perf_counter() - started:.1f} с")
+                report["scales"][str(scale)] = self.run_scale(options["repeat"])
+
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(f"Результат записан в {options['output']}")
+
+        if options["baseline"]:
+            self.compare(report, options["baseline"], options["threshold"])
+
+    def run_scale(self, repeat):
+        client = Client()
+        plan = scenarios()
+        covered = {name.split(":")[0] for name, *_ in plan}
+        missing = set(_url_names(get_resolver().url_patterns)) - covered
+        if missing:
+            self.stderr.write(f"Страницы без сценария: {', '.join(sorted(missing))}")
+
+        results = {}
+        for name, method, path, data in plan:
+            request = getattr(client, method)
+
+            def call():
+                recorder = QueryRecorder()
+                with connection.execute_wrapper(recorder):
+                    started = time.perf_counter()
+                    response = request(path, data)
+                    size = _content_length(response)
+                    elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    raise CommandError(f"{name}: ответ {response.status_code}")
+                return elapsed * 1000, recorder.count, size
+
+            # Первый запрос — холодный: снимок каталога и кэш страниц пусты
+            cold_ms, cold_queries, size = call()
+            timings, queries = [], []
+            for _ in range(repeat):
+                ms, count, size = call()
+                timings.append(ms)
+                queries.append(count)
+
+            # Память меряется отдельным запросом: tracemalloc замедляет код
+            tracemalloc.start()
+            call()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[name] = {
+                "cold_ms": round(cold_ms, 2),
+                "cold_queries": cold_queries,
+                "p50_ms": round(percentile(timings, 50), 2),
+                "p95_ms": round(percentile(timings, 95), 2),
+                "queries": max(queries),
+                "peak_kb": round(peak / 1024, 1),
+                "bytes": size,
+            }
+            self.stdout.write(
+                f"  {name}: p50 {results[name]['p50_ms']} мс, "
+                f"{results[name]['queries']} запросов, {size} байт"
+            )
+        return results
+
+    def compare(self, report, baseline_path, threshold):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = 0
+        for scale, views in report["scales"].items():
+            for name, current in views.items():
+                previous = baseline.get("scales", {}).get(scale, {}).get(name)
+                if previous is None:
+                    continue
+                slower = (
+                    current["p50_ms"] > previous["p50_ms"] * (1 + threshold)
+                    and current["p50_ms"] - previous["p50_ms"] > NOISE_MS
+                )
+                more_queries = current["queries"] > previous["queries"]
+                if slower or more_queries:
+                    regressions += 1
+                    self.stdout.write(
+                        f"РЕГРЕССИЯ {scale}/{name}: p50 {previous['p50_ms']} -> {current['p50_ms']} мс, "
+                        f"запросов {previous['queries']} -> {current['queries']}"
+                    )
+        self.stdout.write(f"Сравнение с {baseline_path}: регрессий {regressions}")
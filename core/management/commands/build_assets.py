@@ -0,0 +1,84 @@
+import gzip
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.assets import (
+    BUNDLE_DIR,
+    BUNDLES,
+    CRITICAL_PAGES,
+    build_bundle,
+    build_critical,
+    minifier_available,
+)
+
+
+def _compressed_sizes(data):
+    sizes = [len(gzip.compress(data, 9))]
+    try:
+        import brotli
+    except ImportError:
+        return sizes
+    return sizes + [len(brotli.compress(data))]
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _kb(size):
+    return f"{size / 1024:.1f}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Собирает бандлы CSS/JS из core.assets.BUNDLES и критический CSS "
+        "страниц в static/bundles. Запускается перед collectstatic: тот "
+        "добавляет в имена хэш содержимого и сжимает файлы gzip и brotli."
+    )
+
+    def handle(self, *args, **options):
+        for kind, package in (("css", "rcssmin"), ("js", "rjsmin")):
+            if not minifier_available(kind):
+                self.stderr.write(f"{package} не установлен: {kind}-бандлы не минифицируются")
+
+        root = os.path.join(settings.STATICFILES_DIRS[0], BUNDLE_DIR)
+        os.makedirs(root, exist_ok=True)
+        written, built = set(), {}
+
+        def write(name, text):
+            data = text.encode()
+            path = os.path.join(root, name)
+            # Неизменённый файл не перезаписывается: время изменения
+            # статики входит в отпечаток кэша страниц
+            if _read(path) != data:
+                with open(path, "wb") as f:
+                    f.write(data)
+            written.add(name)
+            return data
+
+        for name in BUNDLES:
+            text, source_size = build_bundle(name)
+            built[name] = text
+            data = write(name, text)
+            self.stdout.write(
+                f"{name}: исходников {len(BUNDLES[name])}, {_kb(source_size)} -> {_kb(len(data))} КБ, "
+                f"сжатый {' / '.join(_kb(size) for size in _compressed_sizes(data))} КБ"
+            )
+
+        for page, (bundles, templates) in CRITICAL_PAGES.items():
+            css = "".join(built[name] for name in bundles)
+            data = write(f"critical-{page}.css", build_critical(css, templates))
+            self.stdout.write(
+                f"Критический CSS {page}: {_kb(len(data))} КБ из {_kb(len(css.encode()))} КБ"
+            )
+
+        for name in os.listdir(root):
+            if name not in written:
+                os.unlink(os.path.join(root, name))
+        self.stdout.write(f"Бандлы записаны в {root}, дальше — collectstatic")
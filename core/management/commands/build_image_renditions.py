@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from core import renditions
+from core.page_cache import invalidate_pages
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит AVIF/WebP-копии для уже загруженных изображений. "
+        "Изображения с готовым манифестом пропускаются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true", help="Перестроить копии заново"
+        )
+
+    def handle(self, *args, **options):
+        jobs = {}
+        for model, page in renditions.image_models():
+            for name in model.objects.exclude(image="").values_list("image", flat=True):
+                jobs.setdefault(name, page)
+
+        executor = renditions.get_executor()
+        if executor is None:
+            # Пул выключен (IMAGE_RENDITION_WORKERS=0): строим в этом процессе
+            executor = ThreadPoolExecutor(max_workers=1)
+        futures = {
+            executor.submit(renditions.generate_renditions, name, None, options["force"]): name
+            for name in jobs
+        }
+        failed = 0
+        for done, future in enumerate(as_completed(futures), 1):
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                self.stderr.write(f"{futures[future]}: {error}")
+            if done % 50 == 0:
+                self.stdout.write(f"{done}/{len(futures)}")
+
+        for page in {page for page in jobs.values() if page}:
+            invalidate_pages(page)
+        self.stdout.write(f"Готово: {len(futures) - failed} изображений, ошибок: {failed}")
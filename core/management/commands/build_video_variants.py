@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import videos
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит постеры и облегчённые копии роликов из media/video с помощью "
+        "ffmpeg. Ролики с готовым манифестом пропускаются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true", help="Перестроить копии заново"
+        )
+
+    def handle(self, *args, **options):
+        ffmpeg = videos.ffmpeg_binary()
+        if ffmpeg is None:
+            raise CommandError(
+                "ffmpeg не найден; установите его или укажите путь в FFMPEG_BINARY. "
+                "Пока копий нет, страницы отдают оригинальные ролики."
+            )
+        for name in videos.list_videos():
+            if not options["force"] and videos.get_manifest(name):
+                self.stdout.write(f"{name}: уже готово")
+                continue
+            manifest = videos.build_variants(name, ffmpeg)
+            built = ", ".join(v["name"] for v in manifest["variants"]) or "нет (оригинал легче)"
+            self.stdout.write(f"{name}: копии {built}")
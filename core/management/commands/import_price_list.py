@@ -0,0 +1,106 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import (
+    PriceListError,
+    PriceListImporter,
+    file_checksum,
+    read_rows,
+    rollback_import,
+)
+from core.models import AdditionalProducts, PriceListImport, Product
+
+MODELS = {"product": Product, "additional": AdditionalProducts}
+# Сколько ошибок по строкам печатать, остальные только считаются
+SHOWN_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует прайс-лист CSV или XLSX: позиции сопоставляются по артикулу, "
+        "новые создаются, у существующих меняются только отличающиеся поля. "
+        "Значения фильтров в ячейке перечисляются через точку с запятой. "
+        "Изменения коммитятся пачками; прерванный импорт продолжается с --resume, "
+        "а любой запуск откатывается --rollback."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", help="Файл .csv или .xlsx")
+        parser.add_argument("--model", choices=MODELS, default="product")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--deactivate-missing",
+            action="store_true",
+            help="Скрыть позиции с артикулом, которых нет в файле",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Посчитать изменения и откатить их"
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Продолжить прерванный импорт этого файла с первой неприменённой строки",
+        )
+        parser.add_argument(
+            "--rollback",
+            type=int,
+            metavar="ID",
+            help="Откатить запуск импорта с этим номером (файл не нужен)",
+        )
+
+    def handle(self, *args, **options):
+        if options["rollback"] is not None:
+            self.rollback(options["rollback"], options["chunk_size"])
+            return
+        if not options["path"]:
+            raise CommandError("Укажите файл прайс-листа или --rollback")
+
+        importer = PriceListImporter(
+            MODELS[options["model"]],
+            chunk_size=options["chunk_size"],
+            deactivate_missing=options["deactivate_missing"],
+        )
+        started = time.perf_counter()
+        try:
+            with open(options["path"], "rb") as f:
+                checksum = file_checksum(f)
+                result = importer.run(
+                    read_rows(options["path"], f),
+                    dry_run=options["dry_run"],
+                    file_name=options["path"],
+                    checksum=checksum,
+                    resume=options["resume"],
+                )
+        except (OSError, PriceListError) as error:
+            raise CommandError(str(error))
+        # ru_maxrss в Linux — в килобайтах; это пик всего процесса
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        for number, message in result.errors[:SHOWN_ERRORS]:
+            self.stderr.write(f"Строка {number}: {message}")
+        if len(result.errors) > SHOWN_ERRORS:
+            self.stderr.write(f"... и ещё {len(result.errors) - SHOWN_ERRORS} ошибок")
+
+        self.stdout.write(
+            f"{'Проверено' if options['dry_run'] else 'Импортировано'} строк: {result.rows} "
+            f"за {time.perf_counter() - started:.1f} с, пик памяти {peak / 1024:.0f} МБ\n"
+            f"  создано: {result.created}, изменено: {result.updated}, "
+            f"без изменений: {result.unchanged}, скрыто: {result.deactivated}, "
+            f"новых значений фильтров: {result.facet_values_created}, ошибок: {len(result.errors)}"
+        )
+        if importer.record is not None:
+            self.stdout.write(
+                f"Запуск импорта #{importer.record.pk}; откатить: --rollback {importer.record.pk}"
+            )
+
+    def rollback(self, pk, chunk_size):
+        try:
+            record = PriceListImport.objects.get(pk=pk)
+            total = rollback_import(record, chunk_size=chunk_size)
+        except PriceListImport.DoesNotExist:
+            raise CommandError(f"Запуска импорта #{pk} нет")
+        except PriceListError as error:
+            raise CommandError(str(error))
+        self.stdout.write(f"Импорт #{pk} откачен, позиций: {total}")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовый индекс товаров и допов"
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("Полнотекстовый индекс поддерживается только для SQLite")
+        search.rebuild_index()
+        self.stdout.write("Поисковый индекс перестроен")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.page_cache import invalidate_pages
+from core.pricing import next_price_change, refresh_effective_prices
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает цены со скидками для всех позиций. Запускается таймером "
+        "systemd (deploy/refresh_prices_bulka_play_2.timer) сразу после полуночи "
+        "по московскому времени, чтобы цены менялись в дни начала и окончания скидок."
+    )
+
+    def handle(self, *args, **options):
+        refresh_effective_prices()
+        invalidate_pages("discount")
+        day = next_price_change(timezone.localdate())
+        self.stdout.write(
+            "Цены пересчитаны, следующее изменение: "
+            + (day.strftime("%d.%m.%Y") if day else "не запланировано")
+        )
@@ -0,0 +1,35 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from core.notifications import BATCH_SIZE, NotificationWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Отправляет уведомления о заказах из outbox в Telegram. "
+        "Запускается отдельным долгоживущим процессом рядом с gunicorn "
+        "(deploy/telegram_worker_bulka_play_2.service)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Отправить одну пачку уведомлений и выйти",
+        )
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2,
+            help="Пауза в секундах, если очередь пуста",
+        )
+
+    def handle(self, *args, **options):
+        worker = NotificationWorker(
+            batch_size=options["batch_size"], poll_interval=options["poll_interval"]
+        )
+        processed = asyncio.run(worker.run(once=options["once"]))
+        if options["once"]:
+            self.stdout.write(f"Обработано уведомлений: {processed}")
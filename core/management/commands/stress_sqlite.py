@@ -0,0 +1,199 @@
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from core.benchmarks import percentile, populate_catalog, throwaway_database
+
+# Доли операций в нагрузке одного потока
+OPERATIONS = (("order", 0.4), ("read", 0.5), ("admin", 0.1))
+# Настройки подключения, с которыми сайт работал до профиля WAL
+DEFAULT_OPTIONS = {}
+
+
+def _init_worker(profile):
+    import django
+
+    django.setup()
+    if profile == "default":
+        connections.settings["default"]["OPTIONS"] = dict(DEFAULT_OPTIONS)
+    # У синтетического каталога нет файлов изображений: ошибки копий не нужны
+    logging.getLogger("core.renditions").setLevel(logging.CRITICAL)
+
+
+def _run_thread(deadline, seed, results):
+    from django.db import transaction
+    from django.test import Client
+    from django.urls import reverse
+
+    from core.models import Product
+    from core.query_budget import LockRecorder
+
+    rng = random.Random(seed)
+    client = Client(SERVER_NAME="localhost")
+    product_ids = list(Product.objects.filter(is_active=True).values_list("pk", flat=True))
+    pages = [
+        reverse("game_catalog"),
+        reverse("game_catalog") + "?search=шахм",
+        reverse("landing"),
+    ] + [reverse("product_detail", args=[pk]) for pk in product_ids[:20]]
+    names = [name for name, _ in OPERATIONS]
+    weights = [weight for _, weight in OPERATIONS]
+
+    while time.monotonic() < deadline:
+        kind = rng.choices(names, weights)[0]
+        recorder = LockRecorder()
+        started = time.perf_counter()
+        failed = False
+        try:
+            with connection.execute_wrapper(recorder):
+                if kind == "order":
+                    response = client.post(
+                        reverse("process_order"),
+                        {
+                            "order_type": "buy",
+                            "name": "Нагрузка",
+                            "phone": f"+7999{rng.randrange(10**7):07d}",
+                            "buy_games": rng.sample(product_ids, 2),
+                        },
+                    )
+                    failed = response.status_code != 200
+                elif kind == "read":
+                    failed = client.get(rng.choice(pages)).status_code != 200
+                else:
+                    # Сохранение товара, как в админке: транзакция, сигналы, индекс
+                    with transaction.atomic():
+                        product = Product.objects.get(pk=rng.choice(product_ids))
+                        product.price = Decimal(rng.randrange(1000, 20000))
+                        product.save()
+        except Exception:
+            failed = True
+        elapsed = (time.perf_counter() - started) * 1000
+        result = results[kind]
+        result["ops"] += 1
+        result["latencies"].append(elapsed)
+        result["lock_wait_ms"] += recorder.lock_wait_ms
+        result["lock_errors"] += recorder.lock_errors
+        result["failed"] += failed
+    connection.close()
+
+
+def run_worker(duration, threads, seed):
+    """Один процесс-воркер: threads потоков со смешанной нагрузкой"""
+    from core import renditions
+
+    deadline = time.monotonic() + duration
+    results = {
+        name: {"ops": 0, "failed": 0, "lock_errors": 0, "lock_wait_ms": 0.0, "latencies": []}
+        for name, _ in OPERATIONS
+    }
+    lock = threading.Lock()
+    per_thread = []
+
+    def target(number):
+        local = {name: {**values, "latencies": []} for name, values in results.items()}
+        _run_thread(deadline, seed * 100 + number, local)
+        with lock:
+            per_thread.append(local)
+
+    workers = [threading.Thread(target=target, args=(number,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    renditions.shutdown_executor()
+
+    for local in per_thread:
+        for name, values in local.items():
+            for key in ("ops", "failed", "lock_errors", "lock_wait_ms"):
+                results[name][key] += values[key]
+            results[name]["latencies"] += values["latencies"]
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочная проверка SQLite: несколько процессов (как воркеры "
+        "gunicorn) одновременно оформляют заказы, читают каталог и сохраняют "
+        "товары во временной базе. Для каждого профиля подключения выводит "
+        "число операций, ошибки \"database is locked\", ожидание блокировки "
+        "и задержки. Профиль production — настройки из settings (WAL, "
+        "BEGIN IMMEDIATE), default — подключение SQLite по умолчанию."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", choices=["production", "default", "both"], default="both")
+        parser.add_argument("--processes", type=int, default=4)
+        parser.add_argument("--threads", type=int, default=2)
+        parser.add_argument("--duration", type=float, default=15.0, help="Секунд на профиль")
+        parser.add_argument("--scale", type=int, default=500, help="Игр во временной базе")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Команда проверяет только SQLite")
+        profiles = ["default", "production"] if options["profile"] == "both" else [options["profile"]]
+        for profile in profiles:
+            lock_errors = self.run_profile(profile, options)
+            # Ошибки профиля по умолчанию — ожидаемый результат сравнения
+            if lock_errors and profile == "production":
+                raise CommandError(f"Ошибок блокировки базы: {lock_errors}")
+
+    def run_profile(self, profile, options):
+        with throwaway_database() as path, tempfile.TemporaryDirectory(
+            ignore_cleanup_errors=True
+        ) as cache_dir:
+            populate_catalog(options["scale"], seed=1)
+            if profile == "default":
+                # WAL записывается в файл базы, обычный журнал возвращается явно
+                with connection.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode=DELETE")
+            connection.close()
+
+            # Процессы-воркеры читают настройки из окружения при запуске
+            os.environ.update(
+                SQLITE_PATH=path,
+                CACHE_LOCATION=cache_dir,
+                SITEMAP_ROOT=os.path.join(cache_dir, "sitemap"),
+                DEBUG_MODE="False",
+                QUERY_BUDGET_SAMPLE_RATE="0",
+                IMAGE_RENDITION_WORKERS="1",
+            )
+            with ProcessPoolExecutor(
+                max_workers=options["processes"],
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(profile,),
+            ) as executor:
+                futures = [
+                    executor.submit(run_worker, options["duration"], options["threads"], seed)
+                    for seed in range(options["processes"])
+                ]
+                reports = [future.result() for future in futures]
+
+        return self.print_profile(profile, reports, options["duration"])
+
+    def print_profile(self, profile, reports, duration):
+        self.stdout.write(f"Профиль {profile}:")
+        total_lock_errors = 0
+        for name, _ in OPERATIONS:
+            ops = sum(report[name]["ops"] for report in reports)
+            failed = sum(report[name]["failed"] for report in reports)
+            lock_errors = sum(report[name]["lock_errors"] for report in reports)
+            lock_wait = sum(report[name]["lock_wait_ms"] for report in reports)
+            latencies = [value for report in reports for value in report[name]["latencies"]]
+            total_lock_errors += lock_errors
+            self.stdout.write(
+                f"  {name}: {ops} операций ({ops / duration:.1f}/с), неудачных {failed}, "
+                f"ошибок блокировки {lock_errors}, ожидание блокировки {lock_wait / 1000:.2f} с, "
+                f"p50 {percentile(latencies, 50):.1f} мс, p95 {percentile(latencies, 95):.1f} мс, "
+                f"p99 {percentile(latencies, 99):.1f} мс"
+            )
+        return total_lock_errors
@@ -0,0 +1,152 @@
+import logging
+import os
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.template.utils import get_app_template_dirs
+
+from core.fonts import (
+    ALWAYS,
+    CATALOG_MODELS,
+    OUTPUT_DIR,
+    SOURCE_CSS,
+    parse_faces,
+    static_path,
+    subset_of,
+    unicode_range,
+)
+
+BATCH_SIZE = 2000
+
+
+def _kb(size):
+    return f"{size / 1024:.1f}"
+
+
+def template_chars():
+    """Символы шаблонов и скриптов сайта"""
+    dirs = [
+        *(path for engine in settings.TEMPLATES for path in engine.get("DIRS", ())),
+        *get_app_template_dirs("templates"),
+        *(Path(path) / "js" for path in settings.STATICFILES_DIRS),
+    ]
+    chars = set()
+    for directory in dirs:
+        for path in Path(directory).rglob("*"):
+            if path.suffix in (".html", ".txt", ".js"):
+                chars.update(path.read_text(encoding="utf-8", errors="ignore"))
+    return chars
+
+
+def catalog_chars():
+    """Символы текстовых полей моделей CATALOG_MODELS"""
+    chars = set()
+    for name in CATALOG_MODELS:
+        model = apps.get_model("core", name)
+        fields = [
+            field.name
+            for field in model._meta.get_fields()
+            if isinstance(field, (models.CharField, models.TextField)) and not field.choices
+        ]
+        if not fields:
+            continue
+        for row in model.objects.values_list(*fields).iterator(chunk_size=BATCH_SIZE):
+            for value in row:
+                chars.update(value or "")
+    return chars
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит подмножества шрифтов из css/fonts.css: для каждого начертания "
+        "woff2 латиницы и кириллицы только с глифами символов из шаблонов, "
+        "скриптов и текстов каталога, и fonts/fonts.css с unicode-range и "
+        "font-display: swap в static/fonts. Запускается перед build_assets; "
+        "нужен fontTools."
+    )
+
+    def handle(self, *args, **options):
+        try:
+            from fontTools import subset
+            from fontTools.ttLib import TTFont
+        except ImportError as error:
+            raise CommandError("Для подмножеств шрифтов установите fonttools и brotli") from error
+
+        # fontTools предупреждает о каждой служебной таблице, которую
+        # отбрасывает (FFTM от FontForge и подобные)
+        logging.getLogger("fontTools").setLevel(logging.ERROR)
+
+        chars = ALWAYS | template_chars() | catalog_chars()
+        groups = {}
+        for char in chars:
+            # Управляющие символы не рисуются
+            if ord(char) >= 0x20 and not 0x7F <= ord(char) < 0xA0:
+                groups.setdefault(subset_of(char), set()).add(ord(char))
+        self.stdout.write(
+            f"Символов: {sum(len(codes) for codes in groups.values())} "
+            f"({', '.join(f'{name} {len(codes)}' for name, codes in sorted(groups.items()))})"
+        )
+
+        with open(finders.find(SOURCE_CSS), encoding="utf-8") as f:
+            faces = parse_faces(f.read())
+        root = os.path.join(settings.STATICFILES_DIRS[0], OUTPUT_DIR)
+        os.makedirs(root, exist_ok=True)
+        rules, written = [], set()
+        total_before = total_after = 0
+
+        for face in faces:
+            source = finders.find(static_path(face["src"][0]))
+            if source is None:
+                raise CommandError(f"Нет файла шрифта {face['src'][0]}")
+            font = TTFont(source)
+            cmap = set(font.getBestCmap())
+            total_before += os.path.getsize(source)
+            stem = Path(source).name.rsplit(".", 1)[0]
+            sizes = []
+            for name, codes in groups.items():
+                # Символы, которых нет в шрифте, всё равно покажет запасной
+                codes = codes & cmap
+                if not codes:
+                    continue
+                options = subset.Options()
+                options.flavor = "woff2"
+                subsetter = subset.Subsetter(options)
+                subsetter.populate(unicodes=codes)
+                part = TTFont(source)
+                subsetter.subset(part)
+                filename = f"{stem}.{name}.woff2"
+                part.save(os.path.join(root, filename))
+                written.add(filename)
+                size = os.path.getsize(os.path.join(root, filename))
+                sizes.append(f"{name} {_kb(size)}")
+                total_after += size
+                weight = " ".join(str(value) for value in dict.fromkeys(face["weight"]))
+                rules.append(
+                    f"@font-face {{\n"
+                    f"  font-family: '{face['family']}';\n"
+                    f"  src: url('{settings.STATIC_URL.rstrip('/')}/{OUTPUT_DIR}/{filename}') format('woff2');\n"
+                    f"  font-weight: {weight};\n"
+                    f"  font-style: {face['style']};\n"
+                    f"  font-display: swap;\n"
+                    f"  unicode-range: {unicode_range(codes)};\n"
+                    f"}}\n"
+                )
+            self.stdout.write(
+                f"{stem}: {_kb(os.path.getsize(source))} КБ -> {', '.join(sizes)} КБ"
+            )
+
+        with open(os.path.join(root, "fonts.css"), "w", encoding="utf-8") as f:
+            f.write(f"/* Создано командой subset_fonts из {SOURCE_CSS}, не редактировать */\n")
+            f.write("\n".join(rules))
+        written.add("fonts.css")
+        for name in os.listdir(root):
+            if name not in written:
+                os.unlink(os.path.join(root, name))
+        self.stdout.write(
+            f"Шрифты: {_kb(total_before)} -> {_kb(total_after)} КБ во всех начертаниях, "
+            f"записаны в {root}"
+        )
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_alter_arenda_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='notification', to='core.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Уведомление о заказе',
+                'verbose_name_plural': 'Уведомления о заказах',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='core_ordern_status_0dbec9_idx')],
+            },
+        ),
+    ]
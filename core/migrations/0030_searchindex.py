@@ -0,0 +1,60 @@
+from django.db import migrations
+
+TABLE = "core_searchindex"
+
+INDEXED_FIELDS = {
+    "Product": ("name", ("description", "game_rules", "additional_info")),
+    "AdditionalProducts": ("name", ("description", "description_2", "material")),
+}
+
+
+def normalize(text):
+    return (text or "").lower().replace("ё", "е")
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 есть только у SQLite, на других базах поиск идёт через icontains
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "kind UNINDEXED, item_id UNINDEXED, name, body, "
+            "tokenize = 'unicode61 remove_diacritics 0')"
+        )
+        for model_name, (name_field, body_fields) in INDEXED_FIELDS.items():
+            model = apps.get_model("core", model_name)
+            rows = [
+                (
+                    model_name.lower(),
+                    pk,
+                    normalize(name),
+                    "\n".join(map(normalize, body)),
+                )
+                for pk, name, *body in model.objects.values_list(
+                    "pk", name_field, *body_fields
+                )
+            ]
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (kind, item_id, name, body) "
+                "VALUES (%s, %s, %s, %s)",
+                rows,
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_ordernotification'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_searchindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='additionalproducts',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Ключ, по которому позиция сопоставляется со строкой прайс-листа', max_length=64, null=True, unique=True, verbose_name='Артикул'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Ключ, по которому позиция сопоставляется со строкой прайс-листа', max_length=64, null=True, unique=True, verbose_name='Артикул'),
+        ),
+    ]
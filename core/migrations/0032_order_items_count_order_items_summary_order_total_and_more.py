@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_additionalproducts_sku_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Позиций'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_summary',
+            field=models.TextField(blank=True, default='', verbose_name='Состав заказа'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=12, verbose_name='Сумма'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='phone',
+            field=models.CharField(db_index=True, max_length=15, verbose_name='Телефон'),
+        ),
+    ]
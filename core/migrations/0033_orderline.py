@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_order_items_count_order_items_summary_order_total_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0, verbose_name='Порядок')),
+                ('kind', models.CharField(choices=[('product', 'Товар'), ('additional', 'Дополнительный товар'), ('arenda', 'Аренда'), ('game_for_rent', 'Игра для аренды')], max_length=20, verbose_name='Тип позиции')),
+                ('item_id', models.PositiveIntegerField(verbose_name='ID позиции')),
+                ('name', models.CharField(max_length=200, verbose_name='Название')),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена без скидки')),
+                ('discount_name', models.CharField(blank=True, default='', max_length=200, verbose_name='Название скидки')),
+                ('discounted_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена со скидкой')),
+                ('quantity', models.PositiveSmallIntegerField(default=1, verbose_name='Количество')),
+                ('adjustment', models.DecimalField(decimal_places=2, default=1, max_digits=4, verbose_name='Коэффициент 2 в 1')),
+                ('total', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Сумма')),
+                ('discount', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='core.discount', verbose_name='Скидка')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='core.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Позиция заказа',
+                'verbose_name_plural': 'Позиции заказа',
+                'ordering': ['order', 'position'],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_orderline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name='Тип позиции')),
+                ('item_id', models.PositiveIntegerField(verbose_name='ID позиции')),
+                ('base_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена без скидки')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена со скидкой')),
+                ('percentage', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True, verbose_name='Процент скидки')),
+                ('valid_on', models.DateField(verbose_name='Рассчитана на день')),
+                ('valid_until', models.DateField(blank=True, null=True, verbose_name='Действует до')),
+                ('refreshed_at', models.DateTimeField(verbose_name='Пересчитана')),
+                ('discount', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='effective_prices', to='core.discount', verbose_name='Скидка')),
+            ],
+            options={
+                'verbose_name': 'Цена со скидкой',
+                'verbose_name_plural': 'Цены со скидками',
+                'indexes': [models.Index(fields=['kind', 'price'], name='effective_price_sort')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'item_id'), name='effective_price_item')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_effectiveprice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Recommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name='Тип позиции')),
+                ('item_id', models.PositiveIntegerField(verbose_name='ID позиции')),
+                ('products', models.CharField(blank=True, max_length=200, verbose_name='Товары')),
+                ('additional_products', models.CharField(blank=True, max_length=200, verbose_name='Допы')),
+                ('refreshed_at', models.DateTimeField(verbose_name='Пересчитаны')),
+            ],
+            options={
+                'verbose_name': 'Рекомендации',
+                'verbose_name_plural': 'Рекомендации',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'item_id'), name='recommendation_item')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:05
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_recommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceListImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name='Тип позиций')),
+                ('file_name', models.CharField(blank=True, max_length=255, verbose_name='Файл')),
+                ('checksum', models.CharField(blank=True, max_length=64, verbose_name='SHA-256 файла')),
+                ('deactivate_missing', models.BooleanField(default=False, verbose_name='Скрыть позиции, которых нет в файле')),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('failed', 'Прерван'), ('completed', 'Завершён'), ('rolled_back', 'Откачен')], default='running', max_length=20, verbose_name='Статус')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Обработано строк')),
+                ('created', models.PositiveIntegerField(default=0, verbose_name='Создано')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='Изменено')),
+                ('unchanged', models.PositiveIntegerField(default=0, verbose_name='Без изменений')),
+                ('deactivated', models.PositiveIntegerField(default=0, verbose_name='Скрыто')),
+                ('error_count', models.PositiveIntegerField(default=0, verbose_name='Ошибок в строках')),
+                ('last_error', models.TextField(blank=True, verbose_name='Причина остановки')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начат')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Закончен')),
+            ],
+            options={
+                'verbose_name': 'Импорт прайс-листа',
+                'verbose_name_plural': 'Импорты прайс-листов',
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceListImportChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_id', models.PositiveIntegerField(verbose_name='ID позиции')),
+                ('action', models.CharField(choices=[('created', 'Создана'), ('updated', 'Изменена'), ('deactivated', 'Скрыта')], max_length=20, verbose_name='Действие')),
+                ('previous', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Прежние значения')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='core.pricelistimport', verbose_name='Импорт')),
+            ],
+            options={
+                'verbose_name': 'Изменение при импорте',
+                'verbose_name_plural': 'Изменения при импорте',
+            },
+        ),
+    ]
@@ -0,0 +1,121 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.utils import timezone
+
+# Заполняет позиции и сводку заказов, оформленных до появления OrderLine.
+# Исторических цен в базе нет, поэтому, как и core.orders.build_lines,
+# берутся текущие цены и скидки, действующие в день миграции. Логика
+# повторена здесь, потому что миграция работает с историческими моделями.
+
+CHUNK_SIZE = 500
+CENT = Decimal("0.01")
+DOUBLE_GAME_ADJUSTMENT = Decimal("0.9")
+DOUBLE_GAME_QUANTITY = 2
+
+# (связь заказа, тип строки, связь скидки с такими позициями)
+GROUPS = (
+    ("products", "product", "products"),
+    ("additional_products", "additional", "additional_products"),
+    ("arenda", "arenda", "arendas"),
+    ("games_for_rent", "game_for_rent", "products"),
+)
+
+
+def load_discounts(Discount):
+    """(связь скидки, pk позиции) -> скидки в порядке Discount.Meta.ordering"""
+    today = timezone.localdate()
+    discounts = list(
+        Discount.objects.filter(
+            is_active=True, start_date__lte=today, end_date__gte=today
+        ).order_by("-start_date")
+    )
+    links = {}
+    for discount in discounts:
+        for field in ("products", "arendas", "additional_products"):
+            for pk in getattr(discount, field).values_list("pk", flat=True):
+                links.setdefault((field, pk), []).append(discount)
+    return links
+
+
+def discounted(discount, price):
+    if discount.discount_type == "percentage":
+        return price * (1 - discount.value / 100)
+    return max(price - discount.value, 0)
+
+
+def build_line(OrderLine, links, kind, link, item, double):
+    price, best = item.price, None
+    for discount in links.get((link, item.pk), ()):
+        candidate = discounted(discount, item.price)
+        if candidate < price:
+            price, best = candidate, discount
+    price = Decimal(price).quantize(CENT)
+    if double:
+        quantity, adjustment = DOUBLE_GAME_QUANTITY, DOUBLE_GAME_ADJUSTMENT
+    else:
+        quantity, adjustment = 1, Decimal(1)
+    return OrderLine(
+        kind=kind,
+        item_id=item.pk,
+        name=item.name,
+        unit_price=item.price,
+        discount=best,
+        discount_name=best.name if best else "",
+        discounted_price=price,
+        quantity=quantity,
+        adjustment=adjustment,
+        total=(price * adjustment * quantity).quantize(CENT),
+    )
+
+
+def backfill_order_lines(apps, schema_editor):
+    Order = apps.get_model("core", "Order")
+    OrderLine = apps.get_model("core", "OrderLine")
+    links = load_discounts(apps.get_model("core", "Discount"))
+
+    orders = (
+        Order.objects.filter(lines__isnull=True)
+        .order_by("pk")
+        .prefetch_related(*(relation for relation, *_ in GROUPS))
+    )
+    batch, lines = [], []
+    for order in orders.iterator(chunk_size=CHUNK_SIZE):
+        order_lines = [
+            build_line(
+                OrderLine,
+                links,
+                kind,
+                link,
+                item,
+                order.double_game_count == 2 and kind == "product",
+            )
+            for relation, kind, link in GROUPS
+            for item in getattr(order, relation).all()
+        ]
+        for position, line in enumerate(order_lines):
+            line.order_id = order.pk
+            line.position = position
+        order.items_summary = ", ".join(line.name for line in order_lines)
+        order.items_count = len(order_lines)
+        order.total = sum((line.total for line in order_lines), Decimal(0))
+        batch.append(order)
+        lines += order_lines
+        if len(batch) >= CHUNK_SIZE:
+            OrderLine.objects.bulk_create(lines)
+            Order.objects.bulk_update(batch, ["items_summary", "items_count", "total"])
+            batch, lines = [], []
+    OrderLine.objects.bulk_create(lines)
+    Order.objects.bulk_update(batch, ["items_summary", "items_count", "total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_pricelistimport'),
+    ]
+
+    operations = [
+        # Обратно ничего не делается: строки удалит откат 0033_orderline
+        migrations.RunPython(backfill_order_lines, migrations.RunPython.noop),
+    ]
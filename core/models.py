@@ -1,6 +1,12 @@
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from datetime import datetime
 
+from .player_ranges import find_overlap
+from .pricing import resolve_price
+
 
 class Size(models.Model):
     name = models.CharField(max_length=100, verbose_name="Размер")
@@ -94,6 +100,14 @@ class Product(models.Model):
     """Модель товара"""
 
     name = models.CharField(max_length=200, verbose_name="Название")
+    sku = models.CharField(
+        max_length=64,
+        unique=True,
+        blank=True,
+        null=True,
+        verbose_name="Артикул",
+        help_text="Ключ, по которому позиция сопоставляется со строкой прайс-листа",
+    )
     description = models.TextField(
         verbose_name="Описание", blank=True, null=True, default=""
     )
@@ -150,55 +164,11 @@ class Product(models.Model):
 
     def get_discounted_price(self):
         """Возвращает цену товара с учетом активных скидок"""
-        active_discounts = self.discounts.filter(
-            is_active=True,
-            start_date__lte=datetime.now().date(),
-            end_date__gte=datetime.now().date(),
-        )
-
-        if not active_discounts.exists():
-            return self.price
-
-        # Применяем самую выгодную скидку
-        best_price = self.price
-
-        for discount in active_discounts:
-            discounted_price = discount.apply_discount(self.price)
-            if discounted_price < best_price:
-                best_price = discounted_price
-
-        return best_price
+        return resolve_price(self).price
 
     def get_discount_percentage(self):
         """Возвращает процент скидки, если она активна"""
-        active_discounts = self.discounts.filter(
-            is_active=True,
-            start_date__lte=datetime.now().date(),
-            end_date__gte=datetime.now().date(),
-        )
-
-        if not active_discounts.exists():
-            return None
-
-        # Находим самую выгодную скидку
-        best_discount = None
-        best_price = self.price
-
-        for discount in active_discounts:
-            discounted_price = discount.apply_discount(self.price)
-            if discounted_price < best_price:
-                best_price = discounted_price
-                best_discount = discount
-
-        if best_discount:
-            if best_discount.discount_type == "percentage":
-                return best_discount.value
-            else:  # FIXED
-                # Вычисляем эквивалентный процент скидки для фиксированной суммы
-                discount_amount = self.price - best_price
-                discount_percentage = (discount_amount / self.price) * 100
-                return round(discount_percentage)
-        return None
+        return resolve_price(self).percentage
 
 
 class ProductImage(models.Model):
@@ -244,6 +214,22 @@ class PlayerRange(models.Model):
         verbose_name = "Диапазон игроков"
         verbose_name_plural = "Диапазоны игроков"
 
+    def clean(self):
+        if self.min_players is None or self.max_players is None:
+            return
+        if self.min_players > self.max_players:
+            raise ValidationError("Минимальное количество игроков больше максимального")
+        if (
+            self.min_game_count is not None
+            and self.max_game_count is not None
+            and self.min_game_count > self.max_game_count
+        ):
+            raise ValidationError("Минимальное количество игр больше максимального")
+        # Калькулятор ищет один диапазон на число гостей, пересечений быть не должно
+        overlap = find_overlap(self.min_players, self.max_players, exclude_pk=self.pk)
+        if overlap is not None:
+            raise ValidationError(f"Диапазон пересекается с уже заданным: {overlap}")
+
     def __str__(self):
         return f"{self.min_players}-{self.max_players}: {self.min_game_count}-{self.max_game_count} игр"
 
@@ -292,55 +278,11 @@ class Arenda(models.Model):
 
     def get_discounted_price(self):
         """Возвращает цену аренды с учетом активных скидок"""
-        active_discounts = self.discounts.filter(
-            is_active=True,
-            start_date__lte=datetime.now().date(),
-            end_date__gte=datetime.now().date(),
-        )
-
-        if not active_discounts.exists():
-            return self.price
-
-        # Применяем самую выгодную скидку
-        best_price = self.price
-
-        for discount in active_discounts:
-            discounted_price = discount.apply_discount(self.price)
-            if discounted_price < best_price:
-                best_price = discounted_price
-
-        return best_price
+        return resolve_price(self).price
 
     def get_discount_percentage(self):
         """Возвращает процент скидки, если она активна"""
-        active_discounts = self.discounts.filter(
-            is_active=True,
-            start_date__lte=datetime.now().date(),
-            end_date__gte=datetime.now().date(),
-        )
-
-        if not active_discounts.exists():
-            return None
-
-        # Находим самую выгодную скидку
-        best_discount = None
-        best_price = self.price
-
-        for discount in active_discounts:
-            discounted_price = discount.apply_discount(self.price)
-            if discounted_price < best_price:
-                best_price = discounted_price
-                best_discount = discount
-
-        if best_discount:
-            if best_discount.discount_type == "percentage":
-                return best_discount.value
-            else:  # FIXED
-                # Вычисляем эквивалентный процент скидки для фиксированной суммы
-                discount_amount = self.price - best_price
-                discount_percentage = (discount_amount / self.price) * 100
-                return round(discount_percentage)
-        return None
+        return resolve_price(self).percentage
 
     def get_time_in_hours(self):
         """Возвращает время аренды в часах"""
@@ -419,6 +361,14 @@ class AdditionalProducts(models.Model):
     ]
 
     name = models.CharField(max_length=200, verbose_name="Название")
+    sku = models.CharField(
+        max_length=64,
+        unique=True,
+        blank=True,
+        null=True,
+        verbose_name="Артикул",
+        help_text="Ключ, по которому позиция сопоставляется со строкой прайс-листа",
+    )
     description = models.TextField(
         verbose_name="Описание", blank=True, null=True, default=""
     )
@@ -459,34 +409,7 @@ class AdditionalProducts(models.Model):
 
     def get_discount_percentage(self):
         """Возвращает процент скидки, если она активна"""
-        active_discounts = self.discounts.filter(
-            is_active=True,
-            start_date__lte=datetime.now().date(),
-            end_date__gte=datetime.now().date(),
-        )
-
-        if not active_discounts.exists():
-            return None
-
-        # Находим самую выгодную скидку
-        best_discount = None
-        best_price = self.price
-
-        for discount in active_discounts:
-            discounted_price = discount.apply_discount(self.price)
-            if discounted_price < best_price:
-                best_price = discounted_price
-                best_discount = discount
-
-        if best_discount:
-            if best_discount.discount_type == "percentage":
-                return best_discount.value
-            else:  # FIXED
-                # Вычисляем эквивалентный процент скидки для фиксированной суммы
-                discount_amount = self.price - best_price
-                discount_percentage = (discount_amount / self.price) * 100
-                return round(discount_percentage)
-        return None
+        return resolve_price(self).percentage
 
     def get_total_price(self):
         """Возвращает общую сумму заказа с учетом скидок"""
@@ -516,24 +439,7 @@ class AdditionalProducts(models.Model):
 
     def get_discounted_price(self):
         """Возвращает цену дополнительного товара с учетом активных скидок"""
-        active_discounts = self.discounts.filter(
-            is_active=True,
-            start_date__lte=datetime.now().date(),
-            end_date__gte=datetime.now().date(),
-        )
-
-        if not active_discounts.exists():
-            return self.price
-
-        # Применяем самую выгодную скидку
-        best_price = self.price
-
-        for discount in active_discounts:
-            discounted_price = discount.apply_discount(self.price)
-            if discounted_price < best_price:
-                best_price = discounted_price
-
-        return best_price
+        return resolve_price(self).price
 
 
 class AdditionalProductsImage(models.Model):
@@ -561,7 +467,7 @@ class Order(models.Model):
     """Модель заказа"""
 
     name = models.CharField(max_length=100, verbose_name="Имя")
-    phone = models.CharField(max_length=15, verbose_name="Телефон")
+    phone = models.CharField(max_length=15, verbose_name="Телефон", db_index=True)
     order_type = models.CharField(
         max_length=10,
         choices=[
@@ -609,7 +515,17 @@ class Order(models.Model):
         choices=[(1, "1 игра"), (2, "2 игры")],
         default=1,
     )
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name="Дата создания", db_index=True
+    )
+
+    # Сводка заказа записывается при создании (core.orders), чтобы список
+    # заказов в админке не загружал связи каждой строки
+    items_summary = models.TextField(blank=True, default="", verbose_name="Состав заказа")
+    items_count = models.PositiveIntegerField(default=0, verbose_name="Позиций")
+    total = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, db_index=True, verbose_name="Сумма"
+    )
 
     class Meta:
         verbose_name = "Заказ"
@@ -619,30 +535,104 @@ class Order(models.Model):
         return f"Заказ от {self.name} ({self.created_at})"
 
     def get_total_price(self):
-        """Возвращает общую сумму заказа с учетом скидок"""
-        total = 0
+        """Возвращает общую сумму заказа с учетом скидок на момент заказа"""
+        return self.total
 
-        # Товары
-        for product in self.products.all():
-            # Если выбрано 2 игры на одной доске, то цена за каждую игру уменьшается на 10%
-            if self.double_game_count == 2:
-                total += product.get_discounted_price() * 0.9 * 2
-            else:
-                total += product.get_discounted_price()
 
-        # Дополнительные товары
-        for additional_product in self.additional_products.all():
-            total += additional_product.get_discounted_price()
+class OrderLine(models.Model):
+    """Позиция заказа с ценой, зафиксированной при оформлении.
 
-        # Аренды
-        for arenda in self.arenda.all():
-            total += arenda.get_discounted_price()
+    Строка не ссылается на товар внешним ключом и хранит его название и
+    цены, поэтому не меняется при изменении каталога и скидок. После
+    создания строку нельзя изменить, только удалить.
+    """
 
-        # Игры для аренды
-        for game in self.games_for_rent.all():
-            total += game.get_discounted_price()
+    class Kind(models.TextChoices):
+        PRODUCT = "product", "Товар"
+        ADDITIONAL = "additional", "Дополнительный товар"
+        ARENDA = "arenda", "Аренда"
+        GAME_FOR_RENT = "game_for_rent", "Игра для аренды"
 
-        return total
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="lines", verbose_name="Заказ"
+    )
+    position = models.PositiveSmallIntegerField(default=0, verbose_name="Порядок")
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name="Тип позиции")
+    item_id = models.PositiveIntegerField(verbose_name="ID позиции")
+    name = models.CharField(max_length=200, verbose_name="Название")
+    unit_price = models.DecimalField(
+        max_digits=10, decimal_places=2, verbose_name="Цена без скидки"
+    )
+    discount = models.ForeignKey(
+        "Discount",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="order_lines",
+        verbose_name="Скидка",
+    )
+    discount_name = models.CharField(
+        max_length=200, blank=True, default="", verbose_name="Название скидки"
+    )
+    discounted_price = models.DecimalField(
+        max_digits=10, decimal_places=2, verbose_name="Цена со скидкой"
+    )
+    quantity = models.PositiveSmallIntegerField(default=1, verbose_name="Количество")
+    # Множитель цены: 0.9 для игры на доске "2 в 1", иначе 1
+    adjustment = models.DecimalField(
+        max_digits=4, decimal_places=2, default=1, verbose_name="Коэффициент 2 в 1"
+    )
+    total = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Сумма")
+
+    class Meta:
+        verbose_name = "Позиция заказа"
+        verbose_name_plural = "Позиции заказа"
+        ordering = ["order", "position"]
+
+    def __str__(self):
+        return f"{self.name} × {self.quantity}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Позиция заказа не изменяется после создания")
+        super().save(*args, **kwargs)
+
+
+class OrderNotification(models.Model):
+    """Уведомление о заказе в Telegram, ожидающее отправки (outbox)"""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Ожидает отправки"
+        SENT = "sent", "Отправлено"
+        FAILED = "failed", "Ошибка"
+
+    order = models.OneToOneField(
+        Order,
+        on_delete=models.CASCADE,
+        related_name="notification",
+        verbose_name="Заказ",
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name="Статус",
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now, verbose_name="Следующая попытка"
+    )
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата отправки")
+
+    class Meta:
+        verbose_name = "Уведомление о заказе"
+        verbose_name_plural = "Уведомления о заказах"
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"Уведомление о заказе {self.order_id} ({self.get_status_display()})"
 
 
 class OrderedGameKitItem(models.Model):
@@ -710,11 +700,150 @@ class Discount(models.Model):
         if not self.is_active:
             return original_price
 
-        today = datetime.now().date()
+        today = timezone.localdate()
         if not (self.start_date <= today <= self.end_date):
             return original_price
 
+        return self.calculate_price(original_price)
+
+    def calculate_price(self, original_price):
+        """Считает цену со скидкой без проверки активности и сроков"""
         if self.discount_type == DiscountType.PERCENTAGE:
             return original_price * (1 - self.value / 100)
         else:  # FIXED
             return max(original_price - self.value, 0)
+
+
+class EffectivePrice(models.Model):
+    """Цена позиции с учётом скидок на день valid_on (core.pricing).
+
+    Одна строка на товар, аренду или доп. Таблица пересчитывается пачкой
+    при изменении скидок и цен и в дни начала и окончания скидок, а
+    страницы и заказы читают готовую цену вместо перебора скидок.
+    """
+
+    kind = models.CharField(max_length=20, verbose_name="Тип позиции")
+    item_id = models.PositiveIntegerField(verbose_name="ID позиции")
+    base_price = models.DecimalField(
+        max_digits=10, decimal_places=2, verbose_name="Цена без скидки"
+    )
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена со скидкой")
+    percentage = models.DecimalField(
+        max_digits=5, decimal_places=2, null=True, blank=True, verbose_name="Процент скидки"
+    )
+    discount = models.ForeignKey(
+        Discount,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="effective_prices",
+        verbose_name="Скидка",
+    )
+    valid_on = models.DateField(verbose_name="Рассчитана на день")
+    # Первый день, когда начинается или заканчивается какая-то скидка и цену
+    # нужно пересчитать; None — таких дней не запланировано
+    valid_until = models.DateField(null=True, blank=True, verbose_name="Действует до")
+    refreshed_at = models.DateTimeField(verbose_name="Пересчитана")
+
+    class Meta:
+        verbose_name = "Цена со скидкой"
+        verbose_name_plural = "Цены со скидками"
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "item_id"], name="effective_price_item")
+        ]
+        indexes = [models.Index(fields=["kind", "price"], name="effective_price_sort")]
+
+    def __str__(self):
+        return f"{self.kind} #{self.item_id}: {self.price}"
+
+
+class Recommendation(models.Model):
+    """Рекомендации «Смотрите также» для страницы позиции (core.recommendations).
+
+    Одна строка на товар или доп: pk рекомендуемых товаров и допов через
+    запятую, лучшие первыми. Таблица перестраивается целиком в фоне после
+    изменений каталога и заказов.
+    """
+
+    kind = models.CharField(max_length=20, verbose_name="Тип позиции")
+    item_id = models.PositiveIntegerField(verbose_name="ID позиции")
+    products = models.CharField(max_length=200, blank=True, verbose_name="Товары")
+    additional_products = models.CharField(max_length=200, blank=True, verbose_name="Допы")
+    refreshed_at = models.DateTimeField(verbose_name="Пересчитаны")
+
+    class Meta:
+        verbose_name = "Рекомендации"
+        verbose_name_plural = "Рекомендации"
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "item_id"], name="recommendation_item")
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.item_id}"
+
+
+class PriceListImport(models.Model):
+    """Запуск импорта прайс-листа (core.importer).
+
+    Импорт коммитится пачками, а запись хранит, сколько строк файла уже
+    применено: прерванный импорт того же файла можно продолжить с этого
+    места, а изменения запуска — откатить по PriceListImportChange.
+    """
+
+    class Status(models.TextChoices):
+        RUNNING = "running", "Выполняется"
+        FAILED = "failed", "Прерван"
+        COMPLETED = "completed", "Завершён"
+        ROLLED_BACK = "rolled_back", "Откачен"
+
+    kind = models.CharField(max_length=20, verbose_name="Тип позиций")
+    file_name = models.CharField(max_length=255, blank=True, verbose_name="Файл")
+    checksum = models.CharField(max_length=64, blank=True, verbose_name="SHA-256 файла")
+    deactivate_missing = models.BooleanField(
+        default=False, verbose_name="Скрыть позиции, которых нет в файле"
+    )
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.RUNNING, verbose_name="Статус"
+    )
+    rows = models.PositiveIntegerField(default=0, verbose_name="Обработано строк")
+    created = models.PositiveIntegerField(default=0, verbose_name="Создано")
+    updated = models.PositiveIntegerField(default=0, verbose_name="Изменено")
+    unchanged = models.PositiveIntegerField(default=0, verbose_name="Без изменений")
+    deactivated = models.PositiveIntegerField(default=0, verbose_name="Скрыто")
+    error_count = models.PositiveIntegerField(default=0, verbose_name="Ошибок в строках")
+    last_error = models.TextField(blank=True, verbose_name="Причина остановки")
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name="Начат")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Закончен")
+
+    class Meta:
+        verbose_name = "Импорт прайс-листа"
+        verbose_name_plural = "Импорты прайс-листов"
+
+    def __str__(self):
+        return f"Импорт #{self.pk} {self.file_name} ({self.get_status_display()})"
+
+
+class PriceListImportChange(models.Model):
+    """Позиция, изменённая запуском импорта, и что вернуть при откате"""
+
+    class Action(models.TextChoices):
+        CREATED = "created", "Создана"
+        UPDATED = "updated", "Изменена"
+        DEACTIVATED = "deactivated", "Скрыта"
+
+    run = models.ForeignKey(
+        PriceListImport, on_delete=models.CASCADE, related_name="changes", verbose_name="Импорт"
+    )
+    item_id = models.PositiveIntegerField(verbose_name="ID позиции")
+    action = models.CharField(max_length=20, choices=Action.choices, verbose_name="Действие")
+    # Прежние значения изменённых полей и фильтров: {"fields": {...}, "links": {...}}
+    previous = models.JSONField(
+        default=dict, blank=True, encoder=DjangoJSONEncoder, verbose_name="Прежние значения"
+    )
+
+    class Meta:
+        verbose_name = "Изменение при импорте"
+        verbose_name_plural = "Изменения при импорте"
+
+    def __str__(self):
+        return f"{self.get_action_display()} #{self.item_id}"
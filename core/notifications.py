@@ -0,0 +1,192 @@
+"""Уведомления о заказах в Telegram через outbox.
+
+Запись OrderNotification создаётся в той же транзакции, что и заказ, —
+ровно одна на заказ, сколько бы связей заказа ни менялось. Отправляет
+уведомления отдельный долгоживущий процесс (manage.py run_telegram_worker):
+он переиспользует одного бота и одну HTTP-сессию, забирает уведомления
+пачками и повторяет неудачные отправки с экспоненциальной задержкой.
+
+Текст из формы заказа и названия позиций экранируются под Markdown; если
+Telegram всё же не разобрал разметку, сообщение уходит простым текстом.
+"""
+
+import asyncio
+import logging
+from datetime import timedelta
+
+import telegram.error
+from telegram.helpers import escape_markdown
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import OrderLine, OrderNotification
+from .tg_bot import create_bot
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 8
+# Задержка перед повтором: BASE_RETRY_DELAY * 2^попытка, но не больше MAX_RETRY_DELAY
+BASE_RETRY_DELAY = 5
+MAX_RETRY_DELAY = 60 * 60
+
+
+def enqueue_order_notification(order):
+    """Ставит уведомление о заказе в очередь (вызывается в транзакции заказа)"""
+    OrderNotification.objects.create(order=order)
+
+
+def _escape(text):
+    return escape_markdown(str(text), version=1)
+
+
+def _format_lines(lines):
+    if not lines:
+        return "Нет"
+    return ", ".join(
+        f"{_escape(line.name)} × {line.quantity}" if line.quantity > 1 else _escape(line.name)
+        for line in lines
+    )
+
+
+def format_order_message(order):
+    """Формирует текст уведомления о заказе по позициям, записанным при оформлении"""
+    by_kind = {kind: [] for kind in OrderLine.Kind}
+    for line in order.lines.all():
+        by_kind[line.kind].append(line)
+    products = by_kind[OrderLine.Kind.PRODUCT]
+
+    # Игры для 2 в 1 — это товары заказа соответствующего типа
+    double_buy_games = products if order.order_type == "double_buy" else []
+
+    return f"""
+📦 *Новый заказ!* 📦
+👤 **Имя:** {_escape(order.name)}
+📞 **Телефон:** {_escape(order.phone)}
+📋 **Тип заказа:** {order.get_order_type_display()}
+📅 **Дата заказа:** {order.date.strftime("%d.%m.%Y") if order.date else "Не указана"}
+⏰ **Время заказа:** {order.time.strftime("%H:%M") if order.time else "Не указано"}
+
+🎮 **Товары:** {_format_lines(products)}
+🎮 **Дополнительные товары:** {_format_lines(by_kind[OrderLine.Kind.ADDITIONAL])}
+🎮 **Аренды:** {_format_lines(by_kind[OrderLine.Kind.ARENDA])}
+🎮 **Игры для аренды:** {_format_lines(by_kind[OrderLine.Kind.GAME_FOR_RENT])}
+🎮 **Игры для 2 в 1:** {_format_lines(double_buy_games)}
+💰 **Сумма:** {order.total} ₽
+
+💬 **Комментарий:** {_escape(order.comment) if order.comment else "Нет"}
+
+🔗 **Подробнее:** [Ссылка на заказ](http://127.0.0.1:8000/admin/core/order/{order.id}/change/)
+        """
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(BASE_RETRY_DELAY * 2 ** attempts, MAX_RETRY_DELAY))
+
+
+def claim_batch(batch_size=BATCH_SIZE):
+    """Возвращает пачку уведомлений, которые пора отправить, с готовыми текстами"""
+    notifications = list(
+        OrderNotification.objects.filter(
+            status=OrderNotification.Status.PENDING,
+            next_attempt_at__lte=timezone.now(),
+        )
+        .select_related("order")
+        .prefetch_related("order__lines")
+        .order_by("next_attempt_at")[:batch_size]
+    )
+    return [
+        (notification, format_order_message(notification.order))
+        for notification in notifications
+    ]
+
+
+def save_results(notifications):
+    OrderNotification.objects.bulk_update(
+        notifications,
+        ["status", "attempts", "next_attempt_at", "last_error", "sent_at"],
+    )
+
+
+class NotificationWorker:
+    """Отправляет уведомления из outbox одним долгоживущим ботом"""
+
+    def __init__(self, token=None, chat_id=None, batch_size=BATCH_SIZE, poll_interval=2):
+        self.bot = create_bot(token or settings.TELEGRAM_BOT_API_KEY)
+        self.chat_id = chat_id or settings.TELEGRAM_USER_ID
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+    async def run(self, once=False):
+        async with self.bot:
+            while True:
+                processed = await self.process_batch()
+                if once:
+                    return processed
+                if not processed:
+                    await asyncio.sleep(self.poll_interval)
+
+    async def process_batch(self):
+        """Отправляет одну пачку уведомлений, возвращает их количество"""
+        batch = await sync_to_async(claim_batch)(self.batch_size)
+        for notification, message in batch:
+            if not await self.send(notification, message):
+                # Telegram ограничил частоту: остальные уведомления пачки ждут
+                break
+        if batch:
+            await sync_to_async(save_results)([n for n, _ in batch])
+        return len(batch)
+
+    async def send(self, notification, message):
+        """Отправляет уведомление; возвращает False, если Telegram просит подождать"""
+        notification.attempts += 1
+        try:
+            try:
+                await self.bot.send_message(
+                    chat_id=self.chat_id, text=message, parse_mode="Markdown"
+                )
+            except telegram.error.BadRequest as e:
+                # Разметку сломал текст заказа: без неё сообщение всё равно дойдёт
+                logger.warning(
+                    "Уведомление о заказе %s отправляется без разметки: %s",
+                    notification.order_id,
+                    e,
+                )
+                await self.bot.send_message(chat_id=self.chat_id, text=message)
+        except telegram.error.RetryAfter as e:
+            # Telegram сам говорит, сколько ждать; попытка не засчитывается
+            notification.attempts -= 1
+            retry_after = e.retry_after
+            if not isinstance(retry_after, timedelta):
+                retry_after = timedelta(seconds=retry_after)
+            self._retry(notification, str(e), retry_after)
+            return False
+        except telegram.error.BadRequest as e:
+            # Telegram отклонил и простой текст, повтор не поможет
+            self._fail(notification, str(e))
+        except Exception as e:
+            self._retry(notification, str(e), retry_delay(notification.attempts))
+        else:
+            notification.status = OrderNotification.Status.SENT
+            notification.sent_at = timezone.now()
+            notification.last_error = ""
+            logger.info("Уведомление о заказе %s отправлено", notification.order_id)
+        return True
+
+    def _retry(self, notification, error, delay):
+        if notification.attempts >= MAX_ATTEMPTS:
+            self._fail(notification, error)
+            return
+        notification.next_attempt_at = timezone.now() + delay
+        notification.last_error = error
+        logger.warning(
+            "Ошибка отправки уведомления о заказе %s: %s", notification.order_id, error
+        )
+
+    def _fail(self, notification, error):
+        notification.status = OrderNotification.Status.FAILED
+        notification.last_error = error
+        logger.error(
+            "Уведомление о заказе %s не отправлено: %s", notification.order_id, error
+        )
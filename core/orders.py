@@ -0,0 +1,239 @@
+"""Приём заказов с сайта.
+
+Все входные данные проверяются до записи в базу: идентификаторы товаров,
+допов и аренд — одним запросом IN на каждый тип. Затем заказ и все строки
+связующих таблиц вставляются пачками в одной транзакции, так что
+наполовину записанных заказов не бывает.
+
+Для каждой позиции пишется строка OrderLine с ценой и скидкой на момент
+заказа, а в сам заказ — сводка: названия, количество позиций и сумма.
+Строки строятся из уже загруженных при проверке позиций и не стоят
+лишних запросов; дальше сумма и состав заказа читаются из них, а не
+пересчитываются по текущим скидкам.
+"""
+
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from .models import AdditionalProducts, Arenda, Order, OrderLine, Product
+from .pricing import get_discount_table
+
+ORDER_TYPES = {value for value, _ in Order._meta.get_field("order_type").choices}
+ENGRAVING_CHOICES = {value for value, _ in Order._meta.get_field("engraving").choices}
+# Две игры на одной доске: каждая игра на 10% дешевле, игр на доске две
+DOUBLE_GAME_ADJUSTMENT = Decimal("0.9")
+DOUBLE_GAME_QUANTITY = 2
+CENT = Decimal("0.01")
+
+
+def _parse_ids(values, label):
+    try:
+        ids = [int(value) for value in values if value != ""]
+    except (TypeError, ValueError):
+        raise ValidationError(f"Некорректный идентификатор в поле «{label}»")
+    # Повторы не нужны: в связующей таблице пара (заказ, товар) уникальна
+    return list(dict.fromkeys(ids))
+
+
+def _check_exist(model, ids, label):
+    """Проверяет одним запросом, что все ids есть среди активных позиций.
+
+    Возвращает найденные позиции по pk — из них строится сводка заказа.
+    """
+    if not ids:
+        return {}
+    found = model.objects.filter(pk__in=ids, is_active=True).only("name", "price").in_bulk()
+    missing = [pk for pk in ids if pk not in found]
+    if missing:
+        raise ValidationError(
+            f"{label}: позиции {', '.join(map(str, missing))} недоступны для заказа"
+        )
+    return found
+
+
+def _required(data, field, label):
+    value = (data.get(field) or "").strip()
+    if not value:
+        raise ValidationError(f"Не заполнено поле «{label}»")
+    return value
+
+
+class OrderRequest:
+    """Проверенные данные заказа, готовые к записи"""
+
+    def __init__(self, order, products, additional_products, arenda, games_for_rent, lines):
+        self.order = order
+        self.products = products
+        self.additional_products = additional_products
+        self.arenda = arenda
+        self.games_for_rent = games_for_rent
+        self.lines = lines
+
+
+def parse_order(data):
+    """Проверяет данные формы заказа. Бросает ValidationError, не трогая базу на запись"""
+    order_type = data.get("order_type")
+    if order_type not in ORDER_TYPES:
+        raise ValidationError("Выберите тип заказа")
+
+    order = Order(
+        name=_required(data, "name", "Имя"),
+        phone=_required(data, "phone", "Телефон"),
+        order_type=order_type,
+        comment=data.get("comment", ""),
+    )
+
+    products, additional_products, arenda, games_for_rent = [], [], [], []
+
+    if order_type in ("buy", "double_buy"):
+        products = _parse_ids(data.getlist("buy_games"), "Игры")
+        additional_products = _parse_ids(
+            data.getlist("additional_goods"), "Дополнительные товары"
+        )
+        order.delivery_address = data.get("delivery_address")
+        order.engraving = data.get("engraving") or "no"
+        if order.engraving not in ENGRAVING_CHOICES:
+            raise ValidationError("Некорректное значение гравировки")
+        # Для "2 игры на одной доске" количество игр на доске всегда 2
+        order.double_game_count = 2 if order_type == "double_buy" else 1
+
+    elif order_type == "rent":
+        games_for_rent = _parse_ids(data.getlist("rent_games"), "Игры для аренды")
+        arenda = _parse_ids([data.get("rent_type", "")], "Аренда")
+        if data.get("rent_date"):
+            rent_date = parse_date(data.get("rent_date"))
+            if rent_date is None:
+                raise ValidationError("Некорректная дата аренды")
+            order.date = rent_date
+        order.delivery_address = data.get("rent_address")
+
+    # Игры для покупки и для аренды проверяются одним запросом
+    games = _check_exist(Product, list(dict.fromkeys(products + games_for_rent)), "Игры")
+    additional = _check_exist(AdditionalProducts, additional_products, "Дополнительные товары")
+    rents = _check_exist(Arenda, arenda, "Аренда")
+
+    lines = build_lines(
+        order,
+        [games[pk] for pk in products],
+        [additional[pk] for pk in additional_products],
+        [rents[pk] for pk in arenda],
+        [games[pk] for pk in games_for_rent],
+    )
+    summarize(order, lines)
+    return OrderRequest(order, products, additional_products, arenda, games_for_rent, lines)
+
+
+def _line(table, kind, item, double):
+    resolved = table.resolve(item)
+    if double:
+        quantity, adjustment = DOUBLE_GAME_QUANTITY, DOUBLE_GAME_ADJUSTMENT
+    else:
+        quantity, adjustment = 1, Decimal(1)
+    price = Decimal(resolved.price).quantize(CENT)
+    return OrderLine(
+        kind=kind,
+        item_id=item.pk,
+        name=item.name,
+        unit_price=item.price,
+        discount=resolved.discount,
+        discount_name=resolved.discount.name if resolved.discount else "",
+        discounted_price=price,
+        quantity=quantity,
+        adjustment=adjustment,
+        total=(price * adjustment * quantity).quantize(CENT),
+    )
+
+
+def build_lines(order, products, additional_products, arenda, games_for_rent):
+    """Несохранённые строки заказа по ценам со скидками на текущий день"""
+    table = get_discount_table()
+    double = order.double_game_count == 2
+    groups = (
+        (OrderLine.Kind.PRODUCT, products),
+        (OrderLine.Kind.ADDITIONAL, additional_products),
+        (OrderLine.Kind.ARENDA, arenda),
+        (OrderLine.Kind.GAME_FOR_RENT, games_for_rent),
+    )
+    return [
+        _line(table, kind, item, double and kind == OrderLine.Kind.PRODUCT)
+        for kind, items in groups
+        for item in items
+    ]
+
+
+def summarize(order, lines):
+    """Записывает в заказ состав, число позиций и сумму строк (без сохранения)"""
+    order.items_summary = ", ".join(line.name for line in lines)
+    order.items_count = len(lines)
+    order.total = sum((line.total for line in lines), Decimal(0))
+
+
+def related_items(order):
+    """Позиции заказа из его связей в порядке аргументов build_lines"""
+    return (
+        list(order.products.all()),
+        list(order.additional_products.all()),
+        list(order.arenda.all()),
+        list(order.games_for_rent.all()),
+    )
+
+
+def _key(line):
+    return line.kind, line.item_id, line.quantity
+
+
+def sync_lines(order):
+    """Приводит строки заказа к его связям после правки в админке.
+
+    Строки оставшихся позиций сохраняют цену на момент заказа, для
+    добавленных позиций строки создаются по текущим ценам.
+    """
+    with transaction.atomic():
+        existing = list(order.lines.all())
+        wanted = {_key(line): line for line in build_lines(order, *related_items(order))}
+        kept = [line for line in existing if _key(line) in wanted]
+        removed = [line.pk for line in existing if _key(line) not in wanted]
+        kept_keys = {_key(line) for line in kept}
+        added = [line for key, line in wanted.items() if key not in kept_keys]
+
+        if removed:
+            order.lines.filter(pk__in=removed).delete()
+        position = max((line.position for line in kept), default=-1) + 1
+        for offset, line in enumerate(added):
+            line.order_id = order.pk
+            line.position = position + offset
+        OrderLine.objects.bulk_create(added)
+
+        summarize(order, kept + added)
+        order.save(update_fields=["items_summary", "items_count", "total"])
+
+
+def save_order(request):
+    """Сохраняет заказ и его связи одной транзакцией"""
+    order = request.order
+    relations = (
+        (Order.products.through, "product_id", request.products),
+        (Order.additional_products.through, "additionalproducts_id", request.additional_products),
+        (Order.arenda.through, "arenda_id", request.arenda),
+        (Order.games_for_rent.through, "product_id", request.games_for_rent),
+    )
+    with transaction.atomic():
+        order.save()
+        for through, column, ids in relations:
+            if ids:
+                through.objects.bulk_create(
+                    [through(order_id=order.pk, **{column: pk}) for pk in ids]
+                )
+        for position, line in enumerate(request.lines):
+            line.order_id = order.pk
+            line.position = position
+        OrderLine.objects.bulk_create(request.lines)
+    return order
+
+
+def create_order(data):
+    """Проверяет и сохраняет заказ из данных формы"""
+    return save_order(parse_order(data))
@@ -0,0 +1,328 @@
+"""Кэш готовых страниц каталога для анонимных посетителей.
+
+Запись в кэше хранится по ключу "путь + нормализованная строка запроса".
+Вместе с HTML сохраняется отпечаток: версии моделей, от которых зависит
+страница, и текущий день по Москве (от него зависят сроки скидок). Если
+отпечаток не совпал, страницу перестраивает один воркер, а остальные до
+конца перестройки отдают устаревшую копию.
+
+Тот же отпечаток вместе с идентификатором сборки (шаблоны и статика)
+служит валидатором для условных запросов: ETag — хэш отпечатка,
+Last-Modified — самое позднее из времени изменения версий, начала дня и
+сборки. Если у клиента актуальная копия, он получает 304 до рендеринга и
+до чтения записи из кэша. conditional и ConditionalPageMixin дают то же
+самое страницам, которые не кэшируются целиком.
+
+aserve, aconditional и Async*-миксины — те же пути для ASGI: версии и
+запись читаются из кэша без занятия потока, в поток уходит только
+построение страницы.
+
+В кэшируемые страницы не должно попадать ничего личного для посетителя,
+в том числе csrf-токен: форма заказа выводится без него, ProcessOrderView
+принимает заказы без проверки csrf.
+"""
+
+import functools
+import hashlib
+import os
+import time
+from datetime import datetime, time as day_start
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.utils import get_app_template_dirs
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .versioning import aget_versions, bump_version, get_versions, version_time
+
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Сколько секунд воркер держит право на перестройку страницы
+REBUILD_LOCK_TIMEOUT = 30
+
+# Метки рекламных кампаний не меняют содержимое страницы
+IGNORED_QUERY_PARAMS = {"gclid", "yclid", "fbclid", "_openstat", "from"}
+
+
+def _namespace(model_name):
+    return f"page:{model_name}"
+
+
+def invalidate_pages(model_name):
+    """Сбрасывает все страницы, зависящие от модели model_name"""
+    bump_version(_namespace(model_name))
+
+
+def normalize_query(query_dict):
+    """Сортирует параметры и отбрасывает пустые и рекламные"""
+    items = sorted(
+        (key, value)
+        for key, values in query_dict.lists()
+        if key not in IGNORED_QUERY_PARAMS and not key.startswith("utm_")
+        for value in values
+        if value
+    )
+    return urlencode(items)
+
+
+def _cache_key(request):
+    raw = f"{request.path}?{normalize_query(request.GET)}"
+    return "page:" + hashlib.md5(raw.encode()).hexdigest()
+
+
+@functools.cache
+def build_info():
+    """(идентификатор, время) сборки шаблонов и статики, считается раз на процесс"""
+    if settings.BUILD_ID:
+        return settings.BUILD_ID, _build_time()
+    latest, count = _scan_sources()
+    return f"{latest:x}-{count:x}", latest // 10**9
+
+
+def _build_time():
+    """Время сборки с BUILD_ID: BUILD_TIME, затем манифест collectstatic, затем исходники.
+
+    Время старта процесса не подходит: каждый перезапуск воркера сдвигал бы
+    Last-Modified, хотя страницы не менялись.
+    """
+    if settings.BUILD_TIME:
+        return int(settings.BUILD_TIME)
+    manifest_name = getattr(staticfiles_storage, "manifest_name", None)
+    if manifest_name and settings.STATIC_ROOT:
+        try:
+            return int(os.stat(os.path.join(settings.STATIC_ROOT, manifest_name)).st_mtime)
+        except OSError:
+            pass
+    return _scan_sources()[0] // 10**9
+
+
+def _scan_sources():
+    """(самое позднее время изменения в нс, число файлов) шаблонов и статики"""
+    dirs = [
+        *(path for engine in settings.TEMPLATES for path in engine.get("DIRS", ())),
+        *get_app_template_dirs("templates"),
+        *settings.STATICFILES_DIRS,
+    ]
+    latest, count = 0, 0
+    for directory in dirs:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                latest = max(latest, os.stat(os.path.join(root, name)).st_mtime_ns)
+                count += 1
+    return latest, count
+
+
+def _fingerprint(dependencies):
+    versions = get_versions(_namespace(name) for name in dependencies)
+    return (timezone.localdate().isoformat(), build_info()[0]) + versions
+
+
+async def _afingerprint(dependencies):
+    versions = await aget_versions(_namespace(name) for name in dependencies)
+    return (timezone.localdate().isoformat(), build_info()[0]) + versions
+
+
+class Validators:
+    """ETag и Last-Modified страницы для её отпечатка"""
+
+    def __init__(self, key, fingerprint):
+        # Слабый ETag: считается по отпечатку, а не по байтам ответа
+        digest = hashlib.md5(f"{key}:{fingerprint}".encode()).hexdigest()
+        self.etag = "W/" + quote_etag(digest)
+        today = datetime.combine(timezone.localdate(), day_start.min)
+        stamps = [
+            int(timezone.make_aware(today).timestamp()),
+            build_info()[1],
+            # Отпечаток: день, сборка, затем версии моделей
+            *(version_time(version) or 0 for version in fingerprint[2:]),
+        ]
+        self.last_modified = min(max(stamps), int(time.time()))
+
+    def apply(self, response):
+        response["ETag"] = self.etag
+        response["Last-Modified"] = http_date(self.last_modified)
+        # Браузер хранит копию, но перед показом перепроверяет её условным запросом
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    def not_modified(self, request):
+        """Ответ 304 (или 412), если копия клиента актуальна, иначе None"""
+        headers = self.apply(HttpResponse())
+        response = get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified, response=headers
+        )
+        return None if response is headers else response
+
+
+def _response(entry, status):
+    response = HttpResponse(entry["content"], content_type=entry["content_type"])
+    response["X-Page-Cache"] = status
+    return response
+
+
+def conditional(request, dependencies, render):
+    """Отвечает 304 на условный запрос с актуальным валидатором, иначе вызывает render"""
+    validators = Validators(_cache_key(request), _fingerprint(dependencies))
+    response = validators.not_modified(request)
+    if response is not None:
+        return response
+    response = render()
+    if response.status_code == 200:
+        validators.apply(response)
+    return response
+
+
+def _entry(fingerprint, response):
+    return {
+        "fingerprint": fingerprint,
+        "content": response.content,
+        "content_type": response["Content-Type"],
+        "created": time.time(),
+    }
+
+
+def serve(request, dependencies, render):
+    """Отдаёт страницу из кэша или строит её функцией render и сохраняет"""
+    key = _cache_key(request)
+    fingerprint = _fingerprint(dependencies)
+    validators = Validators(key, fingerprint)
+    response = validators.not_modified(request)
+    if response is not None:
+        return response
+    entry = cache.get(key)
+
+    if entry is not None:
+        if entry["fingerprint"] == fingerprint:
+            return validators.apply(_response(entry, "hit"))
+        # Страница устарела: перестраивает её только тот, кто взял блокировку.
+        # Устаревшая копия отдаётся без валидаторов, чтобы клиент её не запомнил
+        if not cache.add(f"{key}:lock", 1, REBUILD_LOCK_TIMEOUT):
+            return _response(entry, "stale")
+
+    try:
+        response = render()
+        if hasattr(response, "render"):
+            response.render()
+        if response.status_code == 200:
+            cache.set(key, _entry(fingerprint, response), PAGE_CACHE_TIMEOUT)
+            validators.apply(response)
+        response["X-Page-Cache"] = "miss"
+        return response
+    finally:
+        if entry is not None:
+            cache.delete(f"{key}:lock")
+
+
+async def aconditional(request, dependencies, render):
+    """Асинхронный conditional; render — корутина, возвращающая готовый ответ"""
+    validators = Validators(_cache_key(request), await _afingerprint(dependencies))
+    response = validators.not_modified(request)
+    if response is not None:
+        return response
+    response = await render()
+    if response.status_code == 200:
+        validators.apply(response)
+    return response
+
+
+async def aserve(request, dependencies, render):
+    """Асинхронный serve; render — корутина, возвращающая готовый ответ"""
+    key = _cache_key(request)
+    fingerprint = await _afingerprint(dependencies)
+    validators = Validators(key, fingerprint)
+    response = validators.not_modified(request)
+    if response is not None:
+        return response
+    entry = await cache.aget(key)
+
+    if entry is not None:
+        if entry["fingerprint"] == fingerprint:
+            return validators.apply(_response(entry, "hit"))
+        if not await cache.aadd(f"{key}:lock", 1, REBUILD_LOCK_TIMEOUT):
+            return _response(entry, "stale")
+
+    try:
+        response = await render()
+        if response.status_code == 200:
+            await cache.aset(key, _entry(fingerprint, response), PAGE_CACHE_TIMEOUT)
+            validators.apply(response)
+        response["X-Page-Cache"] = "miss"
+        return response
+    finally:
+        if entry is not None:
+            await cache.adelete(f"{key}:lock")
+
+
+def _rendered(get):
+    """Корутина, строящая ответ TemplateView в потоке"""
+
+    def build():
+        response = get()
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    return sync_to_async(build)
+
+
+class CachedPageMixin:
+    """Кэширует GET-ответ TemplateView для анонимных посетителей.
+
+    cache_dependencies — имена моделей (model_name), при изменении которых
+    страница должна перестроиться.
+    """
+
+    cache_dependencies = ()
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+        return serve(
+            request,
+            self.cache_dependencies,
+            lambda: super(CachedPageMixin, self).get(request, *args, **kwargs),
+        )
+
+
+class ConditionalPageMixin:
+    """Условные GET-запросы для TemplateView, который не кэшируется целиком.
+
+    Страница всё равно строится заново, но повторный визит с актуальным
+    ETag или If-Modified-Since получает 304 без рендеринга.
+    """
+
+    cache_dependencies = ()
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+        return conditional(
+            request,
+            self.cache_dependencies,
+            lambda: super(ConditionalPageMixin, self).get(request, *args, **kwargs),
+        )
+
+
+class AsyncCachedPageMixin(CachedPageMixin):
+    """CachedPageMixin для ASGI: кэш читается без потока, страница строится в потоке"""
+
+    async def get(self, request, *args, **kwargs):
+        render = _rendered(lambda: super(CachedPageMixin, self).get(request, *args, **kwargs))
+        if (await request.auser()).is_authenticated:
+            return await render()
+        return await aserve(request, self.cache_dependencies, render)
+
+
+class AsyncConditionalPageMixin(ConditionalPageMixin):
+    """ConditionalPageMixin для ASGI: 304 отдаётся без потока"""
+
+    async def get(self, request, *args, **kwargs):
+        render = _rendered(lambda: super(ConditionalPageMixin, self).get(request, *args, **kwargs))
+        if (await request.auser()).is_authenticated:
+            return await render()
+        return await aconditional(request, self.cache_dependencies, render)
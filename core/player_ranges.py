@@ -0,0 +1,106 @@
+"""Таблица диапазонов игроков для калькулятора аренды.
+
+Новые пересечения диапазонов запрещает PlayerRange.clean, но в уже
+заведённых данных они есть (12–14 и 14–16) и могут вкладываться друг в
+друга. Для числа гостей берётся первый подходящий диапазон в порядке
+(min_players, max_players) — так же ищет и браузер по таблице rows. Чтобы
+искать двоичным поиском, диапазоны заранее разбиваются на
+непересекающиеся отрезки с готовым ответом. Таблица держится в памяти
+воркера и перечитывается, когда в кэше меняется её версия.
+"""
+
+import threading
+from bisect import bisect_right
+from typing import NamedTuple
+
+from .versioning import bump_version, get_version
+
+PLAYER_RANGES_NAMESPACE = "player_ranges"
+
+
+class GameCount(NamedTuple):
+    min: int
+    max: int
+
+
+class RangeTable:
+    def __init__(self, version, rows):
+        self.version = version
+        # (min_players, max_players, min_game_count, max_game_count) по возрастанию min_players
+        self.rows = rows
+        self._starts, self._segments = _flatten(rows)
+
+    @classmethod
+    def load(cls, version):
+        from .models import PlayerRange
+
+        rows = list(
+            PlayerRange.objects.order_by("min_players", "max_players").values_list(
+                "min_players", "max_players", "min_game_count", "max_game_count"
+            )
+        )
+        return cls(version, rows)
+
+    def lookup(self, guests):
+        """Рекомендуемое количество игр для guests гостей или None"""
+        index = bisect_right(self._starts, guests) - 1
+        if index < 0:
+            return None
+        end, (_, _, min_games, max_games) = self._segments[index]
+        if guests > end:
+            return None
+        return GameCount(min_games, max_games)
+
+
+def _flatten(rows):
+    """Начала непересекающихся отрезков и для каждого (конец, первая покрывающая строка).
+
+    Диапазонов единицы, поэтому квадратичный перебор при загрузке не важен.
+    """
+    bounds = sorted({row[0] for row in rows} | {row[1] + 1 for row in rows})
+    starts, segments = [], []
+    for start, next_start in zip(bounds, bounds[1:]):
+        row = next((row for row in rows if row[0] <= start <= row[1]), None)
+        if row is not None:
+            starts.append(start)
+            segments.append((next_start - 1, row))
+    return starts, segments
+
+
+def find_overlap(min_players, max_players, exclude_pk=None):
+    """Первый диапазон, пересекающийся с [min_players, max_players], или None"""
+    from .models import PlayerRange
+
+    return (
+        PlayerRange.objects.filter(
+            min_players__lte=max_players, max_players__gte=min_players
+        )
+        .exclude(pk=exclude_pk)
+        .order_by("min_players")
+        .first()
+    )
+
+
+_lock = threading.Lock()
+_table = None
+
+
+def get_range_table():
+    """Таблица текущей версии, при необходимости перечитанная из базы"""
+    global _table
+    version = get_version(PLAYER_RANGES_NAMESPACE)
+
+    table = _table
+    if table is not None and table.version == version:
+        return table
+
+    with _lock:
+        table = _table
+        if table is None or table.version != version:
+            table = RangeTable.load(version)
+            _table = table
+    return table
+
+
+def invalidate_player_ranges():
+    bump_version(PLAYER_RANGES_NAMESPACE)
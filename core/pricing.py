@@ -0,0 +1,430 @@
+"""Цены со скидками, материализованные в таблице EffectivePrice.
+
+Для каждой позиции (товара, аренды, допа) в базе хранится цена на
+текущий день с учётом самой выгодной скидки. Таблица пересчитывается
+пачкой: при изменении скидок и их связей, при изменении цены позиции и в
+дни начала и окончания скидок (команда refresh_effective_prices по
+таймеру systemd после полуночи). DiscountRules перебирает скидки при
+пересчёте и пока таблица устарела.
+
+Воркер держит в памяти DiscountTable — готовые цены, прочитанные двумя
+запросами на эпоху (версию скидок плюс день по московскому времени).
+Версия скидок читается из кэша один раз на HTTP-запрос
+(DiscountTableMiddleware): карточки и цены в шаблонах берут ту же таблицу.
+Если таймер ещё не пересчитал цены к этому дню, таблица считает цены
+по правилам скидок на лету, а пересчёт запускается в фоновом потоке —
+ответ не ждёт пересчёта всего каталога.
+"""
+
+import threading
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import timedelta
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .background import Rebuilder
+from .versioning import bump_version, get_version
+
+DISCOUNTS_NAMESPACE = "discounts"
+BATCH_SIZE = 2000
+
+# Поле модели Discount, через которое скидка привязана к позиции данной модели
+DISCOUNT_FIELDS = {
+    "product": "products",
+    "arenda": "arendas",
+    "additionalproducts": "additional_products",
+}
+
+
+class ResolvedPrice(NamedTuple):
+    """Итоговая цена позиции и скидка, которая её дала"""
+
+    price: object
+    percentage: object
+    discount: Optional[object]
+
+
+class DiscountRules:
+    """Активные на конкретный день скидки и их связи — для пересчёта цен"""
+
+    def __init__(self, day, discounts, links):
+        self.day = day
+        # Скидки в порядке Discount.Meta.ordering
+        self.discounts = discounts
+        # (model_name, pk позиции) -> скидки, привязанные к позиции
+        self._links = links
+
+    @classmethod
+    def load(cls, day):
+        """Загружает скидки и их связи: один запрос на скидки и по одному на каждую связь"""
+        from .models import Discount
+
+        discounts = list(
+            Discount.objects.filter(
+                is_active=True, start_date__lte=day, end_date__gte=day
+            )
+        )
+        by_id = {discount.pk: discount for discount in discounts}
+        position = {discount.pk: index for index, discount in enumerate(discounts)}
+
+        links = defaultdict(list)
+        if discounts:
+            for model_name, field in DISCOUNT_FIELDS.items():
+                through = getattr(Discount, field).through
+                rows = through.objects.filter(discount_id__in=by_id).values_list(
+                    "discount_id", f"{model_name}_id"
+                )
+                for discount_id, item_id in rows:
+                    links[(model_name, item_id)].append(discount_id)
+
+        # Порядок важен при равной выгоде: побеждает первая скидка, как и раньше
+        resolved_links = {
+            key: tuple(by_id[pk] for pk in sorted(ids, key=position.__getitem__))
+            for key, ids in links.items()
+        }
+        return cls(day, discounts, resolved_links)
+
+    def resolve(self, model_name, pk, price):
+        """Возвращает самую выгодную цену позиции и процент скидки"""
+        best_price = price
+        best_discount = None
+
+        for discount in self._links.get((model_name, pk), ()):
+            discounted_price = discount.calculate_price(price)
+            if discounted_price < best_price:
+                best_price = discounted_price
+                best_discount = discount
+
+        return ResolvedPrice(
+            best_price, _percentage(price, best_price, best_discount), best_discount
+        )
+
+
+def _percentage(price, best_price, discount):
+    if discount is None:
+        return None
+    if discount.discount_type == "percentage":
+        return discount.value
+    # Для фиксированной скидки считаем эквивалентный процент
+    return round((price - best_price) / price * 100)
+
+
+class DiscountTable:
+    """Цены со скидками из EffectivePrice, загруженные в память воркера"""
+
+    def __init__(self, day, version, discounts, prices, stale=False):
+        self.day = day
+        self.version = version
+        # Активные скидки в порядке Discount.Meta.ordering
+        self.discounts = discounts
+        # (model_name, pk) -> (цена без скидки, ResolvedPrice)
+        self._prices = prices
+        # Цены посчитаны для другого дня или таблица ещё не заполнялась
+        self.stale = stale
+        # Устаревшие цены не отдаются: до пересчёта цена считается по скидкам дня
+        self._rules = DiscountRules.load(day) if stale else None
+
+    @classmethod
+    def load(cls, day, version):
+        """Два запроса: активные скидки и материализованные цены (плюс правила, если устарели)"""
+        from .models import Discount, EffectivePrice
+
+        discounts = list(
+            Discount.objects.filter(is_active=True, start_date__lte=day, end_date__gte=day)
+        )
+        by_id = {discount.pk: discount for discount in discounts}
+        prices = {}
+        stale = False
+        rows = EffectivePrice.objects.values_list(
+            "kind", "item_id", "base_price", "price", "percentage", "discount_id",
+            "valid_on", "valid_until",
+        )
+        for (
+            kind, item_id, base_price, price, percentage, discount_id, valid_on, valid_until
+        ) in rows.iterator(chunk_size=BATCH_SIZE):
+            if valid_on > day or (valid_until is not None and day >= valid_until):
+                stale = True
+            discount = by_id.get(discount_id)
+            if discount is None:
+                price, percentage = base_price, None
+            elif discount.discount_type != "percentage":
+                percentage = int(percentage)
+            prices[(kind, item_id)] = (base_price, ResolvedPrice(price, percentage, discount))
+        return cls(day, version, discounts, prices, stale=stale or not prices)
+
+    @property
+    def active_discount(self):
+        """Первая активная скидка (для модального окна на главной)"""
+        return self.discounts[0] if self.discounts else None
+
+    def resolve(self, item):
+        """Цена позиции со скидкой из материализованной таблицы"""
+        if self._rules is not None:
+            return self._rules.resolve(item._meta.model_name, item.pk, item.price)
+        stored = self._prices.get((item._meta.model_name, item.pk))
+        if stored is None:
+            # Позиция появилась позже пересчёта: цена без скидки до следующего
+            return ResolvedPrice(item.price, None, None)
+        base_price, resolved = stored
+        if base_price != item.price and resolved.discount is not None:
+            # Цена позиции изменилась, а пересчёт ещё не дошёл: применяем ту же скидку
+            discount = resolved.discount
+            price = discount.calculate_price(item.price)
+            return ResolvedPrice(price, _percentage(item.price, price, discount), discount)
+        if base_price != item.price:
+            return ResolvedPrice(item.price, None, None)
+        return resolved
+
+    def resolve_many(self, items):
+        """Возвращает словарь (model_name, pk) -> ResolvedPrice для списка позиций"""
+        return {(item._meta.model_name, item.pk): self.resolve(item) for item in items}
+
+
+def price_models():
+    from .models import AdditionalProducts, Arenda, Product
+
+    return (Product, Arenda, AdditionalProducts)
+
+
+def next_price_change(day):
+    """Ближайший день после day, когда начинается или заканчивается скидка"""
+    from .models import Discount
+
+    bounds = Discount.objects.filter(is_active=True).aggregate(
+        start=Min("start_date", filter=Q(start_date__gt=day)),
+        end=Min("end_date", filter=Q(end_date__gte=day)),
+    )
+    candidates = [bounds["start"]]
+    if bounds["end"] is not None:
+        # Скидка действует по end_date включительно, цена меняется на следующий день
+        candidates.append(bounds["end"] + timedelta(days=1))
+    candidates = [value for value in candidates if value is not None]
+    return min(candidates) if candidates else None
+
+
+def refresh_effective_prices(items=None, day=None):
+    """Пересчитывает материализованные цены и сбрасывает таблицы воркеров.
+
+    items — {модель: [pk, ...]} для точечного пересчёта (изменилась цена
+    позиции); None — все позиции, при этом удаляются строки исчезнувших.
+    """
+    from .models import EffectivePrice
+
+    day = day or timezone.localdate()
+    now = timezone.now()
+    rules = DiscountRules.load(day)
+    valid_until = next_price_change(day)
+    changed = 0
+
+    def build(kind, rows):
+        for pk, price in rows:
+            resolved = rules.resolve(kind, pk, price)
+            yield EffectivePrice(
+                kind=kind,
+                item_id=pk,
+                base_price=price,
+                price=Decimal(resolved.price).quantize(Decimal("0.01")),
+                percentage=resolved.percentage,
+                discount=resolved.discount,
+                valid_on=day,
+                valid_until=valid_until,
+                refreshed_at=now,
+            )
+
+    with transaction.atomic():
+        for model in price_models():
+            kind = model._meta.model_name
+            rows = model.objects.values_list("pk", "price")
+            if items is None:
+                for batch in _batches(build(kind, rows.iterator(chunk_size=BATCH_SIZE))):
+                    changed += _upsert(batch)
+                continue
+            pks = list(items.get(model, ()))
+            for start in range(0, len(pks), BATCH_SIZE):
+                chunk = pks[start : start + BATCH_SIZE]
+                found = list(rows.filter(pk__in=chunk))
+                changed += _upsert(list(build(kind, found)))
+                # Позиции, которых больше нет в базе, теряют и строку цены
+                gone = set(chunk) - {pk for pk, _ in found}
+                if gone:
+                    deleted = EffectivePrice.objects.filter(kind=kind, item_id__in=gone).delete()
+                    changed += deleted[0]
+        if items is None:
+            changed += EffectivePrice.objects.filter(refreshed_at__lt=now).delete()[0]
+    # Пустой пересчёт не сбрасывает таблицы: иначе воркеры с пустым каталогом
+    # перезапускали бы пересчёт друг у друга
+    if changed:
+        invalidate_discounts()
+
+
+def _batches(iterable, size=BATCH_SIZE):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _upsert(batch):
+    """Вставляет или обновляет строки цен, возвращает их число"""
+    from .models import EffectivePrice
+
+    if batch:
+        EffectivePrice.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=["kind", "item_id"],
+            update_fields=[
+                "base_price",
+                "price",
+                "percentage",
+                "discount",
+                "valid_on",
+                "valid_until",
+                "refreshed_at",
+            ],
+        )
+    return len(batch)
+
+
+class _RefreshBatch:
+    """Позиции, изменённые в текущей транзакции; пересчитываются один раз"""
+
+    def __init__(self):
+        self.full = False
+        self.items = defaultdict(set)
+        self.done = False
+
+    def run(self):
+        if self.done:
+            return
+        self.done = True
+        if getattr(_pending, "batch", None) is self:
+            del _pending.batch
+        refresh_effective_prices(
+            None if self.full else {model: list(pks) for model, pks in self.items.items()}
+        )
+
+
+_pending = threading.local()
+
+
+def schedule_refresh(model=None, pk=None):
+    """Пересчёт цен после коммита: позиции pk модели model или всех позиций.
+
+    Сигналы одной транзакции (скидка и все её связи) собираются в один
+    пересчёт. Если транзакция откатилась, её позиции пересчитаются вместе
+    со следующей — пересчёт идемпотентен.
+    """
+    batch = getattr(_pending, "batch", None)
+    if batch is None or batch.done:
+        batch = _pending.batch = _RefreshBatch()
+    if model is None:
+        batch.full = True
+    else:
+        batch.items[model].add(pk)
+    transaction.on_commit(batch.run)
+
+
+def _refresh_stale_prices():
+    from .page_cache import invalidate_pages
+
+    refresh_effective_prices()
+    invalidate_pages("discount")
+
+
+_refresher = Rebuilder("effective-prices", _refresh_stale_prices, "цены со скидками")
+
+
+def wait_for_refresh(timeout=None):
+    """Ждёт окончания фонового пересчёта цен (перед удалением временной базы)"""
+    _refresher.wait(timeout)
+
+
+_lock = threading.Lock()
+_table = None
+# Таблица, уже выбранная в текущем HTTP-запросе: словарь, общий для копий
+# контекста (sync_to_async), или None вне запроса
+_request_scope = ContextVar("discount_table_request", default=None)
+
+
+def get_discount_table():
+    """Возвращает таблицу цен текущей эпохи, в пределах запроса — одну и ту же"""
+    scope = _request_scope.get()
+    if scope is None:
+        return _current_table()
+    if "table" not in scope:
+        scope["table"] = _current_table()
+    return scope["table"]
+
+
+def _current_table():
+    """Таблица текущей эпохи; версия скидок читается из кэша при каждом вызове"""
+    global _table
+    day = timezone.localdate()
+    version = get_version(DISCOUNTS_NAMESPACE)
+
+    table = _table
+    if table is not None and table.day == day and table.version == version:
+        return table
+
+    with _lock:
+        table = _table
+        if table is None or table.day != day or table.version != version:
+            table = DiscountTable.load(day, version)
+            if table.stale:
+                # Таймер не успел пересчитать цены к этому дню. Пересчёт всего
+                # каталога идёт в фоне, новая версия скидок сбросит эту таблицу
+                _refresher.schedule()
+            _table = table
+    return table
+
+
+def resolve_price(item):
+    return get_discount_table().resolve(item)
+
+
+class DiscountTableMiddleware:
+    """Одна проверка версии скидок на запрос вместо проверки на каждую цену.
+
+    Без неё каждый get_discounted_price в шаблоне читал версию из кэша
+    (для FileBasedCache — открытие файла), на странице каталога — сотни раз.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        token = _request_scope.set({})
+        try:
+            return self.get_response(request)
+        finally:
+            _request_scope.reset(token)
+
+    async def _acall(self, request):
+        token = _request_scope.set({})
+        try:
+            return await self.get_response(request)
+        finally:
+            _request_scope.reset(token)
+
+
+def invalidate_discounts():
+    """Сбрасывает таблицу скидок во всех воркерах"""
+    bump_version(DISCOUNTS_NAMESPACE)
@@ -0,0 +1,247 @@
+"""Учёт SQL-запросов по страницам и проверка бюджетов.
+
+QueryBudgetMiddleware считает для выборки запросов число SQL-запросов,
+суммарное время в базе и повторяющиеся запросы (одинаковый SQL с точностью
+до параметров — типичный признак N+1). Замер пишется строкой JSON в
+QUERY_BUDGET_LOG с именем URL (landing, game_catalog, ...). Запросы
+перехватываются через connection.execute_wrapper, поэтому учёт работает
+без DEBUG и без debug_toolbar и стоит несколько микросекунд на запрос.
+
+Бюджеты задаются в QUERY_BUDGETS: имя URL -> максимум запросов на ответ.
+QueryBudgetTestMixin.assertWithinQueryBudget проваливает тест, если
+страница вышла за бюджет; QueryBudgetTests в core/tests.py проверяет так
+каждую страницу из QUERY_BUDGETS на холодном кэше.
+
+Для каждого ответа (не только из выборки) считается ожидание блокировки
+записи SQLite: время BEGIN IMMEDIATE и одиночных записей вне транзакции
+(в WAL только они ждут busy_timeout) и число ошибок "database is locked".
+Ответ, ждавший дольше LOCK_WAIT_REPORT_MS или получивший ошибку, тоже
+попадает в QUERY_BUDGET_LOG.
+"""
+
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+# Бюджет рассчитан на холодный старт: после сброса снимка каталога,
+# таблиц скидок и рекомендаций страница перечитывает их (около 15
+# запросов), дальше каталожные страницы отдаются из кэша почти без
+# обращений к базе
+QUERY_BUDGETS = {
+    "landing": 16,
+    "about": 18,
+    "game_catalog": 18,
+    "product_detail": 21,
+    "rental_catalog": 19,
+    "two_games_on_one_board": 16,
+    "additional_product_detail": 19,
+    "calculate_games": 1,
+    "player_ranges_table": 1,
+    "news_gallery": 3,
+    "process_order": 14,
+}
+
+# Ожидание блокировки, начиная с которого ответ пишется в журнал вне выборки
+LOCK_WAIT_REPORT_MS = 100
+_WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# Списки значений IN (...) разной длины — один и тот же запрос
+_IN_LIST_RE = re.compile(r"\((?:%s, )*%s\)")
+_sink_lock = threading.Lock()
+
+
+def fingerprint(sql):
+    return _IN_LIST_RE.sub("(...)", sql)
+
+
+def get_budget(url_name):
+    budgets = {**QUERY_BUDGETS, **getattr(settings, "QUERY_BUDGETS", {})}
+    return budgets.get(url_name)
+
+
+def _takes_write_lock(sql, context):
+    """Запрос, который ждёт блокировку записи: начало транзакции или запись вне её"""
+    head = sql.lstrip()[:7].upper()
+    if head.startswith("BEGIN"):
+        return True
+    return head.startswith(_WRITE_STATEMENTS) and not context["connection"].in_atomic_block
+
+
+def _is_lock_error(error):
+    return isinstance(error, OperationalError) and "locked" in str(error)
+
+
+class LockRecorder:
+    """Обёртка execute_wrapper: ожидание блокировки записи и ошибки блокировки"""
+
+    def __init__(self):
+        self.lock_wait = 0.0
+        self.lock_errors = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not _takes_write_lock(sql, context):
+            return self._execute(execute, sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return self._execute(execute, sql, params, many, context)
+        finally:
+            self.lock_wait += time.perf_counter() - started
+
+    def _execute(self, execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except Exception as error:
+            if _is_lock_error(error):
+                self.lock_errors += 1
+            raise
+
+    @property
+    def lock_wait_ms(self):
+        return round(self.lock_wait * 1000, 2)
+
+    def report(self, url_name, path, status=None):
+        return {
+            "ts": round(time.time(), 3),
+            "url_name": url_name,
+            "path": path,
+            "status": status,
+            "lock_wait_ms": self.lock_wait_ms,
+            "lock_errors": self.lock_errors,
+        }
+
+
+class QueryRecorder(LockRecorder):
+    """Обёртка execute_wrapper, запоминающая SQL и время запросов"""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.seconds = 0.0
+        self.fingerprints = Counter()
+
+    def _execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return super()._execute(execute, sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+    def report(self, url_name, path, status=None):
+        budget = get_budget(url_name)
+        return {
+            **super().report(url_name, path, status),
+            "queries": self.count,
+            "db_ms": round(self.seconds * 1000, 2),
+            "budget": budget,
+            "over_budget": budget is not None and self.count > budget,
+            "duplicates": [
+                {"sql": sql, "count": count}
+                for sql, count in sorted(self.duplicates().items(), key=lambda item: -item[1])
+            ],
+        }
+
+
+def write_report(report):
+    """Дописывает замер в JSONL-файл QUERY_BUDGET_LOG, если он задан"""
+    path = getattr(settings, "QUERY_BUDGET_LOG", None)
+    if not path:
+        return
+    line = json.dumps(report, ensure_ascii=False)
+    with _sink_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def _url_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+    return match.url_name
+
+
+class QueryBudgetMiddleware:
+    """Замеряет запросы к базе для доли QUERY_BUDGET_SAMPLE_RATE запросов.
+
+    Под ASGI запросы к базе выполняются в потоке представления, а не там,
+    где работает middleware, поэтому асинхронные ответы не замеряются.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "QUERY_BUDGET_SAMPLE_RATE", 0.0)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        recorder = QueryRecorder() if sampled else LockRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        contended = recorder.lock_errors or recorder.lock_wait_ms >= LOCK_WAIT_REPORT_MS
+        if contended:
+            logger.warning(
+                "%s: ожидание блокировки базы %s мс, ошибок блокировки %s",
+                request.path,
+                recorder.lock_wait_ms,
+                recorder.lock_errors,
+            )
+        if sampled or contended:
+            url_name = _url_name(request)
+            report = recorder.report(url_name, request.path, response.status_code)
+            if report.get("over_budget"):
+                logger.warning(
+                    "%s: %s SQL-запросов при бюджете %s",
+                    url_name,
+                    report["queries"],
+                    report["budget"],
+                )
+            write_report(report)
+        if settings.DEBUG:
+            response["X-DB-Lock-Wait"] = recorder.lock_wait_ms
+            if sampled:
+                response["X-Query-Count"] = recorder.count
+        return response
+
+
+class QueryBudgetTestMixin:
+    """Проверка бюджета запросов для TestCase с self.client"""
+
+    def assertWithinQueryBudget(self, path, data=None, budget=None, method="get", **extra):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = getattr(self.client, method)(path, data, **extra)
+        url_name = _url_name(response.wsgi_request)
+        budget = budget if budget is not None else get_budget(url_name)
+        report = recorder.report(url_name, path, response.status_code)
+        write_report(report)
+        if budget is None:
+            self.fail(f"Для {url_name} ({path}) не задан бюджет запросов")
+        if recorder.count > budget:
+            lines = [f"{url_name} ({path}): {recorder.count} SQL-запросов при бюджете {budget}"]
+            lines += [f"  x{item['count']}: {item['sql']}" for item in report["duplicates"]]
+            self.fail("\n".join(lines))
+        return response
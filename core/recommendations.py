@@ -0,0 +1,287 @@
+"""Рекомендации «Смотрите также» для страниц товара и допа.
+
+Для каждой активной позиции заранее выбираются STORED_COUNT лучших
+товаров и допов. Счёт пары складывается из:
+- общих значений фильтров (вид игры весит больше, чем размер, число и
+  возраст игроков) — только между товарами;
+- совместных заказов: за каждый заказ, в котором есть обе позиции;
+- у допов, для которых фильтров нет, — общего первого слова названия
+  (сертификаты, сумки).
+При равном счёте выше позиция, которую чаще заказывают, затем более
+новая; если позиций со счётом не хватает, список добирается ими же.
+
+Таблица Recommendation перестраивается целиком в фоновом потоке после
+изменений каталога и заказов и командой build_recommendations при
+деплое. Воркер держит её в памяти и перечитывает при смене версии, а
+страница берёт из списка первые SHOWN_COUNT активных позиций. Пока
+строки нет, показываются первые позиции каталога.
+"""
+
+import heapq
+import threading
+from collections import Counter, defaultdict
+from itertools import combinations, islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .background import Rebuilder
+from .page_cache import invalidate_pages
+from .versioning import bump_version, get_version
+
+RECOMMENDATIONS_NAMESPACE = "recommendations"
+# Сколько позиций хранится: запас на выключенные до следующей перестройки
+STORED_COUNT = 8
+# Больше блок не показывает даже на широком экране
+SHOWN_COUNT = 4
+BATCH_SIZE = 2000
+
+# Поле Product -> вес общего значения
+ATTRIBUTE_WEIGHTS = {"game_types": 3, "player_counts": 1, "player_ages": 1, "sizes": 1}
+# Значение, общее для стольких товаров, почти не говорит о сходстве,
+# а пар даёт квадрат от их числа
+COMMON_VALUE_LIMIT = 500
+ORDER_WEIGHT = 2
+GROUP_WEIGHT = 3
+
+# Вид строки заказа -> модель позиции
+LINE_KINDS = {
+    "product": "product",
+    "game_for_rent": "product",
+    "additional": "additionalproducts",
+}
+KINDS = ("product", "additionalproducts")
+
+
+def _add_pairs(scores, keys, weight):
+    for a, b in combinations(keys, 2):
+        scores[a][b] += weight
+        scores[b][a] += weight
+
+
+def _attribute_scores(scores, products):
+    from .models import Product
+
+    active = set(products)
+    for name, weight in ATTRIBUTE_WEIGHTS.items():
+        field = getattr(Product, name).field
+        rows = field.remote_field.through.objects.values_list(
+            "product_id", f"{field.m2m_reverse_field_name()}_id"
+        )
+        by_value = defaultdict(list)
+        for product_id, value_id in rows.iterator(chunk_size=BATCH_SIZE):
+            if product_id in active:
+                by_value[value_id].append(("product", product_id))
+        for keys in by_value.values():
+            if len(keys) <= COMMON_VALUE_LIMIT:
+                _add_pairs(scores, keys, weight)
+
+
+def _group_scores(scores, additional_products):
+    groups = defaultdict(list)
+    for pk, name in additional_products:
+        words = name.split()
+        if words:
+            groups[words[0].lower()].append(("additionalproducts", pk))
+    for keys in groups.values():
+        _add_pairs(scores, keys, GROUP_WEIGHT)
+
+
+def _order_scores(scores, active):
+    """Совместные заказы; возвращает число заказов каждой позиции"""
+    from .models import OrderLine
+
+    popularity = Counter()
+
+    def add(keys):
+        popularity.update(keys)
+        _add_pairs(scores, sorted(keys), ORDER_WEIGHT)
+
+    rows = (
+        OrderLine.objects.filter(kind__in=LINE_KINDS)
+        .order_by("order_id")
+        .values_list("order_id", "kind", "item_id")
+    )
+    current, keys = None, set()
+    for order_id, kind, item_id in rows.iterator(chunk_size=BATCH_SIZE):
+        if order_id != current:
+            add(keys)
+            current, keys = order_id, set()
+        key = (LINE_KINDS[kind], item_id)
+        if key in active:
+            keys.add(key)
+    add(keys)
+    return popularity
+
+
+def compute_recommendations():
+    """(kind, pk) -> (pk товаров, pk допов) для всех активных позиций"""
+    from .models import AdditionalProducts, Product
+
+    products = list(
+        Product.objects.filter(is_active=True).order_by("-created_at").values_list("pk", flat=True)
+    )
+    additional_products = list(
+        AdditionalProducts.objects.filter(is_active=True)
+        .order_by("-created_at")
+        .values_list("pk", "name")
+    )
+    catalog = [("product", pk) for pk in products] + [
+        ("additionalproducts", pk) for pk, _ in additional_products
+    ]
+    active = set(catalog)
+
+    scores = defaultdict(Counter)
+    _attribute_scores(scores, products)
+    _group_scores(scores, additional_products)
+    popularity = _order_scores(scores, active)
+
+    # Порядок при равном счёте и для добора: популярные, затем новые
+    fallback = sorted(catalog, key=lambda key: -popularity[key])
+    position = {key: index for index, key in enumerate(fallback)}
+    fallback_by_kind = {kind: [key for key in fallback if key[0] == kind] for kind in KINDS}
+
+    result = {}
+    for key in catalog:
+        lists = []
+        for kind in KINDS:
+            scored = [(other, score) for other, score in scores[key].items() if other[0] == kind]
+            best = [
+                other
+                for other, _ in heapq.nsmallest(
+                    STORED_COUNT, scored, key=lambda pair: (-pair[1], position[pair[0]])
+                )
+            ]
+            chosen = set(best)
+            for other in fallback_by_kind[kind]:
+                if len(best) >= STORED_COUNT:
+                    break
+                if other != key and other not in chosen:
+                    best.append(other)
+            lists.append(tuple(pk for _, pk in best))
+        result[key] = tuple(lists)
+    return result
+
+
+def _format(pks):
+    return ",".join(str(pk) for pk in pks)
+
+
+def _parse(value):
+    return tuple(int(pk) for pk in value.split(",")) if value else ()
+
+
+def _stored():
+    from .models import Recommendation
+
+    rows = Recommendation.objects.values_list("kind", "item_id", "products", "additional_products")
+    return {
+        (kind, item_id): (_parse(products), _parse(additional_products))
+        for kind, item_id, products, additional_products in rows.iterator(chunk_size=BATCH_SIZE)
+    }
+
+
+def build_recommendations():
+    """Перестраивает таблицу; возвращает число позиций.
+
+    Если рекомендации не изменились (например, заказ не поменял порядок),
+    таблица не перезаписывается и страницы не сбрасываются.
+    """
+    from .models import Recommendation
+
+    computed = compute_recommendations()
+    if computed == _stored():
+        return len(computed)
+    now = timezone.now()
+    rows = [
+        Recommendation(
+            kind=kind,
+            item_id=pk,
+            products=_format(products),
+            additional_products=_format(additional_products),
+            refreshed_at=now,
+        )
+        for (kind, pk), (products, additional_products) in computed.items()
+    ]
+    with transaction.atomic():
+        Recommendation.objects.all().delete()
+        Recommendation.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    bump_version(RECOMMENDATIONS_NAMESPACE)
+    invalidate_pages("recommendation")
+    return len(rows)
+
+
+_rebuilder = Rebuilder("recommendations", build_recommendations, "рекомендации")
+
+
+def schedule_rebuild():
+    """Перестраивает рекомендации в фоне"""
+    _rebuilder.schedule()
+
+
+def wait_for_rebuild(timeout=None):
+    """Ждёт окончания фоновой перестройки (перед удалением временной базы)"""
+    _rebuilder.wait(timeout)
+
+
+class RecommendationTable:
+    def __init__(self, version, rows):
+        self.version = version
+        # (kind, pk) -> (pk товаров, pk допов), лучшие первыми
+        self.rows = rows
+
+    @classmethod
+    def load(cls, version):
+        return cls(version, _stored())
+
+    def related(self, item):
+        return self.rows.get((item._meta.model_name, item.pk))
+
+
+_lock = threading.Lock()
+_table = None
+
+
+def get_recommendation_table():
+    """Таблица текущей версии, при необходимости перечитанная из базы"""
+    global _table
+    version = get_version(RECOMMENDATIONS_NAMESPACE)
+
+    table = _table
+    if table is not None and table.version == version:
+        return table
+
+    with _lock:
+        table = _table
+        if table is None or table.version != version:
+            table = RecommendationTable.load(version)
+            if not table.rows:
+                # Таблица ещё не строилась: страницы пока показывают
+                # первые позиции каталога
+                schedule_rebuild()
+            _table = table
+    return table
+
+
+def recommended(item, catalog):
+    """Рекомендуемые товары и допы для страницы item, до SHOWN_COUNT каждых"""
+    row = get_recommendation_table().related(item)
+    if row is None:
+        # Таблица ещё не построена: первые позиции каталога, с запасом на саму item
+        row = (
+            tuple(islice(catalog.products_by_pk, SHOWN_COUNT + 1)),
+            tuple(islice(catalog.additional_products_by_pk, SHOWN_COUNT + 1)),
+        )
+    kind = item._meta.model_name
+    result = []
+    for model_name, pks, by_pk in (
+        ("product", row[0], catalog.products_by_pk),
+        ("additionalproducts", row[1], catalog.additional_products_by_pk),
+    ):
+        items = [
+            by_pk[pk]
+            for pk in pks
+            if pk in by_pk and not (model_name == kind and pk == item.pk)
+        ]
+        result.append(items[:SHOWN_COUNT])
+    return tuple(result)
@@ -0,0 +1,258 @@
+"""Уменьшенные копии загруженных изображений в форматах AVIF и WebP.
+
+Для каждого оригинала строятся копии нескольких ширин (не шире
+оригинала) и манифест renditions/<имя оригинала>.json со списком копий.
+Копии строятся в отдельном пуле процессов после сохранения модели, для уже
+загруженных файлов — командой build_image_renditions. Пока манифеста нет,
+тег {% picture %} отдаёт оригинал, поэтому страницы не ломаются.
+
+IMAGE_RENDITION_WORKERS=0 выключает фоновый пул: копии тогда строит
+только build_image_renditions. Сбой пула (например, упавший процесс) не
+мешает сохранению моделей: ошибка пишется в журнал, пул пересоздаётся.
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .page_cache import invalidate_pages
+from .versioning import bump_version
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR = "renditions"
+WIDTHS = (320, 640, 960, 1280)
+# Формат -> (MIME-тип, параметры сохранения Pillow); порядок — порядок <source>
+FORMATS = {
+    "avif": ("image/avif", {"quality": 50, "speed": 6}),
+    "webp": ("image/webp", {"quality": 80, "method": 4}),
+}
+
+# Версия меняется с каждым новым манифестом: от неё зависят карточки
+# core.cards, в которых есть <source> копий
+RENDITIONS_NAMESPACE = "renditions"
+
+# Отсутствие манифеста кэшируется ненадолго, чтобы страницы подхватили копии
+# вскоре после фоновой генерации
+MISSING = "missing"
+MISSING_TIMEOUT = 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def image_models():
+    """Модели с изображениями и модель, чьи страницы показывают эти изображения"""
+    from .models import (
+        AdditionalProducts,
+        AdditionalProductsImage,
+        Arenda,
+        News,
+        NewsImage,
+        Product,
+        ProductImage,
+    )
+
+    return (
+        (Product, "product"),
+        (ProductImage, None),
+        (AdditionalProducts, "additionalproducts"),
+        (AdditionalProductsImage, None),
+        (Arenda, "arenda"),
+        (News, "news"),
+        (NewsImage, "news"),
+    )
+
+
+def manifest_name(name):
+    return posixpath.join(RENDITIONS_DIR, name + ".json")
+
+
+def _cache_key(name):
+    return "rendition:" + hashlib.md5(name.encode()).hexdigest()
+
+
+def get_manifest(name):
+    """Манифест копий оригинала name или None, если копий ещё нет"""
+    key = _cache_key(name)
+    manifest = cache.get(key)
+    if manifest is None:
+        path = manifest_name(name)
+        if default_storage.exists(path):
+            with default_storage.open(path) as f:
+                manifest = json.load(f)
+            cache.set(key, manifest, None)
+        else:
+            cache.set(key, MISSING, MISSING_TIMEOUT)
+            return None
+    return None if manifest == MISSING else manifest
+
+
+def describe(image):
+    """URL, размеры и srcset копий изображения для отдачи в JSON"""
+    manifest = get_manifest(image.name)
+    if manifest is not None:
+        width, height = manifest["width"], manifest["height"]
+    else:
+        try:
+            width, height = image.width, image.height
+        except (OSError, ValueError):
+            width = height = None
+    sources = []
+    for fmt, items in (manifest or {}).get("sources", {}).items():
+        if fmt in FORMATS:
+            sources.append(
+                {
+                    "type": FORMATS[fmt][0],
+                    "srcset": ", ".join(
+                        f"{default_storage.url(path)} {w}w" for w, path in items
+                    ),
+                }
+            )
+    return {"url": image.url, "width": width, "height": height, "sources": sources}
+
+
+def target_widths(width):
+    widths = {w for w in WIDTHS if w < width}
+    widths.add(min(width, WIDTHS[-1]))
+    return sorted(widths)
+
+
+def _open(name):
+    with default_storage.open(name) as f:
+        image = Image.open(f)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    return image
+
+
+def _save(path, content):
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, ContentFile(content))
+
+
+def generate_renditions(name, page=None, force=False):
+    """Строит копии оригинала name и записывает манифест.
+
+    page — модель, чьи закэшированные страницы нужно сбросить, чтобы они
+    начали ссылаться на копии. Возвращает манифест.
+    """
+    if not force:
+        manifest = get_manifest(name)
+        if manifest is not None:
+            return manifest
+
+    image = _open(name)
+    width, height = image.size
+    sources = {}
+    for fmt, (_, options) in FORMATS.items():
+        sources[fmt] = []
+        for target in target_widths(width):
+            resized = image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS
+            )
+            buffer = BytesIO()
+            resized.save(buffer, format=fmt.upper(), **options)
+            path = _save(
+                posixpath.join(RENDITIONS_DIR, f"{name}-{target}w.{fmt}"),
+                buffer.getvalue(),
+            )
+            sources[fmt].append([target, path])
+
+    # Манифест пишется последним: пока его нет, страницы отдают оригинал
+    manifest = {"width": width, "height": height, "sources": sources}
+    _save(manifest_name(name), json.dumps(manifest).encode())
+    cache.set(_cache_key(name), manifest, None)
+    bump_version(RENDITIONS_NAMESPACE)
+    if page:
+        invalidate_pages(page)
+    return manifest
+
+
+def get_executor():
+    """Общий пул процессов для генерации копий; None, если пул выключен.
+
+    Процессы запускаются через spawn, а не fork, чтобы не копировать
+    соединения с базой и потоки веб-сервера.
+    """
+    global _executor
+    if settings.IMAGE_RENDITION_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_RENDITION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+        return _executor
+
+
+def shutdown_executor():
+    """Дожидается очереди копий и останавливает пул.
+
+    Нужна процессам, запущенным через multiprocessing: при их выходе пул
+    не останавливается сам, и процесс ждёт его воркеры бесконечно.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+def _discard_executor(executor):
+    """Забывает сломанный пул: следующая задача запустит новый"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _log_failure(name, executor):
+    def callback(future):
+        error = future.exception()
+        if error is not None:
+            logger.error("Не удалось построить копии %s: %s", name, error)
+        if isinstance(error, BrokenProcessPool):
+            _discard_executor(executor)
+
+    return callback
+
+
+def schedule(name, page=None):
+    """Ставит генерацию копий в фоновый пул; ошибки пула только пишет в журнал"""
+    if not name:
+        return
+    # Пул мог сломаться после прошлой задачи: вторая попытка — в новом
+    for attempt in range(2):
+        executor = get_executor()
+        if executor is None:
+            return
+        try:
+            future = executor.submit(generate_renditions, name, page)
+        except Exception:
+            _discard_executor(executor)
+            if attempt:
+                logger.exception("Не удалось поставить в очередь копии %s", name)
+            continue
+        future.add_done_callback(_log_failure(name, executor))
+        return
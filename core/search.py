@@ -0,0 +1,153 @@
+"""Полнотекстовый поиск по товарам и допам (SQLite FTS5).
+
+Виртуальная таблица core_searchindex зеркалит текстовые поля Product и
+AdditionalProducts и обновляется сигналами при сохранении и удалении.
+Текст и запрос нормализуются одинаково: нижний регистр и "ё" -> "е".
+Токенизатор unicode61 запущен без удаления диакритики, чтобы "й" не
+превращалась в "и". Результаты ранжируются по bm25, совпадение в
+названии весит больше, чем в описании.
+"""
+
+import re
+
+from django.db import connection, transaction
+
+TABLE = "core_searchindex"
+
+# kind -> (поле-название, поля-описание)
+INDEXED_FIELDS = {
+    "product": ("name", ("description", "game_rules", "additional_info")),
+    "additionalproducts": ("name", ("description", "description_2", "material")),
+}
+
+# Веса столбцов bm25: kind, item_id, name, body
+NAME_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize(text):
+    return (text or "").lower().replace("ё", "е")
+
+
+def is_available():
+    """FTS5 есть только у SQLite; на других базах поиск идёт через icontains"""
+    return connection.vendor == "sqlite"
+
+
+def _document(item):
+    name_field, body_fields = INDEXED_FIELDS[item._meta.model_name]
+    name = normalize(getattr(item, name_field))
+    body = "\n".join(normalize(getattr(item, field)) for field in body_fields)
+    return name, body
+
+
+def index_item(item):
+    """Добавляет или обновляет позицию в поисковом индексе"""
+    if not is_available():
+        return
+    kind = item._meta.model_name
+    name, body = _document(item)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE kind = %s AND item_id = %s", [kind, item.pk]
+        )
+        cursor.execute(
+            f"INSERT INTO {TABLE} (kind, item_id, name, body) VALUES (%s, %s, %s, %s)",
+            [kind, item.pk, name, body],
+        )
+
+
+def remove_item(kind, pk):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE kind = %s AND item_id = %s", [kind, pk])
+
+
+def reindex_items(model, pks, batch_size=2000):
+    """Переиндексирует позиции model с pk из pks пачками (для массового импорта)"""
+    if not is_available():
+        return
+    kind = model._meta.model_name
+    name_field, body_fields = INDEXED_FIELDS[kind]
+    pks = list(pks)
+    # Вне транзакции SQLite фиксирует каждую вставку executemany отдельно
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(pks), batch_size):
+            chunk = pks[start : start + batch_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(
+                f"DELETE FROM {TABLE} WHERE kind = %s AND item_id IN ({placeholders})",
+                [kind, *chunk],
+            )
+            rows = model.objects.filter(pk__in=chunk).values_list(
+                "pk", name_field, *body_fields
+            )
+            _insert(
+                cursor,
+                [
+                    (kind, pk, normalize(name), "\n".join(map(normalize, body)))
+                    for pk, name, *body in rows
+                ],
+            )
+
+
+def rebuild_index(batch_size=2000):
+    """Полностью перестраивает индекс, читая позиции пачками"""
+    from .models import AdditionalProducts, Product
+
+    # Одна транзакция: поиск не видит полупустой индекс, а SQLite не
+    # фиксирует каждую строку отдельно
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        for model in (Product, AdditionalProducts):
+            kind = model._meta.model_name
+            name_field, body_fields = INDEXED_FIELDS[kind]
+            rows = model.objects.values_list("pk", name_field, *body_fields)
+            batch = []
+            for pk, name, *body in rows.iterator(chunk_size=batch_size):
+                batch.append(
+                    (kind, pk, normalize(name), "\n".join(map(normalize, body)))
+                )
+                if len(batch) >= batch_size:
+                    _insert(cursor, batch)
+                    batch = []
+            if batch:
+                _insert(cursor, batch)
+
+
+def _insert(cursor, rows):
+    cursor.executemany(
+        f"INSERT INTO {TABLE} (kind, item_id, name, body) VALUES (%s, %s, %s, %s)",
+        rows,
+    )
+
+
+def build_match(query):
+    """Превращает пользовательский запрос в выражение MATCH.
+
+    Каждое слово ищется как префикс ("шахм" найдёт "шахматы"), все слова
+    должны встретиться в документе.
+    """
+    tokens = TOKEN_RE.findall(normalize(query))
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search(query, kind="product", limit=None):
+    """Возвращает pk позиций kind, подходящих под запрос, от лучших к худшим"""
+    match = build_match(query)
+    if not match:
+        return []
+    sql = (
+        f"SELECT item_id FROM {TABLE} WHERE {TABLE} MATCH %s AND kind = %s "
+        f"ORDER BY bm25({TABLE}, 0, 0, %s, %s)"
+    )
+    params = [match, kind, NAME_WEIGHT, BODY_WEIGHT]
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
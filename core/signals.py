@@ -1,75 +1,221 @@
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.db import transaction
-from .models import Order
-from .tg_bot import send_telegram_message
-from django.conf import settings
-import asyncio
-
-api_key = settings.TELEGRAM_BOT_API_KEY
-user_id = settings.TELEGRAM_USER_ID
-
-
-def send_telegram_notification(instance):
-    try:
-        # Принудительно загружаем все связи
-        instance.refresh_from_db()
-
-        # Формируем список товаров
-        products_list = [product.name for product in instance.products.all()]
-        additional_products_list = [
-            product.name for product in instance.additional_products.all()
-        ]
-
-        # Здесь добавляем отладочный вывод
-        print(f"Order {instance.id} arenda relations: {instance.arenda.all()}")
-
-        arenda_list = [arenda.name for arenda in instance.arenda.all()]
-        games_for_rent_list = [game.name for game in instance.games_for_rent.all()]
-
-        # Формируем список игр для 2 в 1, если это соответствующий тип заказа
-        double_buy_games_list = []
-        if instance.order_type == 'double_buy' and products_list:
-            double_buy_games_list = products_list.copy()
-
-        # Формируем сообщение
-        tg_markdown_message = f"""
-📦 *Новый заказ!* 📦
-👤 **Имя:** {instance.name}
-📞 **Телефон:** {instance.phone}
-📋 **Тип заказа:** {instance.get_order_type_display()}
-📅 **Дата заказа:** {instance.date.strftime("%d.%m.%Y") if instance.date else "Не указана"}
-⏰ **Время заказа:** {instance.time.strftime("%H:%M") if instance.time else "Не указано"}
-
-🎮 **Товары:** {', '.join(products_list) if products_list else "Нет"}
-🎮 **Дополнительные товары:** {', '.join(additional_products_list) if additional_products_list else "Нет"}
-🎮 **Аренды:** {', '.join(arenda_list) if arenda_list else "Нет"}
-🎮 **Игры для аренды:** {', '.join(games_for_rent_list) if games_for_rent_list else "Нет"}
-🎮 **Игры для 2 в 1:** {', '.join(double_buy_games_list) if double_buy_games_list else "Нет"}
-
-💬 **Комментарий:** {instance.comment if instance.comment else "Нет"}
-
-🔗 **Подробнее:** [Ссылка на заказ](http://127.0.0.1:8000/admin/core/order/{instance.id}/change/)
-        """
-
-        # Отправляем сообщение в Telegram
-        asyncio.run(send_telegram_message(api_key, user_id, tg_markdown_message))
-    except Exception as e:
-        print(f"Ошибка отправки сообщения в Telegram: {e}")
+from .models import (
+    Order,
+    Discount,
+    Product,
+    Arenda,
+    AdditionalProducts,
+    News,
+    NewsImage,
+    ProductImage,
+    AdditionalProductsImage,
+    Size,
+    PlayerCount,
+    PlayerAge,
+    GameType,
+    PlayerRange,
+    GameKitItem,
+    OrderedGameKitItem,
+)
+from .catalog import invalidate_catalog
+from .page_cache import invalidate_pages
+from .player_ranges import invalidate_player_ranges
+from .pricing import schedule_refresh
+from . import recommendations, renditions, search, sitemaps
+from .notifications import enqueue_order_notification
+
+
+def _before_m2m_change(kwargs):
+    """m2m_changed приходит дважды: до изменения (pre_*) и после (post_*)"""
+    return kwargs.get("action", "post_").startswith("pre_")
 
 
 @receiver(post_save, sender=Order)
-def notify_telegram_on_order_created(sender, instance, created, **kwargs):
-    if created:
-        print("Order created, waiting for m2m changes...")
-        # Мы не отправляем уведомление здесь, а ждем m2m_changed
-
-
-@receiver(m2m_changed, sender=Order.products.through)
-@receiver(m2m_changed, sender=Order.additional_products.through)
-@receiver(m2m_changed, sender=Order.arenda.through)
-@receiver(m2m_changed, sender=Order.games_for_rent.through)
-def notify_telegram_on_order_m2m_changed(sender, instance, action, **kwargs):
-    if action == "post_add" and isinstance(instance, Order):
-        print("M2M relations changed, sending notification...")
-        transaction.on_commit(lambda: send_telegram_notification(instance))
+def notify_telegram_on_order_created(sender, instance, created, raw=False, **kwargs):
+    # Записи из фикстур (loaddata, raw=True) не шлют уведомлений, не
+    # индексируются и не пересчитывают цены: после загрузки запускаются
+    # rebuild_search_index и refresh_effective_prices
+    if created and not raw:
+        # Уведомление пишется в outbox в транзакции заказа, отправляет его
+        # run_telegram_worker уже после коммита, когда все связи заказа сохранены
+        enqueue_order_notification(instance)
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+@receiver(m2m_changed, sender=Discount.products.through)
+@receiver(m2m_changed, sender=Discount.arendas.through)
+@receiver(m2m_changed, sender=Discount.additional_products.through)
+def refresh_prices_on_discount_change(sender, raw=False, **kwargs):
+    if raw or _before_m2m_change(kwargs):
+        return
+    # Цены пересчитываются после коммита, чтобы другие воркеры не успели
+    # перечитать старые данные под новой версией
+    schedule_refresh()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Arenda)
+@receiver(post_delete, sender=Arenda)
+@receiver(post_save, sender=AdditionalProducts)
+@receiver(post_delete, sender=AdditionalProducts)
+def refresh_item_price(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    schedule_refresh(sender, instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Arenda)
+@receiver(post_delete, sender=Arenda)
+@receiver(post_save, sender=AdditionalProducts)
+@receiver(post_delete, sender=AdditionalProducts)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=PlayerCount)
+@receiver(post_delete, sender=PlayerCount)
+@receiver(post_save, sender=PlayerAge)
+@receiver(post_delete, sender=PlayerAge)
+@receiver(post_save, sender=GameType)
+@receiver(post_delete, sender=GameType)
+@receiver(m2m_changed, sender=Product.sizes.through)
+@receiver(m2m_changed, sender=Product.player_counts.through)
+@receiver(m2m_changed, sender=Product.player_ages.through)
+@receiver(m2m_changed, sender=Product.game_types.through)
+def invalidate_catalog_on_change(sender, **kwargs):
+    if _before_m2m_change(kwargs):
+        return
+    transaction.on_commit(invalidate_catalog)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Arenda)
+@receiver(post_delete, sender=Arenda)
+@receiver(post_save, sender=AdditionalProducts)
+@receiver(post_delete, sender=AdditionalProducts)
+@receiver(post_save, sender=News)
+@receiver(post_delete, sender=News)
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def invalidate_pages_on_change(sender, **kwargs):
+    model_name = sender._meta.model_name
+    transaction.on_commit(lambda: invalidate_pages(model_name))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Arenda)
+@receiver(post_delete, sender=Arenda)
+@receiver(post_save, sender=News)
+@receiver(post_delete, sender=News)
+def rebuild_sitemap_on_change(sender, **kwargs):
+    transaction.on_commit(sitemaps.schedule_rebuild)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=AdditionalProducts)
+@receiver(post_delete, sender=AdditionalProducts)
+@receiver(m2m_changed, sender=Product.sizes.through)
+@receiver(m2m_changed, sender=Product.player_counts.through)
+@receiver(m2m_changed, sender=Product.player_ages.through)
+@receiver(m2m_changed, sender=Product.game_types.through)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def rebuild_recommendations_on_change(sender, **kwargs):
+    if _before_m2m_change(kwargs):
+        return
+    # Строки заказа пишутся в той же транзакции после Order.save, поэтому
+    # перестройка — только после коммита
+    transaction.on_commit(recommendations.schedule_rebuild)
+
+
+@receiver(post_save, sender=PlayerRange)
+@receiver(post_delete, sender=PlayerRange)
+def invalidate_player_ranges_on_change(sender, **kwargs):
+    # Страница аренды ссылается на таблицу по версии, её тоже нужно перестроить
+    transaction.on_commit(invalidate_player_ranges)
+    transaction.on_commit(lambda: invalidate_pages("playerrange"))
+
+
+@receiver(post_save, sender=NewsImage)
+@receiver(post_delete, sender=NewsImage)
+def invalidate_pages_on_news_image_change(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_pages("news"))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=OrderedGameKitItem)
+@receiver(post_delete, sender=OrderedGameKitItem)
+@receiver(post_save, sender=GameKitItem)
+@receiver(post_delete, sender=GameKitItem)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=PlayerCount)
+@receiver(post_delete, sender=PlayerCount)
+@receiver(post_save, sender=PlayerAge)
+@receiver(post_delete, sender=PlayerAge)
+@receiver(post_save, sender=GameType)
+@receiver(post_delete, sender=GameType)
+@receiver(m2m_changed, sender=Product.sizes.through)
+@receiver(m2m_changed, sender=Product.player_counts.through)
+@receiver(m2m_changed, sender=Product.player_ages.through)
+@receiver(m2m_changed, sender=Product.game_types.through)
+def invalidate_pages_on_product_part_change(sender, **kwargs):
+    if _before_m2m_change(kwargs):
+        return
+    # Фото, комплектация и фильтры выводятся на страницах товаров: от них
+    # зависят кэш страниц и ETag
+    transaction.on_commit(lambda: invalidate_pages("product"))
+
+
+@receiver(post_save, sender=AdditionalProductsImage)
+@receiver(post_delete, sender=AdditionalProductsImage)
+def invalidate_pages_on_additional_image_change(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_pages("additionalproducts"))
+
+
+@receiver(m2m_changed, sender=Discount.products.through)
+@receiver(m2m_changed, sender=Discount.arendas.through)
+@receiver(m2m_changed, sender=Discount.additional_products.through)
+def invalidate_pages_on_discount_m2m_changed(sender, action, **kwargs):
+    if action.startswith("post_"):
+        transaction.on_commit(lambda: invalidate_pages("discount"))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=AdditionalProducts)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_item(instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=AdditionalProducts)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_item(sender._meta.model_name, instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=AdditionalProducts)
+@receiver(post_save, sender=AdditionalProductsImage)
+@receiver(post_save, sender=Arenda)
+@receiver(post_save, sender=News)
+@receiver(post_save, sender=NewsImage)
+def build_image_renditions(sender, instance, raw=False, **kwargs):
+    if raw:
+        # Копии для загруженных фикстур строит build_image_renditions
+        return
+    # Копии уже построенного изображения generate_renditions пропускает,
+    # так что повторное сохранение без нового файла ничего не пересчитывает
+    name = instance.image.name
+    page = dict(renditions.image_models())[sender]
+    transaction.on_commit(lambda: renditions.schedule(name, page))
@@ -1,81 +1,199 @@
-from django.contrib.sitemaps import Sitemap
+"""Карта сайта, заранее записанная на диск.
+
+Карта состоит из индекса sitemap.xml и сжатых частей sitemap-<n>.xml.gz
+по SHARD_SIZE адресов (протокол допускает не больше 50 000). Адреса
+читаются через values_list итератором, поэтому ни модели, ни весь список
+адресов в память не загружаются. Адреса не повторяются: аренды и новости
+не имеют своих страниц и дают только lastmod каталога аренды и главной.
+
+Файлы перезаписываются атомарно (временный файл и os.replace): сначала
+части, последним индекс. После изменения товаров, аренд и новостей карта
+перестраивается в фоновом потоке, изменения за время перестройки
+собираются в один следующий проход. Команда build_sitemap строит карту
+при деплое или по расписанию.
+"""
+
+import gzip
+import os
+import re
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Max
+from django.http import FileResponse, Http404
 from django.urls import reverse
-from core.models import Product, Arenda, News
-
-class ProductSitemap(Sitemap):
-    # Частота изменения страницы: "weekly" (еженедельно), "daily" (ежедневно) и т.д.
-    changefreq = "weekly"
-    # Приоритет страницы относительно других страниц на сайте (от 0.0 до 1.0)
-    priority = 0.9
-
-    def items(self):
-        # Метод возвращает QuerySet объектов, для которых будут сгенерированы URL
-        # В данном случае, это активные товары
-        return Product.objects.filter(is_active=True)
-
-    def lastmod(self, obj):
-        # Метод возвращает дату последнего изменения объекта.
-        # Используется для информирования поисковиков об актуальности контента.
-        return obj.updated_at
-
-    def location(self, obj):
-        # Метод возвращает абсолютный URL для каждого объекта.
-        return reverse('product_detail', kwargs={'pk': obj.pk})
-
-class ArendaSitemap(Sitemap):
-    # Частота изменения страницы: "weekly" (еженедельно), "daily" (ежедневно) и т.д.
-    changefreq = "weekly"
-    # Приоритет страницы относительно других страниц на сайте (от 0.0 до 1.0)
-    priority = 0.9
-
-    def items(self):
-        # Метод возвращает QuerySet объектов, для которых будут сгенерированы URL
-        # В данном случае, это активные аренды
-        return Arenda.objects.filter(is_active=True)
-
-    def lastmod(self, obj):
-        # Метод возвращает дату последнего изменения объекта.
-        # Используется для информирования поисковиков об актуальности контента.
-        return obj.updated_at
-
-    def location(self, obj):
-        # Метод возвращает абсолютный URL для каждого объекта.
-        # Для аренды нет отдельной страницы, поэтому возвращаем URL каталога аренд
-        return reverse('rental_catalog')
-
-class NewsSitemap(Sitemap):
-    # Частота изменения страницы: "weekly" (еженедельно), "daily" (ежедневно) и т.д.
-    changefreq = "weekly"
-    # Приоритет страницы относительно других страниц на сайте (от 0.0 до 1.0)
-    priority = 0.8
-
-    def items(self):
-        # Метод возвращает QuerySet объектов, для которых будут сгенерированы URL
-        # В данном случае, это активные новости
-        return News.objects.filter(is_active=True)
-
-    def lastmod(self, obj):
-        # Метод возвращает дату последнего изменения объекта.
-        # Используется для информирования поисковиков об актуальности контента.
-        return obj.updated_at
-
-    def location(self, obj):
-        # Метод возвращает абсолютный URL для каждого объекта.
-        # Новости отображаются на главной странице, поэтому возвращаем URL главной
-        return reverse('landing')
-
-class StaticViewSitemap(Sitemap):
-    # Приоритет для статичных страниц, обычно ниже, чем у динамического контента
-    priority = 0.5
-    # Частота изменения для статичных страниц, обычно реже
-    changefreq = "monthly"
-
-    def items(self):
-        # Метод возвращает список имен URL-адресов, определенных в urls.py
-        # для статичных страниц.
-        return ['landing', 'about', 'game_catalog', 'rental_catalog', 'two_games_on_one_board']
-
-    def location(self, item):
-        # Для статичных страниц используем функцию reverse для получения URL
-        # по их имени, определенному в urls.py.
-        return reverse(item)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .background import Rebuilder
+
+INDEX_NAME = "sitemap.xml"
+SHARD_SIZE = 50000
+BATCH_SIZE = 2000
+FILE_NAME_RE = re.compile(r"^sitemap(?:-\d+\.xml\.gz|\.xml)$")
+CONTENT_TYPES = {".xml": "application/xml", ".gz": "application/gzip"}
+
+# Модели, от которых зависит содержимое карты
+DEPENDENCIES = ("product", "arenda", "news")
+
+XMLNS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+# Страницы без своей модели: (имя URL, changefreq, priority)
+STATIC_PAGES = [
+    ("landing", "weekly", "0.8"),
+    ("about", "monthly", "0.5"),
+    ("game_catalog", "weekly", "0.5"),
+    ("rental_catalog", "weekly", "0.9"),
+    ("two_games_on_one_board", "monthly", "0.5"),
+]
+
+
+def _absolute(location):
+    return settings.SITEMAP_BASE_URL.rstrip("/") + location
+
+
+def _lastmod(value):
+    return value.date().isoformat() if value is not None else None
+
+
+def iter_urls():
+    """(адрес, lastmod, changefreq, priority) для всех страниц карты"""
+    from .models import Arenda, News, Product
+
+    # Главная показывает новости, каталог аренды — аренды: их lastmod —
+    # самое позднее изменение, а не отдельный адрес на каждую запись
+    page_lastmod = {
+        "landing": News.objects.filter(is_active=True).aggregate(last=Max("updated_at"))["last"],
+        "rental_catalog": Arenda.objects.filter(is_active=True).aggregate(
+            last=Max("updated_at")
+        )["last"],
+    }
+    for name, changefreq, priority in STATIC_PAGES:
+        yield reverse(name), _lastmod(page_lastmod.get(name)), changefreq, priority
+
+    # Пачки по ключу, а не iterator(): открытый курсор SQLite держит
+    # блокировку чтения всё время записи карты и не даёт сохранять товары
+    rows = Product.objects.filter(is_active=True).order_by("pk").values_list("pk", "updated_at")
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        for pk, updated_at in batch:
+            yield reverse("product_detail", args=[pk]), _lastmod(updated_at), "weekly", "0.9"
+        if len(batch) < BATCH_SIZE:
+            break
+        last_pk = batch[-1][0]
+
+
+def _url_entry(location, lastmod, changefreq, priority):
+    parts = [f"<url><loc>{escape(_absolute(location))}</loc>"]
+    if lastmod:
+        parts.append(f"<lastmod>{lastmod}</lastmod>")
+    parts.append(f"<changefreq>{changefreq}</changefreq><priority>{priority}</priority></url>\n")
+    return "".join(parts)
+
+
+def _replace(root, name, write):
+    """Пишет файл во временный рядом и атомарно подменяет им name"""
+    fd, temp_path = tempfile.mkstemp(dir=root, prefix=f".{name}.")
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            write(raw)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, os.path.join(root, name))
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _write_shard(raw, urls):
+    # mtime=0: одинаковое содержимое даёт одинаковые байты
+    with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset {XMLNS}>\n'.encode())
+        for entry in urls:
+            f.write(_url_entry(*entry).encode())
+        f.write(b"</urlset>\n")
+
+
+def build_sitemap(root=None):
+    """Записывает части и индекс карты сайта, возвращает число адресов"""
+    root = str(root or settings.SITEMAP_ROOT)
+    os.makedirs(root, exist_ok=True)
+    urls = iter_urls()
+    total, shards = 0, []
+
+    def take(count):
+        # Часть берёт из общего итератора не больше count адресов
+        nonlocal total
+        for entry in urls:
+            total += 1
+            yield entry
+            count -= 1
+            if count == 0:
+                return
+
+    while True:
+        name = f"sitemap-{len(shards) + 1}.xml.gz"
+        written = total
+        _replace(root, name, lambda raw: _write_shard(raw, take(SHARD_SIZE)))
+        if total == written and shards:
+            # Адреса закончились ровно на границе части: пустая часть не нужна
+            os.unlink(os.path.join(root, name))
+            break
+        shards.append(name)
+        if total - written < SHARD_SIZE:
+            break
+
+    def write_index(raw):
+        raw.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex {XMLNS}>\n'.encode())
+        for name in shards:
+            raw.write(f"<sitemap><loc>{escape(_absolute('/' + name))}</loc></sitemap>\n".encode())
+        raw.write(b"</sitemapindex>\n")
+
+    _replace(root, INDEX_NAME, write_index)
+
+    # Части, оставшиеся от прошлой, более длинной карты
+    for name in os.listdir(root):
+        if FILE_NAME_RE.match(name) and name != INDEX_NAME and name not in shards:
+            os.unlink(os.path.join(root, name))
+    return total
+
+
+_rebuilder = Rebuilder("sitemap", build_sitemap, "карту сайта")
+
+
+def schedule_rebuild():
+    """Перестраивает карту сайта в фоне"""
+    _rebuilder.schedule()
+
+
+def wait_for_rebuild(timeout=None):
+    """Ждёт окончания фоновой перестройки (перед удалением временной базы)"""
+    _rebuilder.wait(timeout)
+
+
+def serve_sitemap(request, name):
+    """Отдаёт индекс или часть карты с ETag и Last-Modified"""
+    if not FILE_NAME_RE.match(name):
+        raise Http404
+    path = os.path.join(settings.SITEMAP_ROOT, name)
+    if not os.path.isfile(path):
+        if name != INDEX_NAME:
+            raise Http404
+        # Первое обращение до команды build_sitemap: строим карту сразу
+        build_sitemap()
+
+    stat = os.stat(path)
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if not_modified is not None:
+        not_modified["ETag"] = etag
+        return not_modified
+
+    response = FileResponse(open(path, "rb"), content_type=CONTENT_TYPES[os.path.splitext(name)[1]])
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Cache-Control"] = "no-cache"
+    return response
@@ -0,0 +1,51 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from core import assets
+
+register = template.Library()
+
+
+@register.simple_tag
+def stylesheet_bundle(name, defer=False):
+    """<link> на CSS-бандл или на его исходники, если бандл не собран.
+
+    defer=True для страниц с критическим CSS: собранный бандл грузится,
+    не блокируя отрисовку, и применяется, когда загрузится.
+    """
+    urls = assets.urls(name)
+    if defer and assets.is_built(assets.bundle_path(name)):
+        return format_html(
+            '<link rel="preload" href="{0}" as="style" '
+            "onload=\"this.onload=null;this.rel='stylesheet'\">"
+            '<noscript><link rel="stylesheet" href="{0}"></noscript>',
+            urls[0],
+        )
+    return format_html_join("\n", '<link rel="stylesheet" href="{}">', ((url,) for url in urls))
+
+
+@register.simple_tag
+def script_bundle(name):
+    """<script> на JS-бандл или на его исходники, если бандл не собран"""
+    return format_html_join("\n", '<script src="{}"></script>', ((url,) for url in assets.urls(name)))
+
+
+@register.simple_tag
+def critical_css(page):
+    """Встроенный критический CSS страницы; пусто, пока статика не собрана"""
+    css = assets.critical_css(page)
+    if not css:
+        return ""
+    # Закрывающий тег внутри CSS оборвал бы <style>
+    return mark_safe("<style>" + css.replace("</", "<\\/") + "</style>")
+
+
+@register.simple_tag
+def font_preloads():
+    """<link rel="preload"> шрифтов первого экрана из subset_fonts"""
+    return format_html_join(
+        "\n",
+        '<link rel="preload" href="{}" as="font" type="font/woff2" crossorigin>',
+        ((url,) for url in assets.font_preload_urls()),
+    )
@@ -0,0 +1,23 @@
+from django import template
+
+from core import cards as card_fragments
+
+register = template.Library()
+
+
+@register.simple_tag
+def cards(items, variant):
+    """Карточки позиций items вида variant (includes/cards/<variant>.html) из кэша"""
+    return card_fragments.render_cards(items, variant)
+
+
+@register.simple_tag
+def card(item, variant):
+    """Одна карточка — для списков с условием внутри цикла"""
+    return card_fragments.render_cards([item], variant)
+
+
+@register.simple_tag
+def static_include(template_name):
+    """Шаблон без переменных контекста (меню, подвал), отрендеренный раз на сборку"""
+    return card_fragments.static_fragment(template_name)
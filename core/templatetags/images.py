@@ -0,0 +1,32 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html_join
+
+from core.renditions import FORMATS, get_manifest
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_sources(image, sizes="100vw"):
+    """Теги <source> с AVIF/WebP-копиями изображения для <picture>.
+
+    Оригинал остаётся в <img> внутри <picture>: пока копии не построены,
+    тег ничего не выводит и браузер загружает оригинал.
+    """
+    manifest = get_manifest(image.name) if image else None
+    if manifest is None:
+        return ""
+    return format_html_join(
+        "",
+        '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (
+                FORMATS[fmt][0],
+                ", ".join(f"{default_storage.url(path)} {width}w" for width, path in items),
+                sizes,
+            )
+            for fmt, items in manifest["sources"].items()
+            if fmt in FORMATS
+        ),
+    )
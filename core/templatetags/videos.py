@@ -0,0 +1,37 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+
+from core.videos import get_manifest
+
+register = template.Library()
+
+
+@register.simple_tag
+def video(name, **attrs):
+    """<video> для ролика name из media/video.
+
+    Если для ролика построены копии, перед оригиналом выводятся <source>
+    с media-условиями, и узкий экран получает лёгкую копию; постер
+    подставляется, если атрибут poster не передан. По умолчанию браузер
+    загружает только метаданные ролика.
+    """
+    manifest = get_manifest(name) or {}
+    attrs.setdefault("preload", "metadata")
+    if manifest.get("poster") and "poster" not in attrs:
+        attrs["poster"] = default_storage.url(manifest["poster"])
+    sources = format_html_join(
+        "",
+        '<source src="{}" type="video/mp4" media="{}">',
+        (
+            (default_storage.url(variant["path"]), variant["media"])
+            for variant in manifest.get("variants", ())
+        ),
+    )
+    return format_html(
+        '<video{}>{}<source src="{}" type="video/mp4"></video>',
+        flatatt(attrs),
+        sources,
+        default_storage.url(name),
+    )
@@ -1,3 +1,993 @@
-from django.test import TestCase
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import product as combinations_of
+from unittest import mock
+from urllib.parse import parse_qsl
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    cards,
+    catalog,
+    page_cache,
+    player_ranges,
+    pricing,
+    recommendations,
+    search,
+    videos,
+)
+from .facets import FACETS
+from .importer import PriceListImporter, file_checksum, read_csv, rollback_import
+from .models import (
+    AdditionalProducts,
+    Arenda,
+    Discount,
+    EffectivePrice,
+    GameType,
+    News,
+    NewsImage,
+    Order,
+    OrderLine,
+    OrderNotification,
+    PlayerAge,
+    PlayerCount,
+    PlayerRange,
+    PriceListImport,
+    Product,
+    Size,
+)
+from .notifications import NotificationWorker
+from .orders import create_order
+from .player_ranges import RangeTable
+from .pricing import refresh_effective_prices
+from .query_budget import QUERY_BUDGETS, QueryBudgetTestMixin
+from .recommendations import build_recommendations
+
+
+class FakeBotAPI:
+    """Локальный сервер Bot API: записывает sendMessage и отвечает по очереди ответов"""
+
+    def __init__(self):
+        self.messages = []
+        # Ответы на следующие sendMessage: (HTTP-статус, описание ошибки)
+        self.failures = []
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(body or "{}")
+                else:
+                    params = dict(parse_qsl(body))
+                method = self.path.rsplit("/", 1)[-1]
+                status, payload = api.answer(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/bot"
+
+    def answer(self, method, params):
+        if method == "getMe":
+            return 200, {
+                "ok": True,
+                "result": {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot"},
+            }
+        if method != "sendMessage":
+            return 200, {"ok": True, "result": True}
+        if self.failures:
+            status, description = self.failures.pop(0)
+            return status, {"ok": False, "error_code": status, "description": description}
+        self.messages.append(params)
+        return 200, {
+            "ok": True,
+            "result": {
+                "message_id": len(self.messages),
+                "date": 0,
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "text": params.get("text", ""),
+            },
+        }
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class NotificationWorkerTests(TestCase):
+    def setUp(self):
+        self.api = FakeBotAPI().__enter__()
+        self.addCleanup(self.api.__exit__)
+        settings = override_settings(TELEGRAM_API_BASE_URL=self.api.base_url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def create_order(self, **kwargs):
+        fields = {"name": "Иван", "phone": "+79990000000", "order_type": "buy"}
+        fields.update(kwargs)
+        return Order.objects.create(**fields)
+
+    def run_worker(self):
+        worker = NotificationWorker(token="123:abc", chat_id="42")
+        return async_to_sync(worker.run)(once=True)
+
+    def test_order_is_sent_once(self):
+        order = self.create_order()
+
+        self.assertEqual(self.run_worker(), 1)
+        self.assertEqual(self.run_worker(), 0)
+
+        notification = OrderNotification.objects.get(order=order)
+        self.assertEqual(notification.status, OrderNotification.Status.SENT)
+        self.assertEqual(len(self.api.messages), 1)
+        self.assertEqual(self.api.messages[0]["chat_id"], "42")
+        self.assertIn("Иван", self.api.messages[0]["text"])
+
+    def test_server_error_is_retried(self):
+        order = self.create_order()
+        self.api.failures.append((502, "Bad Gateway"))
+
+        self.run_worker()
+        notification = OrderNotification.objects.get(order=order)
+        self.assertEqual(notification.status, OrderNotification.Status.PENDING)
+        self.assertEqual(notification.attempts, 1)
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+
+        notification.next_attempt_at = timezone.now() - timedelta(seconds=1)
+        notification.save()
+        self.run_worker()
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, OrderNotification.Status.SENT)
+        self.assertEqual(len(self.api.messages), 1)
+
+    def test_user_text_is_escaped(self):
+        self.create_order(name="snake_case *bold*", comment="[ссылка")
+
+        self.run_worker()
+        text = self.api.messages[0]["text"]
+        self.assertIn(r"snake\_case \*bold\*", text)
+        self.assertIn(r"\[ссылка", text)
+
+    def test_markup_rejected_falls_back_to_plain_text(self):
+        order = self.create_order()
+        self.api.failures.append((400, "Bad Request: can't parse entities"))
+
+        self.run_worker()
+        notification = OrderNotification.objects.get(order=order)
+        self.assertEqual(notification.status, OrderNotification.Status.SENT)
+        self.assertNotIn("parse_mode", self.api.messages[0])
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    IMAGE_RENDITION_WORKERS=0,
+)
+class PriceListImportTests(TestCase):
+    HEADER = "sku;name;price;sizes\n"
+
+    def run_import(self, lines, resume=False, stop=None, **kwargs):
+        data = (self.HEADER + "".join(lines)).encode()
+        rows = read_csv(io.BytesIO(data))
+        if stop is not None:
+            rows = self.interrupted(rows, stop)
+        importer = PriceListImporter(Product, chunk_size=2, **kwargs)
+        importer.run(rows, checksum=file_checksum(io.BytesIO(data)), resume=resume)
+        return importer.record
+
+    def interrupted(self, rows, stop):
+        for number, row in enumerate(rows):
+            if number == stop:
+                raise KeyboardInterrupt
+            yield row
+
+    def state(self):
+        return {
+            product.sku: (product.price, product.is_active, [size.name for size in product.sizes.all()])
+            for product in Product.objects.prefetch_related("sizes")
+        }
+
+    def test_interrupted_import_resumes_after_last_chunk(self):
+        lines = [f"SKU{i};Игра {i};{100 + i};30x30\n" for i in range(5)]
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_import(lines, stop=3)
+        record = PriceListImport.objects.get()
+        self.assertEqual(record.status, PriceListImport.Status.FAILED)
+        # Третья строка была в незакоммиченной пачке
+        self.assertEqual(record.rows, 2)
+        self.assertEqual(Product.objects.count(), 2)
+
+        self.assertEqual(self.run_import(lines, resume=True), record)
+        record.refresh_from_db()
+        self.assertEqual(record.status, PriceListImport.Status.COMPLETED)
+        self.assertEqual((record.rows, record.created), (5, 5))
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_rollback_restores_items(self):
+        self.run_import(["A;Игра А;100;30x30\n", "B;Игра Б;200;40x40\n", "C;Игра В;300;30x30\n"])
+        before = self.state()
+
+        record = self.run_import(
+            ["A;Игра А;150;40x40\n", "D;Игра Г;400;30x30\n"], deactivate_missing=True
+        )
+        self.assertEqual(record.changes.count(), 4)
+        self.assertEqual(Product.objects.filter(is_active=False).count(), 2)
+
+        self.assertEqual(rollback_import(record), 4)
+        self.assertEqual(self.state(), before)
+        record.refresh_from_db()
+        self.assertEqual(record.status, PriceListImport.Status.ROLLED_BACK)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class StaleDiscountTableTests(TestCase):
+    def setUp(self):
+        pricing._table = None
+        self.addCleanup(setattr, pricing, "_table", None)
+        today = timezone.localdate()
+        self.product = Product.objects.create(
+            name="Игра", description="d", price=Decimal(1000), image="products/x.jpg"
+        )
+        discount = Discount.objects.create(name="10%", value=10, start_date=today, end_date=today)
+        discount.products.set([self.product])
+        # Цены посчитаны вчера, скидка началась сегодня
+        refresh_effective_prices(day=today - timedelta(days=1))
+
+    def test_stale_prices_are_resolved_live_and_refreshed_in_background(self):
+        with mock.patch.object(pricing._refresher, "schedule") as schedule:
+            table = pricing.get_discount_table()
+            self.assertEqual(pricing.get_discount_table(), table)
+
+        self.assertTrue(table.stale)
+        self.assertEqual(table.resolve(self.product).price, Decimal(900))
+        schedule.assert_called_once_with()
+        # Запрос не пересчитывает каталог сам
+        self.assertFalse(EffectivePrice.objects.filter(valid_on=timezone.localdate()).exists())
+
+
+class BuildInfoTests(SimpleTestCase):
+    def setUp(self):
+        page_cache.build_info.cache_clear()
+        self.addCleanup(page_cache.build_info.cache_clear)
+
+    @override_settings(BUILD_ID="abc123", BUILD_TIME="1700000000")
+    def test_build_time_setting(self):
+        self.assertEqual(page_cache.build_info(), ("abc123", 1700000000))
+
+    def test_build_time_from_static_manifest(self):
+        with tempfile.TemporaryDirectory() as static_root:
+            manifest = os.path.join(static_root, "staticfiles.json")
+            with open(manifest, "w") as f:
+                json.dump({"version": "1.1", "paths": {}, "hash": ""}, f)
+            os.utime(manifest, (1600000000, 1600000000))
+            with override_settings(BUILD_ID="abc123", BUILD_TIME="", STATIC_ROOT=static_root):
+                self.assertEqual(page_cache.build_info(), ("abc123", 1600000000))
+
+
+class SqliteWriteContentionTests(SimpleTestCase):
+    """Профиль подключения из settings (WAL, busy_timeout, BEGIN IMMEDIATE) под
+    одновременной записью: транзакции ждут блокировку, а не падают с ошибкой"""
+
+    WRITERS = 8
+    TRANSACTIONS = 40
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Тестовая база в памяти, поэтому профиль проверяется на файле
+        self.settings_dict = {
+            **connections.settings["default"],
+            "NAME": os.path.join(directory.name, "contention.sqlite3"),
+        }
+        with self.connect("setup") as wrapper, wrapper.cursor() as cursor:
+            cursor.execute("CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER)")
+            cursor.execute("INSERT INTO counter (id, value) VALUES (1, 0)")
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+
+    def connect(self, alias):
+        wrapper = DatabaseWrapper(self.settings_dict, alias)
+        connections[alias] = wrapper
+        return contextlib.closing(wrapper)
+
+    def write(self, number, errors):
+        alias = f"writer{number}"
+        try:
+            with self.connect(alias) as wrapper:
+                for _ in range(self.TRANSACTIONS):
+                    # Чтение, затем запись в одной транзакции: с BEGIN DEFERRED
+                    # такая транзакция получает "database is locked" без ожидания
+                    with transaction.atomic(using=alias), wrapper.cursor() as cursor:
+                        cursor.execute("SELECT value FROM counter WHERE id = 1")
+                        value = cursor.fetchone()[0]
+                        cursor.execute("UPDATE counter SET value = %s WHERE id = 1", [value + 1])
+        except OperationalError as error:
+            errors.append(error)
+        finally:
+            del connections[alias]
+
+    def test_concurrent_writers_do_not_get_locked(self):
+        errors = []
+        writers = [
+            threading.Thread(target=self.write, args=(number, errors))
+            for number in range(self.WRITERS)
+        ]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+        self.assertEqual(errors, [])
+        with self.connect("check") as wrapper, wrapper.cursor() as cursor:
+            cursor.execute("SELECT value FROM counter WHERE id = 1")
+            self.assertEqual(cursor.fetchone()[0], self.WRITERS * self.TRANSACTIONS)
+
+
+class RangeTableTests(SimpleTestCase):
+    def lookup(self, rows, guests):
+        found = RangeTable("v", sorted(rows)).lookup(guests)
+        return tuple(found) if found else None
+
+    def test_disjoint_ranges(self):
+        rows = [(2, 4, 1, 3), (6, 8, 4, 5)]
+        self.assertEqual(self.lookup(rows, 2), (1, 3))
+        self.assertEqual(self.lookup(rows, 4), (1, 3))
+        self.assertIsNone(self.lookup(rows, 5))
+        self.assertEqual(self.lookup(rows, 8), (4, 5))
+        self.assertIsNone(self.lookup(rows, 1))
+        self.assertIsNone(self.lookup(rows, 9))
+
+    def test_overlapping_ranges_use_first_in_table_order(self):
+        rows = [(12, 14, 7, 8), (14, 16, 9, 10)]
+        self.assertEqual(self.lookup(rows, 14), (7, 8))
+        self.assertEqual(self.lookup(rows, 15), (9, 10))
+
+    def test_nested_ranges(self):
+        rows = [(2, 100, 1, 1), (5, 6, 2, 2)]
+        self.assertEqual(self.lookup(rows, 5), (1, 1))
+        self.assertEqual(self.lookup(rows, 50), (1, 1))
+        self.assertEqual(self.lookup(rows, 100), (1, 1))
+        self.assertIsNone(self.lookup(rows, 101))
+
+
+def reset_worker_tables():
+    """Сбрасывает таблицы, которые воркер держит в памяти между запросами"""
+    pricing._table = None
+    catalog._snapshot = None
+    recommendations._table = None
+    player_ranges._table = None
+    cards._local.clear()
+
+
+@override_settings(
+    QUERY_BUDGET_LOG=None,
+    QUERY_BUDGET_SAMPLE_RATE=0,
+    IMAGE_RENDITION_WORKERS=0,
+)
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    # Во сколько раз каталог больше базового (6 игр, 1 доп)
+    SCALE = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        sizes = [Size.objects.create(name=name) for name in ("30x30", "40x40")]
+        count = PlayerCount.objects.create(count=2)
+        age = PlayerAge.objects.create(age="6+")
+        game_type = GameType.objects.create(name="Логика")
+        cls.products = []
+        for i in range(6 * cls.SCALE):
+            product = Product.objects.create(
+                name=f"Игра {i}", description="d", price=Decimal(1000 + i), image="products/x.jpg"
+            )
+            product.sizes.set([sizes[i % 2]])
+            product.player_counts.set([count])
+            product.player_ages.set([age])
+            product.game_types.set([game_type])
+            cls.products.append(product)
+        arenda = Arenda.objects.create(
+            name="Аренда", description="d", price=Decimal(5000), image="products/a.jpg"
+        )
+        cls.additional = AdditionalProducts.objects.create(
+            name="СУМКА", price=Decimal(500), image="products/b.jpg"
+        )
+        for i in range(cls.SCALE - 1):
+            AdditionalProducts.objects.create(
+                name=f"Доп {i}", price=Decimal(100 + i), image="products/b.jpg"
+            )
+        cls.news = News.objects.create(name="Новость", image="news/n.jpg")
+        NewsImage.objects.create(news=cls.news, image="news/m.jpg")
+        PlayerRange.objects.create(min_players=2, max_players=10, min_game_count=1, max_game_count=3)
+        discount = Discount.objects.create(
+            name="10%", value=10, start_date=today - timedelta(days=1), end_date=today
+        )
+        discount.products.set(cls.products[: len(cls.products) // 2])
+        discount.arendas.set([arenda])
+        # Производные таблицы строятся после коммита, в тесте его нет
+        refresh_effective_prices()
+        build_recommendations()
+
+    def setUp(self):
+        # Холодный старт воркера: свой кэш у каждого теста (LocMemCache общий
+        # для одинакового LOCATION) и сброшенные таблицы в памяти процесса
+        caches = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                    "LOCATION": f"query-budget-{self.id()}",
+                }
+            }
+        )
+        caches.enable()
+        self.addCleanup(caches.disable)
+        reset_worker_tables()
+
+    def test_every_budget_is_checked(self):
+        checked = {name[len("test_"):] for name in dir(self) if name.startswith("test_")}
+        self.assertLessEqual(set(QUERY_BUDGETS), checked)
+
+    def test_discount_version_is_read_once_per_request(self):
+        with mock.patch.object(pricing, "get_version", wraps=pricing.get_version) as get_version:
+            self.client.get(reverse("game_catalog"))
+        reads = [
+            call
+            for call in get_version.call_args_list
+            if call.args == (pricing.DISCOUNTS_NAMESPACE,)
+        ]
+        self.assertEqual(len(reads), 1)
+
+    def test_landing(self):
+        self.assertWithinQueryBudget(reverse("landing"))
+
+    def test_about(self):
+        self.assertWithinQueryBudget(reverse("about"))
+
+    def test_game_catalog(self):
+        self.assertWithinQueryBudget(
+            reverse("game_catalog"), {"size": "30x30", "search": "игра", "sort": "price_asc"}
+        )
+
+    def test_product_detail(self):
+        self.assertWithinQueryBudget(reverse("product_detail", args=[self.products[0].pk]))
+
+    def test_rental_catalog(self):
+        self.assertWithinQueryBudget(reverse("rental_catalog"))
+
+    def test_two_games_on_one_board(self):
+        self.assertWithinQueryBudget(reverse("two_games_on_one_board"))
+
+    def test_additional_product_detail(self):
+        self.assertWithinQueryBudget(
+            reverse("additional_product_detail", args=[self.additional.pk])
+        )
+
+    def test_calculate_games(self):
+        self.assertWithinQueryBudget(reverse("calculate_games"), {"guests": 4})
+
+    def test_player_ranges_table(self):
+        self.assertWithinQueryBudget(reverse("player_ranges_table"))
+
+    def test_news_gallery(self):
+        self.assertWithinQueryBudget(reverse("news_gallery", args=[self.news.pk]))
+
+    def test_process_order(self):
+        response = self.assertWithinQueryBudget(
+            reverse("process_order"),
+            {
+                "order_type": "buy",
+                "name": "Иван",
+                "phone": "+79990000000",
+                "buy_games": [product.pk for product in self.products[:2]],
+                "additional_goods": [self.additional.pk],
+                "delivery_address": "Красноярск",
+            },
+            method="post",
+        )
+        self.assertTrue(response.json()["success"])
+
+
+class LargeCatalogQueryBudgetTests(QueryBudgetTests):
+    """Те же страницы и бюджеты на каталоге в 10 раз больше: число запросов
+    не должно зависеть от числа позиций"""
+
+    SCALE = 10
+
+
+class FacetIndexTests(TestCase):
+    """Маски фасетного индекса против того же фильтра через ORM"""
+
+    @classmethod
+    def setUpTestData(cls):
+        sizes = [Size.objects.create(name=name) for name in ("30x30", "40x40", "50x50")]
+        counts = [PlayerCount.objects.create(count=count) for count in (2, 4)]
+        ages = [PlayerAge.objects.create(age=age) for age in ("3+", "6+")]
+        types = [GameType.objects.create(name=name) for name in ("Логика", "Шашки")]
+        for i in range(10):
+            product = Product.objects.create(
+                name=f"Игра {i}",
+                description="d",
+                price=Decimal(100),
+                image="products/x.jpg",
+                # Скрытый товар не попадает ни в индекс, ни в выборку ORM
+                is_active=i != 9,
+            )
+            # У части игр по два значения фильтра
+            product.sizes.set(sizes[i % 3 : i % 3 + 1 + i % 2])
+            product.player_counts.set([counts[i % 2]])
+            product.player_ages.set(ages if i % 4 == 0 else [ages[i % 2]])
+            product.game_types.set([types[i % 3 % 2]] if i != 7 else [])
+
+    def setUp(self):
+        self.index = catalog.CatalogSnapshot.load("test").facet_index
+        self.values = {
+            param: [""] + list(self.index._masks[param]) for param, _, _ in FACETS
+        }
+
+    def orm_pks(self, selected):
+        queryset = Product.objects.filter(is_active=True)
+        for param, field, attr in FACETS:
+            if selected.get(param):
+                queryset = queryset.filter(**{f"{field}__{attr}": selected[param]})
+        return set(queryset.values_list("pk", flat=True))
+
+    def combinations(self):
+        params = [param for param, _, _ in FACETS]
+        for values in combinations_of(*(self.values[param] for param in params)):
+            yield dict(zip(params, values))
+
+    def test_combined_filters_match_orm(self):
+        for selected in self.combinations():
+            with self.subTest(selected=selected):
+                found = self.index.items(self.index.filter(selected))
+                self.assertEqual({product.pk for product in found}, self.orm_pks(selected))
+
+    def test_option_counts_exclude_own_facet(self):
+        for selected in self.combinations():
+            options = self.index.options(selected)
+            for param, _, _ in FACETS:
+                for option in options[param]:
+                    with self.subTest(selected=selected, param=param, value=option.value):
+                        expected = self.orm_pks({**selected, param: option.value})
+                        self.assertEqual(option.count, len(expected))
+                        self.assertEqual(option.selected, option.value == selected[param])
+
+    def test_base_mask_limits_results(self):
+        pks = sorted(self.orm_pks({}))[::2]
+        base_mask = self.index.mask_for_pks(pks)
+        selected = {"size": "30x30"}
+        found = self.index.items(self.index.filter(selected, base_mask))
+        self.assertEqual({product.pk for product in found}, self.orm_pks(selected) & set(pks))
+
+
+class SearchIndexTests(TestCase):
+    """Полнотекстовый поиск FTS5 и синхронизация индекса сигналами"""
+
+    def create_product(self, name, description="Настольная игра"):
+        return Product.objects.create(
+            name=name, description=description, price=Decimal(100), image="products/x.jpg"
+        )
+
+    def test_yo_and_ye_are_the_same_letter(self):
+        tree = self.create_product("Ёлочка")
+        hedgehog = self.create_product("Ежик")
+        self.assertEqual(search.search("елочка"), [tree.pk])
+        self.assertEqual(search.search("ЁЛОЧКА"), [tree.pk])
+        self.assertEqual(search.search("ёжик"), [hedgehog.pk])
+
+    def test_words_match_by_prefix(self):
+        chess = self.create_product("Шахматы гигантские")
+        self.create_product("Шашки")
+        self.assertEqual(search.search("шахм"), [chess.pk])
+        self.assertEqual(search.search("гиг шах"), [chess.pk])
+        self.assertEqual(search.search("шахм домино"), [])
+
+    def test_name_match_ranks_above_description_match(self):
+        in_body = self.create_product("Городки", "Русская игра, похожая на кегли")
+        in_name = self.create_product("Кегли напольные")
+        self.assertEqual(search.search("кегли"), [in_name.pk, in_body.pk])
+
+    def test_index_follows_save_and_delete(self):
+        product = self.create_product("Дженга")
+        additional = AdditionalProducts.objects.create(
+            name="Дженга запасные бруски", description="d", price=Decimal(10), image="x.jpg"
+        )
+        self.assertEqual(search.search("дженга"), [product.pk])
+        self.assertEqual(search.search("дженга", kind="additionalproducts"), [additional.pk])
+
+        product.name = "Башня"
+        product.save()
+        self.assertEqual(search.search("дженга"), [])
+        self.assertEqual(search.search("башня"), [product.pk])
+
+        product.delete()
+        additional.delete()
+        self.assertEqual(search.search("башня"), [])
+        self.assertEqual(search.search("дженга", kind="additionalproducts"), [])
+
+
+class PageCacheServeTests(SimpleTestCase):
+    """Заголовок X-Page-Cache для попадания, промаха и устаревшей копии"""
+
+    def setUp(self):
+        caches = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                    "LOCATION": f"page-cache-{self.id()}",
+                }
+            }
+        )
+        caches.enable()
+        self.addCleanup(caches.disable)
+        self.renders = 0
+
+    def render(self):
+        self.renders += 1
+        return HttpResponse(f"страница {self.renders}")
+
+    def serve(self, path):
+        return page_cache.serve(RequestFactory().get(path), ("product",), self.render)
+
+    def test_miss_then_hit(self):
+        first = self.serve("/game-catalog/")
+        self.assertEqual(first["X-Page-Cache"], "miss")
+        second = self.serve("/game-catalog/")
+        self.assertEqual(second["X-Page-Cache"], "hit")
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(self.renders, 1)
+
+    def test_version_bump_rebuilds_page(self):
+        self.serve("/game-catalog/")
+        page_cache.invalidate_pages("product")
+        response = self.serve("/game-catalog/")
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertEqual(response.content.decode(), "страница 2")
+        # Изменение модели, от которой страница не зависит, её не сбрасывает
+        page_cache.invalidate_pages("news")
+        self.assertEqual(self.serve("/game-catalog/")["X-Page-Cache"], "hit")
+
+    def test_stale_copy_while_another_worker_rebuilds(self):
+        self.serve("/game-catalog/")
+        page_cache.invalidate_pages("product")
+        request = RequestFactory().get("/game-catalog/")
+        # Блокировку перестройки держит другой воркер
+        lock = f"{page_cache._cache_key(request)}:lock"
+        cache.add(lock, 1)
+        response = self.serve("/game-catalog/")
+        self.assertEqual(response["X-Page-Cache"], "stale")
+        self.assertEqual(response.content.decode(), "страница 1")
+        self.assertNotIn("ETag", response)
+        self.assertEqual(self.renders, 1)
+
+        cache.delete(lock)
+        self.assertEqual(self.serve("/game-catalog/")["X-Page-Cache"], "miss")
+        # Свою блокировку воркер снимает после перестройки
+        self.assertIsNone(cache.get(lock))
+        self.assertEqual(self.serve("/game-catalog/")["X-Page-Cache"], "hit")
+
+    def test_campaign_params_are_ignored(self):
+        self.serve("/game-catalog/?size=40x40&sort=name_asc")
+        response = self.serve(
+            "/game-catalog/?utm_source=vk&sort=name_asc&gclid=abc&size=40x40&yclid=1"
+        )
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertEqual(self.serve("/game-catalog/?size=50x50")["X-Page-Cache"], "miss")
+        self.assertEqual(self.renders, 2)
+
+
+class OrderTests(TestCase):
+    """Проверка данных заказа до записи и откат заказа при сбое записи строк"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            name="Шахматы", description="d", price=Decimal(1000), image="products/x.jpg"
+        )
+        cls.hidden = Product.objects.create(
+            name="Шашки", description="d", price=Decimal(900), image="products/x.jpg",
+            is_active=False,
+        )
+        cls.additional = AdditionalProducts.objects.create(
+            name="СУМКА", price=Decimal(500), image="products/b.jpg"
+        )
+        refresh_effective_prices()
+
+    def setUp(self):
+        reset_worker_tables()
+
+    def form(self, **fields):
+        data = QueryDict(mutable=True)
+        data.update({"order_type": "buy", "name": "Иван", "phone": "+79990000000"})
+        for field, values in fields.items():
+            data.setlist(field, [str(value) for value in values])
+        return data
+
+    def assertNothingSaved(self):
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderLine.objects.exists())
+        self.assertFalse(Order.products.through.objects.exists())
+        self.assertFalse(Order.additional_products.through.objects.exists())
+        self.assertFalse(OrderNotification.objects.exists())
+
+    def test_unknown_and_inactive_ids_are_rejected(self):
+        unknown = self.product.pk + self.hidden.pk + 100
+        cases = [
+            ("buy_games", [self.product.pk, unknown], str(unknown)),
+            ("buy_games", [self.hidden.pk], str(self.hidden.pk)),
+            ("additional_goods", [unknown], str(unknown)),
+            ("buy_games", ["шахматы"], "«Игры»"),
+        ]
+        for field, values, message in cases:
+            with self.subTest(field=field, values=values):
+                with self.assertRaisesMessage(ValidationError, message):
+                    create_order(self.form(**{field: values}))
+        self.assertNothingSaved()
+
+    def test_order_is_rolled_back_when_lines_fail(self):
+        data = self.form(buy_games=[self.product.pk], additional_goods=[self.additional.pk])
+        with mock.patch.object(
+            OrderLine.objects, "bulk_create", side_effect=OperationalError("disk I/O error")
+        ):
+            with self.assertRaises(OperationalError):
+                create_order(data)
+        self.assertNothingSaved()
+
+        order = create_order(data)
+        self.assertEqual(order.items_count, 2)
+        self.assertEqual(order.lines.count(), 2)
+
+
+class ServeVideoRangeTests(SimpleTestCase):
+    """Отдача видео частями по заголовку Range"""
+
+    CONTENT = bytes(range(100))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        os.mkdir(os.path.join(directory.name, videos.VIDEO_DIR))
+        with open(os.path.join(directory.name, videos.VIDEO_DIR, "promo.mp4"), "wb") as f:
+            f.write(self.CONTENT)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def get(self, **headers):
+        response = videos.serve_video(RequestFactory().get("/", headers=headers), "promo.mp4")
+        self.addCleanup(response.close)
+        return response
+
+    def test_slice(self):
+        response = self.get(range="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.CONTENT[10:20])
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_end_past_file_is_clamped(self):
+        response = self.get(range="bytes=90-500")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.CONTENT[90:])
+        self.assertEqual(response["Content-Range"], "bytes 90-99/100")
+
+    def test_suffix_range(self):
+        response = self.get(range="bytes=-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.CONTENT[-5:])
+        self.assertEqual(response["Content-Range"], "bytes 95-99/100")
+
+    def test_unsatisfiable_range(self):
+        for header in ("bytes=100-", "bytes=500-600"):
+            with self.subTest(header=header):
+                response = self.get(range=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], "bytes */100")
+
+    def test_changed_file_is_sent_whole(self):
+        # If-Range со старым ETag: клиенту нужен весь новый файл, а не его часть
+        response = self.get(range="bytes=10-19", if_range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.CONTENT)
+
+
+class OrderTotalsTests(TestCase):
+    """Суммы строк и заказа в Decimal против посчитанных вручную"""
+
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.localdate()
+        cls.discounted = Product.objects.create(
+            name="Шахматы", description="d", price=Decimal("999.99"), image="products/x.jpg"
+        )
+        cls.full_price = Product.objects.create(
+            name="Шашки", description="d", price=Decimal("1000.00"), image="products/x.jpg"
+        )
+        cls.additional = AdditionalProducts.objects.create(
+            name="СУМКА", price=Decimal("333.33"), image="products/b.jpg"
+        )
+        percentage = Discount.objects.create(
+            name="15%", value=Decimal(15), start_date=today, end_date=today
+        )
+        percentage.products.set([cls.discounted])
+        fixed = Discount.objects.create(
+            name="Минус 33,33", discount_type="fixed", value=Decimal("33.33"),
+            start_date=today, end_date=today,
+        )
+        fixed.additional_products.set([cls.additional])
+        refresh_effective_prices()
+
+    def setUp(self):
+        reset_worker_tables()
+
+    def order(self, order_type):
+        data = QueryDict(mutable=True)
+        data.update({"order_type": order_type, "name": "Иван", "phone": "+79990000000"})
+        data.setlist("buy_games", [str(self.discounted.pk), str(self.full_price.pk)])
+        data.setlist("additional_goods", [str(self.additional.pk)])
+        order = Order.objects.get(pk=create_order(data).pk)
+        lines = [
+            (line.name, line.discounted_price, line.quantity, line.adjustment, line.total)
+            for line in order.lines.order_by("position")
+        ]
+        return order, lines
+
+    def test_single_game_board(self):
+        order, lines = self.order("buy")
+        self.assertEqual(
+            lines,
+            [
+                # 999.99 * 0.85 = 849.9915
+                ("Шахматы", Decimal("849.99"), 1, Decimal(1), Decimal("849.99")),
+                ("Шашки", Decimal("1000.00"), 1, Decimal(1), Decimal("1000.00")),
+                ("СУМКА", Decimal("300.00"), 1, Decimal(1), Decimal("300.00")),
+            ],
+        )
+        self.assertEqual(order.total, Decimal("2149.99"))
+        self.assertEqual(order.items_count, 3)
+        self.assertEqual(order.items_summary, "Шахматы, Шашки, СУМКА")
+
+    def test_two_games_on_one_board(self):
+        order, lines = self.order("double_buy")
+        self.assertEqual(
+            lines,
+            [
+                # 849.99 * 0.9 * 2 = 1529.982
+                ("Шахматы", Decimal("849.99"), 2, Decimal("0.9"), Decimal("1529.98")),
+                ("Шашки", Decimal("1000.00"), 2, Decimal("0.9"), Decimal("1800.00")),
+                # Доп на доску не ставится: без коэффициента
+                ("СУМКА", Decimal("300.00"), 1, Decimal(1), Decimal("300.00")),
+            ],
+        )
+        self.assertEqual(order.total, Decimal("3629.98"))
+
+
+class ComputeRecommendationsTests(TestCase):
+    """Ранжирование рекомендаций на небольшом каталоге с известными счетами"""
+
+    @classmethod
+    def setUpTestData(cls):
+        size = Size.objects.create(name="40x40")
+        logic = GameType.objects.create(name="Логика")
+        created = timezone.now() - timedelta(days=30)
+
+        def create(model, name, **fields):
+            item = model.objects.create(
+                name=name, price=Decimal(100), image="products/x.jpg", **fields
+            )
+            # Порядок создания задаётся явно: от него зависит выбор при равенстве
+            model.objects.filter(pk=item.pk).update(
+                created_at=created + timedelta(days=model.objects.count())
+            )
+            return item
+
+        # От старых к новым
+        cls.same_type = create(Product, "Same type", description="d")
+        cls.same_size = create(Product, "Same size", description="d")
+        cls.ordered_with = create(Product, "Ordered with", description="d")
+        cls.popular = create(Product, "Popular", description="d")
+        cls.same_size_newer = create(Product, "Same size newer", description="d")
+        cls.unrelated = create(Product, "Unrelated", description="d")
+        cls.hidden = create(Product, "Hidden", description="d", is_active=False)
+        cls.game = create(Product, "Game", description="d")
+        cls.game.game_types.set([logic])
+        cls.game.sizes.set([size])
+        cls.same_type.game_types.set([logic])
+        cls.hidden.game_types.set([logic])
+        for product in (cls.same_size, cls.ordered_with, cls.same_size_newer):
+            product.sizes.set([size])
+
+        cls.bag = create(AdditionalProducts, "Сумка большая")
+        cls.small_bag = create(AdditionalProducts, "Сумка малая")
+        cls.certificate = create(AdditionalProducts, "Сертификат")
+
+        refresh_effective_prices()
+        reset_worker_tables()
+        for games, additional in (
+            ([cls.game, cls.ordered_with], [cls.certificate]),
+            ([cls.popular], []),
+        ):
+            data = QueryDict(mutable=True)
+            data.update({"order_type": "buy", "name": "Иван", "phone": "+79990000000"})
+            data.setlist("buy_games", [str(game.pk) for game in games])
+            data.setlist("additional_goods", [str(item.pk) for item in additional])
+            create_order(data)
+
+    def setUp(self):
+        reset_worker_tables()
+        self.result = recommendations.compute_recommendations()
+
+    def pks(self, *items):
+        return tuple(item.pk for item in items)
+
+    def test_ranking_for_product(self):
+        products, additional = self.result[("product", self.game.pk)]
+        self.assertEqual(
+            products,
+            self.pks(
+                # Счёт 3: совместный заказ (2) + размер (1) выше вида игры (3),
+                # потому что этот товар заказывали
+                self.ordered_with,
+                self.same_type,
+                # Счёт 1 и ни одного заказа: сначала более новый
+                self.same_size_newer,
+                self.same_size,
+                # Добор без счёта: популярный, затем новые
+                self.popular,
+                self.unrelated,
+            ),
+        )
+        self.assertEqual(additional, self.pks(self.certificate, self.small_bag, self.bag))
+
+    def test_self_and_inactive_items_are_excluded(self):
+        for (kind, pk), lists in self.result.items():
+            with self.subTest(kind=kind, pk=pk):
+                own = lists[recommendations.KINDS.index(kind)]
+                self.assertNotIn(pk, own)
+                self.assertNotIn(self.hidden.pk, lists[0])
+        self.assertNotIn(("product", self.hidden.pk), self.result)
+
+    def test_fallback_fills_additional_products(self):
+        products, additional = self.result[("additionalproducts", self.bag.pk)]
+        # Общее первое слово названия, затем добор популярными
+        self.assertEqual(additional, self.pks(self.small_bag, self.certificate))
+        # Товаров со счётом нет: по одному заказу у трёх, среди них новые выше
+        self.assertEqual(
+            products,
+            self.pks(
+                self.game,
+                self.popular,
+                self.ordered_with,
+                self.unrelated,
+                self.same_size_newer,
+                self.same_size,
+                self.same_type,
+            ),
+        )
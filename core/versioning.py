@@ -0,0 +1,66 @@
+"""Версии кэшируемых данных, общие для всех воркеров.
+
+Версия хранится в кэше Django. При изменении данных записывается новая
+случайная версия, и каждый воркер при следующем обращении видит, что его
+локальная копия устарела. Случайное значение (а не счётчик) не даст совпасть
+старой и новой версии даже после очистки кэша. Перед случайной частью
+записывается время изменения в секундах: по нему страницы отдают
+Last-Modified.
+"""
+
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+
+def _key(namespace):
+    return f"version:{namespace}"
+
+
+def _new_version():
+    return f"{int(time.time())}-{uuid.uuid4().hex}"
+
+
+def version_time(version):
+    """Время изменения из версии (unix-секунды) или None для версий старого вида"""
+    stamp, _, rest = str(version).partition("-")
+    return int(stamp) if rest and stamp.isdigit() else None
+
+
+def get_version(namespace):
+    """Возвращает текущую версию данных из пространства имён namespace"""
+    version = cache.get(_key(namespace))
+    if version is None:
+        cache.add(_key(namespace), _new_version(), timeout=None)
+        version = cache.get(_key(namespace))
+    return version
+
+
+def bump_version(namespace):
+    """Помечает данные пространства имён namespace как изменившиеся"""
+    version = _new_version()
+    cache.set(_key(namespace), version, timeout=None)
+    return version
+
+
+def get_versions(namespaces):
+    """Возвращает версии нескольких пространств имён одним обращением к кэшу"""
+    keys = {namespace: _key(namespace) for namespace in namespaces}
+    found = cache.get_many(keys.values())
+    return tuple(
+        found.get(key) or get_version(namespace) for namespace, key in keys.items()
+    )
+
+
+async def aget_versions(namespaces):
+    """Асинхронный вариант get_versions"""
+    keys = {namespace: _key(namespace) for namespace in namespaces}
+    found = await cache.aget_many(keys.values())
+    return tuple(
+        [
+            found.get(key) or await sync_to_async(get_version)(namespace)
+            for namespace, key in keys.items()
+        ]
+    )
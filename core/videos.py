@@ -0,0 +1,241 @@
+"""Видео из media/video: отдача с поддержкой Range, постеры и облегчённые копии.
+
+Django отдаёт медиа только в DEBUG и без Range, из-за чего браузер не
+может перематывать видео и начинает воспроизведение только после полной
+загрузки. serve_video отдаёт файлы из media/video частями (206) с ETag и
+долгим кэшированием.
+
+Команда build_video_variants при наличии ffmpeg строит для каждого ролика
+кадр-постер и копии с меньшим разрешением и битрейтом и записывает их в
+манифест video/variants/<имя>.json. Тег {% video %} выводит <source> с
+media-условиями: на узком экране браузер берёт лёгкую копию, без манифеста
+остаётся только оригинал.
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, quote_etag
+
+from .page_cache import invalidate_pages
+
+VIDEO_DIR = "video"
+VARIANTS_DIR = posixpath.join(VIDEO_DIR, "variants")
+POSTERS_DIR = posixpath.join(VIDEO_DIR, "posters")
+
+# Имя копии, наибольшая сторона кадра, битрейт видео и media-условие, при
+# котором браузер выбирает эту копию. Порядок — от лёгкой к тяжёлой.
+VARIANTS = (
+    ("mobile", 640, "700k", "(max-width: 767px)"),
+    ("hd", 1280, "2000k", "(max-width: 1399px)"),
+)
+
+CACHE_MAX_AGE = 60 * 60 * 24 * 30
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Страницы с видео зависят от этого имени в кэше страниц
+PAGE_DEPENDENCY = "video"
+
+
+def _etag(stat):
+    return quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+
+
+def _parse_range(header, size):
+    """(start, end) включительно для одного диапазона или None.
+
+    Несколько диапазонов в одном запросе не поддерживаются — в этом случае
+    отдаётся весь файл, что разрешено RFC 9110.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N: последние N байт
+        length = min(int(last), size)
+        return size - length, size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    return start, end
+
+
+def _read(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_video(request, path):
+    """Отдаёт файл из media/video с поддержкой Range, ETag и If-None-Match"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, VIDEO_DIR, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    stat = os.stat(full_path)
+    size = stat.st_size
+    etag = _etag(stat)
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+
+    if request.headers.get("If-None-Match") == etag:
+        return HttpResponseNotModified(headers={"ETag": etag})
+
+    byte_range = None
+    range_header = request.headers.get("Range")
+    if range_header and request.headers.get("If-Range", etag) == etag:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is not None and byte_range[0] >= size:
+            return HttpResponse(status=416, headers={"Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read(full_path, start, end - start + 1), status=206, content_type=content_type
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = end - start + 1
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Cache-Control"] = f"public, max-age={CACHE_MAX_AGE}"
+    return response
+
+
+def manifest_name(name):
+    stem = posixpath.splitext(posixpath.relpath(name, VIDEO_DIR))[0]
+    return posixpath.join(VARIANTS_DIR, stem + ".json")
+
+
+def _cache_key(name):
+    return "video:" + hashlib.md5(name.encode()).hexdigest()
+
+
+def get_manifest(name):
+    """Постер и копии ролика name (путь в хранилище) или None"""
+    key = _cache_key(name)
+    manifest = cache.get(key)
+    if manifest is None:
+        path = manifest_name(name)
+        manifest = {}
+        if default_storage.exists(path):
+            with default_storage.open(path) as f:
+                manifest = json.load(f)
+        # Пустой манифест тоже кэшируется: он сбросится после сборки копий
+        cache.set(key, manifest, None)
+    return manifest or None
+
+
+def ffmpeg_binary():
+    """Путь к ffmpeg или None, если его нет на сервере"""
+    return shutil.which(settings.FFMPEG_BINARY)
+
+
+def list_videos():
+    """Исходные ролики из media/video (без копий и постеров)"""
+    _, files = default_storage.listdir(VIDEO_DIR)
+    return sorted(
+        posixpath.join(VIDEO_DIR, file)
+        for file in files
+        if mimetypes.guess_type(file)[0] == "video/mp4"
+    )
+
+
+def _run(ffmpeg, *args):
+    subprocess.run([ffmpeg, "-y", "-v", "error", *args], check=True)
+
+
+def _scale(max_size):
+    # Ограничиваем большую сторону кадра, вторая считается с сохранением
+    # пропорций и округляется до чётной, как требует libx264
+    return (
+        f"scale='if(gt(iw,ih),min(iw,{max_size}),-2)'"
+        f":'if(gt(iw,ih),-2,min(ih,{max_size}))'"
+    )
+
+
+def _store(source, name):
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    with open(source, "rb") as f:
+        return default_storage.save(name, f)
+
+
+def build_variants(name, ffmpeg):
+    """Строит постер и копии ролика name и записывает манифест"""
+    source = default_storage.path(name)
+    stem = posixpath.splitext(posixpath.relpath(name, VIDEO_DIR))[0]
+    original_size = default_storage.size(name)
+    manifest = {"poster": None, "variants": []}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        poster = os.path.join(tmp, "poster.jpg")
+        # Фильтр thumbnail выбирает характерный кадр из начала ролика
+        _run(ffmpeg, "-i", source, "-vf", "thumbnail", "-frames:v", "1", "-q:v", "3", poster)
+        manifest["poster"] = _store(poster, posixpath.join(POSTERS_DIR, stem + ".jpg"))
+
+        for variant, max_size, bitrate, media in VARIANTS:
+            output = os.path.join(tmp, f"{variant}.mp4")
+            _run(
+                ffmpeg, "-i", source,
+                "-vf", _scale(max_size),
+                "-c:v", "libx264", "-preset", "slow", "-profile:v", "main",
+                "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate,
+                "-c:a", "aac", "-b:a", "96k",
+                "-movflags", "+faststart",
+                output,
+            )
+            # Копия, которая не легче оригинала, только зря занимает место
+            if os.path.getsize(output) >= original_size:
+                continue
+            manifest["variants"].append(
+                {
+                    "name": variant,
+                    "media": media,
+                    "path": _store(output, posixpath.join(VARIANTS_DIR, f"{stem}-{variant}.mp4")),
+                }
+            )
+
+    path = manifest_name(name)
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(json.dumps(manifest).encode()))
+    cache.set(_cache_key(name), manifest, None)
+    invalidate_pages(PAGE_DEPENDENCY)
+    return manifest
+
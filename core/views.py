@@ -1,162 +1,145 @@
 from django.shortcuts import render, redirect
 from django.views.generic import TemplateView, View
 from django.http import JsonResponse
+from django.core.paginator import Paginator
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import quote_etag
 from django.contrib import messages
+from django.core.exceptions import ValidationError
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.db.models import Q
 from .models import (
     Product,
-    Arenda,
     News,
-    Order,
-    PlayerRange,
-    Size,
-    PlayerCount,
-    PlayerAge,
-    GameType,
     AdditionalProducts,
-    Discount,
 )
+from .catalog import get_catalog
+from .facets import FACETS
+from . import search
+from .orders import create_order
+from .player_ranges import get_range_table
+from .recommendations import recommended
+from .page_cache import CachedPageMixin, ConditionalPageMixin, serve
+from .renditions import describe
 
 
-class LandingView(TemplateView):
+class LandingView(CachedPageMixin, TemplateView):
     template_name = "landing.html"
+    cache_dependencies = ("product", "arenda", "additionalproducts", "discount")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["products"] = Product.objects.filter(is_active=True).order_by(
-            "-created_at"
-        )
-        context["active_product_count"] = Product.objects.filter(is_active=True).count()
-        context["arenda"] = Arenda.objects.filter(is_active=True).order_by(
-            "-created_at"
-        )
-        context["additional_products"] = AdditionalProducts.objects.filter(
-            is_active=True
-        ).order_by("-created_at")
-
-        # Get the active discount
-        from datetime import datetime
-        active_discount = Discount.objects.filter(
-            is_active=True,
-            start_date__lte=datetime.now().date(),
-            end_date__gte=datetime.now().date()
-        ).first()
+        catalog = get_catalog()
+        context["products"] = catalog.products
+        context["active_product_count"] = len(catalog.products)
+        context["arenda"] = catalog.arenda
+        context["additional_products"] = catalog.additional_products
 
-        # Add the active discount to the context
-        context["active_discount"] = active_discount
+        # Активная скидка берётся из уже загруженной таблицы скидок
+        context["active_discount"] = catalog.discount_table.active_discount
 
         return context
 
 
-class AboutView(TemplateView):
+class AboutView(CachedPageMixin, TemplateView):
     template_name = "about.html"
+    cache_dependencies = ("product", "arenda", "additionalproducts", "discount", "news", "video")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["products"] = Product.objects.filter(is_active=True).order_by(
-            "-created_at"
-        )
-        context["additional_products"] = AdditionalProducts.objects.filter(
-            is_active=True
-        ).order_by("-created_at")
-        context["arenda"] = Arenda.objects.filter(is_active=True).order_by(
-            "-created_at"
+        catalog = get_catalog()
+        context["products"] = catalog.products
+        context["additional_products"] = catalog.additional_products
+        context["arenda"] = catalog.arenda
+        # Галерея новости загружается отдельно при открытии модального окна
+        context["news"] = (
+            News.objects.filter(is_active=True).only("name", "image").order_by("-created_at")
         )
-        context["news"] = News.objects.filter(is_active=True).order_by("-created_at")
         return context
 
 
-class GameCatalogView(TemplateView):
+class GameCatalogView(ConditionalPageMixin, TemplateView):
     template_name = "game_catalog.html"
+    cache_dependencies = ("product", "arenda", "additionalproducts", "discount")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        products = Product.objects.filter(is_active=True)
-        context["additional_products"] = AdditionalProducts.objects.filter(
-            is_active=True
-        ).order_by("-created_at")
-        context["arenda"] = Arenda.objects.filter(is_active=True).order_by(
-            "-created_at"
-        )
-        # Получаем все возможные значения для фильтров
-        sizes = Size.objects.all()
-        player_counts = PlayerCount.objects.all()
-        player_ages = PlayerAge.objects.all()
-        game_types = GameType.objects.all()
-
-        # Обработка поискового запроса
+        catalog = get_catalog()
+        index = catalog.facet_index
+        context["additional_products"] = catalog.additional_products
+        context["arenda"] = catalog.arenda
+
+        # Обработка поискового запроса: полнотекстовый индекс с ранжированием bm25
+        base_mask = None
+        ranking = None
         search_query = self.request.GET.get("search", "")
         if search_query:
-            from django.db.models import Q
-            products = products.filter(
-                Q(name__icontains=search_query) |
-                Q(name__icontains=search_query.capitalize()) |
-                Q(name__icontains=search_query.upper()) |
-                Q(name__icontains=search_query.lower())
-            )
-
-        # Обработка фильтров
-        if "size" in self.request.GET and self.request.GET["size"]:
-            products = products.filter(sizes__name=self.request.GET["size"])
-
-        if "players" in self.request.GET and self.request.GET["players"]:
-            products = products.filter(
-                player_counts__count=self.request.GET["players"]
-            )
-
-        if "age" in self.request.GET and self.request.GET["age"]:
-            products = products.filter(player_ages__age=self.request.GET["age"])
-
-        if "type" in self.request.GET and self.request.GET["type"]:
-            products = products.filter(game_types__name=self.request.GET["type"])
-
-        # Обработка сортировки
+            found = search_product_ids(search_query)
+            ranking = {pk: position for position, pk in enumerate(found)}
+            base_mask = index.mask_for_pks(found)
+
+        # Обработка фильтров: пересечение масок фасетного индекса
+        selected = {param: self.request.GET.get(param, "") for param, _, _ in FACETS}
+        products = index.items(index.filter(selected, base_mask))
+
+        # Обработка сортировки (товары снимка уже отсортированы по "-created_at");
+        # по цене сортируем по цене со скидкой, которую видит покупатель
         sort = self.request.GET.get("sort", "")
         if sort == "price_asc":
-            products = products.order_by("price")
+            products.sort(key=lambda product: catalog.price_of(product).price)
         elif sort == "price_desc":
-            products = products.order_by("-price")
+            products.sort(key=lambda product: catalog.price_of(product).price, reverse=True)
         elif sort == "name_asc":
-            products = products.order_by("name")
+            products.sort(key=lambda product: product.name)
         elif sort == "name_desc":
-            products = products.order_by("-name")
-        else:
-            products = products.order_by("-created_at")
+            products.sort(key=lambda product: product.name, reverse=True)
+        elif ranking is not None:
+            # Без явной сортировки результаты поиска идут по релевантности
+            products.sort(key=lambda product: ranking[product.pk])
 
         context["products"] = products
 
         # Добавляем значения для фильтров в контекст
-        context["sizes"] = sizes
-        context["player_counts"] = player_counts
-        context["player_ages"] = player_ages
-        context["game_types"] = game_types
+        context["sizes"] = catalog.sizes
+        context["player_counts"] = catalog.player_counts
+        context["player_ages"] = catalog.player_ages
+        context["game_types"] = catalog.game_types
+        # Варианты фильтров с количеством игр, которые останутся после выбора
+        context["facets"] = index.options(selected, base_mask)
 
         return context
 
 
-class ProductDetailView(TemplateView):
+class ProductDetailView(ConditionalPageMixin, TemplateView):
     template_name = "product_detail.html"
+    cache_dependencies = ("product", "arenda", "additionalproducts", "discount", "recommendation")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        current_product = Product.objects.get(pk=self.kwargs.get("pk"))
+        catalog = get_catalog()
+        # Фото и комплектация выводятся в шаблоне дважды (страница и модальное окно)
+        current_product = Product.objects.prefetch_related(
+            "additional_images", "ordered_game_kits__game_kit_item"
+        ).get(pk=self.kwargs.get("pk"))
         context["product"] = current_product
 
-        # Оставляем существующий список продуктов без изменений
-        context["products"] = Product.objects.filter(is_active=True).order_by("-created_at")
+        # Полные списки нужны форме заказа
+        context["products"] = catalog.products
 
-        # Добавляем новый список продуктов для блока "СМОТРИТЕ ТАКЖЕ", исключая текущий продукт
-        context["similar_products"] = Product.objects.filter(is_active=True).exclude(pk=current_product.pk).order_by("-created_at")
+        # Блоки "СМОТРИТЕ ТАКЖЕ" и "С ЭТИМ ТОВАРОМ ПОКУПАЮТ" — заранее посчитанные рекомендации
+        (
+            context["similar_products"],
+            context["recommended_additional_products"],
+        ) = recommended(current_product, catalog)
 
         context["additional_images"] = current_product.additional_images.all()
 
         # Добавьте передачу данных аренды
-        context["arenda"] = Arenda.objects.filter(is_active=True).order_by("-created_at")
-        additional_products = list(
-            AdditionalProducts.objects.filter(is_active=True).order_by("-created_at")
-        )
-        context["additional_products"] = additional_products
+        context["arenda"] = catalog.arenda
+        context["additional_products"] = catalog.additional_products
         return context
 
 class AdditionalProductsView(TemplateView):
@@ -169,159 +152,167 @@ class AdditionalProductsView(TemplateView):
         ).order_by("-created_at")
         return context
 
-class AdditionalProductDetailView(TemplateView):
+class AdditionalProductDetailView(ConditionalPageMixin, TemplateView):
     template_name = "additional_product_detail.html"
+    cache_dependencies = ("product", "arenda", "additionalproducts", "discount", "recommendation")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["products"] = Product.objects.filter(is_active=True).order_by("-created_at")
+        catalog = get_catalog()
+        context["products"] = catalog.products
         current_additional_product = AdditionalProducts.objects.get(pk=self.kwargs.get("pk"))
         context["additional_product"] = current_additional_product
         context["additional_images"] = current_additional_product.additional_images.all()
 
 
-        context["arenda"] = Arenda.objects.filter(is_active=True).order_by(
-            "-created_at"
-        )
-        additional_products = list(
-            AdditionalProducts.objects.filter(is_active=True).order_by("-created_at")
-        )
-        context["additional_products"] = additional_products
-        # Список дополнительных продуктов, исключая текущий
-        context["similar_additional_products"] = AdditionalProducts.objects.filter(
-            is_active=True
-        ).exclude(pk=current_additional_product.pk).order_by("-created_at")
+        context["arenda"] = catalog.arenda
+        context["additional_products"] = catalog.additional_products
+        # Рекомендации для блоков "СМОТРИТЕ ТАКЖЕ" и "С ЭТИМ ТОВАРОМ ПОКУПАЮТ"
+        (
+            context["recommended_products"],
+            context["similar_additional_products"],
+        ) = recommended(current_additional_product, catalog)
         return context
     
-class RentalCatalogView(TemplateView):
+class RentalCatalogView(CachedPageMixin, TemplateView):
     template_name = "rental_catalog.html"
+    cache_dependencies = (
+        "product", "arenda", "additionalproducts", "discount", "news", "playerrange"
+    )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["additional_products"] = AdditionalProducts.objects.filter(
-            is_active=True
-        ).order_by("-created_at")
-        context["products"] = Product.objects.filter(is_active=True).order_by(
-            "-created_at"
-        )
-        context["arenda"] = Arenda.objects.filter(is_active=True).order_by(
-            "-created_at"
+        catalog = get_catalog()
+        context["additional_products"] = catalog.additional_products
+        context["products"] = catalog.products
+        context["arenda"] = catalog.arenda
+        # Галерея новости загружается отдельно при открытии модального окна
+        context["news"] = (
+            News.objects.filter(is_active=True).only("name", "image").order_by("-created_at")
         )
-        context["news"] = News.objects.filter(is_active=True).order_by("-created_at")
+        # Калькулятор гостей один раз загружает таблицу диапазонов этой версии
+        context["player_ranges_version"] = get_range_table().version
         return context
 
-class TwoGamesOnOneBoardView(TemplateView):
+
+class TwoGamesOnOneBoardView(CachedPageMixin, TemplateView):
     template_name = "two_games_on_one_board.html"
+    cache_dependencies = ("product", "arenda", "additionalproducts", "discount", "video")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["arenda"] = Arenda.objects.filter(is_active=True).order_by(
-            "-created_at"
-        )
-        context["products"] = Product.objects.filter(is_active=True).order_by(
-            "-created_at"
-        )
-        context["additional_products"] = AdditionalProducts.objects.filter(
-            is_active=True).order_by(
-            "-created_at"
-        )
+        catalog = get_catalog()
+        context["arenda"] = catalog.arenda
+        context["products"] = catalog.products
+        context["additional_products"] = catalog.additional_products
         return context
+
+
+def search_product_ids(query):
+    """pk товаров, подходящих под поисковый запрос, от самых релевантных"""
+    if search.is_available():
+        return search.search(query)
+    # LIKE в SQLite не различает регистр только у латиницы: кириллицу
+    # ищем в нескольких вариантах регистра
+    condition = Q()
+    for variant in {query, query.capitalize(), query.upper(), query.lower()}:
+        condition |= Q(name__icontains=variant)
+    return list(Product.objects.filter(condition).values_list("pk", flat=True))
+
+
+NEWS_GALLERY_PAGE_SIZE = 12
+
+
+def news_gallery(request, pk):
+    """Фотографии новости для модального окна, постранично.
+
+    Первой идёт обложка новости, за ней дополнительные фото. Ответ
+    кэшируется вместе со страницами, зависящими от новостей.
+    """
+    return serve(request, ("news",), lambda: render_news_gallery(request, pk))
+
+
+def render_news_gallery(request, pk):
+    news = get_object_or_404(News, pk=pk, is_active=True)
+    images = [news.image] + [
+        item.image for item in news.additional_images.order_by("-is_main", "pk")
+    ]
+    page = Paginator(images, NEWS_GALLERY_PAGE_SIZE).get_page(request.GET.get("page"))
+    next_url = None
+    if page.has_next():
+        next_url = f"{reverse('news_gallery', args=[pk])}?page={page.next_page_number()}"
+    return JsonResponse(
+        {
+            "images": [describe(image) for image in page],
+            "page": page.number,
+            "pages": page.paginator.num_pages,
+            "next": next_url,
+        }
+    )
+
+
+# Сколько секунд браузер может не перепроверять ответ калькулятора
+CALCULATOR_MAX_AGE = 60 * 5
+
+
 def calculate_games(request):
-    guests = int(request.GET.get('guests'))
     try:
-        player_range = PlayerRange.objects.filter(min_players__lte=guests, max_players__gte=guests).first()
-        
-        if player_range is not None:
-            data = {'min': player_range.min_game_count, 'max': player_range.max_game_count}
-        else:
-            data = {'min': None, 'max': None}
-            
-        return JsonResponse(data)
-    
-    except Exception as e:
-        print(f"Ошибка: {e}")
-        return JsonResponse({'error': str(e)}, status=500)
-    
+        guests = int(request.GET.get("guests", ""))
+    except ValueError:
+        return JsonResponse({"error": "guests должно быть целым числом"}, status=400)
+
+    table = get_range_table()
+    found = table.lookup(guests)
+    data = {"min": found.min, "max": found.max} if found else {"min": None, "max": None}
+    response = JsonResponse(data)
+    response["ETag"] = quote_etag(f"{table.version}-{guests}")
+    patch_cache_control(response, public=True, max_age=CALCULATOR_MAX_AGE)
+    return response
+
+
+def player_ranges_table(request):
+    """Вся таблица диапазонов для расчёта в браузере.
+
+    Ссылка на таблицу содержит её версию, поэтому ответ на актуальную версию
+    кэшируется браузером надолго, а после изменения таблицы страница
+    ссылается на новый адрес.
+    """
+    table = get_range_table()
+    response = JsonResponse({"version": table.version, "ranges": table.rows})
+    response["ETag"] = quote_etag(table.version)
+    if request.GET.get("v") == table.version:
+        patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=CALCULATOR_MAX_AGE)
+    return response
+
 
 @method_decorator(csrf_exempt, name="dispatch")
 class ProcessOrderView(View):
     def post(self, request, *args, **kwargs):
-        try:
-            data = request.POST
-
-            # Создание заказа
-            order = Order.objects.create(
-                name=data.get("name"),
-                phone=data.get("phone"),
-                order_type=data.get("order_type"),
-                comment=data.get("comment", ""),
-                double_game_count=data.get("double_game_count", 1),
-            )
-
-            # Обработка в зависимости от типа заказа
-            if data.get("order_type") == "buy":
-                # Сохранение выбранных игр для покупки
-                if "buy_games" in data:
-                    games = data.getlist("buy_games")
-                    order.products.set(games)
-
-                # Сохранение дополнительных товаров
-                if "additional_goods" in data:
-                    additional_goods = data.getlist("additional_goods")
-                    order.additional_products.set(additional_goods)
-
-                # Сохранение адреса доставки
-                order.delivery_address = data.get("delivery_address")
-
-                # Сохранение информации о гравировке
-                order.engraving = data.get("engraving", "no")
-
-            elif data.get("order_type") == "double_buy":
-                # Сохранение выбранных игр для покупки 2 игр на одной доске
-                if "buy_games" in data:
-                    games = data.getlist("buy_games")
-                    order.products.set(games)
-
-                # Сохранение дополнительных товаров
-                if "additional_goods" in data:
-                    additional_goods = data.getlist("additional_goods")
-                    order.additional_products.set(additional_goods)
-
-                # Сохранение адреса доставки
-                order.delivery_address = data.get("delivery_address")
-
-                # Сохранение информации о гравировке
-                order.engraving = data.get("engraving", "no")
-
-                # Установка количества игр на одной доске
-                order.double_game_count = 2
-
-            elif data.get("order_type") == "rent":
-                # Сохранение выбранных игр для аренды
-                if "rent_games" in data:
-                    games = data.getlist("rent_games")
-                    order.games_for_rent.set(games)
-
-                # Сохранение типа аренды
-                if "rent_type" in data:
-                    order.arenda.set([data.get("rent_type")])
-
-                # Сохранение даты аренды
-                if "rent_date" in data:
-                    order.date = data.get("rent_date")
-
-                # Сохранение адреса доставки
-                order.delivery_address = data.get("rent_address")
-
-            order.save()
-
-            return JsonResponse({"success": True, "message": "Заказ успешно оформлен!"})
-
-        except Exception as e:
-            return JsonResponse(
-                {
-                    "success": False,
-                    "message": f"Ошибка при оформлении заказа: {str(e)}",
-                },
-                status=400,
-            )
+        return order_response(request.POST)
+
+
+def order_response(data):
+    """Создаёт заказ из данных формы и возвращает JSON-ответ для формы"""
+    try:
+        create_order(data)
+
+        return JsonResponse({"success": True, "message": "Заказ успешно оформлен!"})
+
+    except ValidationError as e:
+        return JsonResponse(
+            {
+                "success": False,
+                "message": f"Ошибка при оформлении заказа: {' '.join(e.messages)}",
+            },
+            status=400,
+        )
+    except Exception as e:
+        return JsonResponse(
+            {
+                "success": False,
+                "message": f"Ошибка при оформлении заказа: {str(e)}",
+            },
+            status=400,
+        )
@@ -391,7 +391,6 @@ function submitFormData() {
     method: 'POST',
     body: formData,
     headers: {
-      'X-CSRFToken': formData.get('csrfmiddlewaretoken'),
       'X-Requested-With': 'XMLHttpRequest'
     }
   })
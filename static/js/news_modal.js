@@ -1,31 +1,78 @@
 // Управление модальным окном новостей
 let newsSlideIndex = 0;
 let newsSlides = [];
+// Адрес следующей страницы галереи и номер текущего запроса: ответ
+// для уже закрытой или другой новости отбрасывается
+let newsNextPage = null;
+let newsGalleryRequest = 0;
+let newsGalleryLoading = false;
 
-// Открытие модального окна новостей
-function openNewsModal(images) {
-    const modal = document.getElementById('newsModal');
-    const carouselInner = document.querySelector('.news-carousel-inner');
-
-    // Очистка предыдущих слайдов
-    carouselInner.innerHTML = '';
+// Разметка слайда: AVIF/WebP-копии, если они уже построены, иначе оригинал
+function newsSlideHtml(image, index) {
+    const sources = (image.sources || [])
+        .map(source => `<source type="${source.type}" srcset="${source.srcset}" sizes="100vw">`)
+        .join('');
+    const size = image.width && image.height ? ` width="${image.width}" height="${image.height}"` : '';
+    return `<picture>${sources}<img src="${image.url}" alt="Слайд ${index + 1}"${size}></picture>`;
+}
 
-    // Добавление новых слайдов
-    images.forEach((image, index) => {
+// Добавление слайдов в карусель
+function appendNewsSlides(images) {
+    const carouselInner = document.querySelector('.news-carousel-inner');
+    images.forEach(image => {
         const slide = document.createElement('div');
         slide.className = 'news-carousel-item';
-        slide.innerHTML = `<img src="${image}" alt="Слайд ${index + 1}">`;
+        slide.innerHTML = newsSlideHtml(image, carouselInner.children.length);
         carouselInner.appendChild(slide);
     });
-
-    // Обновление списка слайдов
     newsSlides = document.querySelectorAll('.news-carousel-item');
+}
+
+// Загрузка страницы галереи; replace заменяет временную обложку из карточки
+// полноразмерными слайдами первой страницы
+function loadNewsGallery(url, request, replace) {
+    newsGalleryLoading = true;
+    return fetch(url)
+        .then(response => response.ok ? response.json() : Promise.reject(response.status))
+        .then(data => {
+            if (request !== newsGalleryRequest) return;
+            if (replace) {
+                document.querySelector('.news-carousel-inner').innerHTML = '';
+            }
+            appendNewsSlides(data.images);
+            showNewsSlide(newsSlideIndex);
+            newsNextPage = data.next;
+        })
+        .catch(error => console.error('Не удалось загрузить галерею новости:', error))
+        .finally(() => {
+            if (request === newsGalleryRequest) newsGalleryLoading = false;
+        });
+}
+
+// Открытие модального окна новостей: сразу показываем обложку из карточки,
+// остальные фото подгружаем с сервера
+function openNewsModal(cover, galleryUrl) {
+    const modal = document.getElementById('newsModal');
+    const carouselInner = document.querySelector('.news-carousel-inner');
+
+    // Очистка предыдущих слайдов
+    carouselInner.innerHTML = '';
+    newsNextPage = null;
+    const request = ++newsGalleryRequest;
+
+    if (cover) {
+        appendNewsSlides([cover]);
+    }
 
     // Отображение модального окна
     modal.style.display = 'block';
     document.body.style.overflow = 'hidden';
     newsSlideIndex = 0;
     showNewsSlide(newsSlideIndex);
+
+    if (galleryUrl) {
+        loadNewsGallery(galleryUrl, request, true);
+    }
 }
 
 // Закрытие модального окна новостей
@@ -43,8 +90,15 @@ function showNewsSlide(index) {
     document.querySelector('.news-carousel-inner').style.transform = `translateX(-${newsSlideIndex * 100}%)`;
 }
 
-// Следующий слайд в карусели новостей
+// Следующий слайд в карусели новостей; у предпоследнего слайда заранее
+// подгружаем следующую страницу галереи
 function newsNextSlide() {
+    if (newsNextPage && !newsGalleryLoading && newsSlideIndex + 2 >= newsSlides.length) {
+        loadNewsGallery(newsNextPage, newsGalleryRequest, false);
+    }
+    if (newsSlideIndex + 1 >= newsSlides.length && newsNextPage) {
+        return;
+    }
     newsSlideIndex++;
     showNewsSlide(newsSlideIndex);
 }
@@ -77,22 +131,11 @@ document.addEventListener('DOMContentLoaded', function() {
     buttons.forEach(button => {
         button.addEventListener('click', function() {
             const newsId = this.getAttribute('data-news-id');
-            // Получаем все изображения для новости
-            const images = [];
             const newsItem = document.querySelector(`.news-card[data-news-id="${newsId}"]`);
-            if (newsItem) {
-                // Основное изображение новости
-                const mainImage = newsItem.querySelector('.news_card_image');
-                if (mainImage) {
-                    images.push(mainImage.src);
-                }
-                // Дополнительные изображения новости
-                const additionalImages = newsItem.querySelectorAll('.additional_news_image');
-                additionalImages.forEach(img => {
-                    images.push(img.src);
-                });
-            }
-            openNewsModal(images);
+            // Обложка уже загружена в карточке, берём её без запроса к серверу
+            const mainImage = newsItem && newsItem.querySelector('.news_card_image');
+            const cover = mainImage ? { url: mainImage.currentSrc || mainImage.src } : null;
+            openNewsModal(cover, this.getAttribute('data-gallery-url'));
         });
     });
 
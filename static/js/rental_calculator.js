@@ -4,6 +4,31 @@ document.addEventListener('DOMContentLoaded', function() {
     const guestMinCount = document.getElementById("guestMinCount");
     const guestMaxCount = document.getElementById("guestMaxCount");
 
+    // Калькулятор есть только на странице аренды
+    if (!guestSlider) return;
+
+    // Таблица диапазонов [мин. гостей, макс. гостей, мин. игр, макс. игр],
+    // загружается один раз; пока её нет, считаем через /calculate_games/
+    let playerRanges = null;
+    const tableUrl = guestSlider.dataset.tableUrl;
+    if (tableUrl) {
+        fetch(tableUrl)
+            .then(response => response.ok ? response.json() : Promise.reject(response.status))
+            .then(data => { playerRanges = data.ranges; })
+            .catch(error => console.error('Ошибка загрузки таблицы диапазонов:', error));
+    }
+
+    function lookupGames(guests) {
+        const range = playerRanges.find(([minPlayers, maxPlayers]) => minPlayers <= guests && guests <= maxPlayers);
+        return range ? { min: range[2], max: range[3] } : { min: null, max: null };
+    }
+
+    function showGames(data) {
+        guestMinCount.textContent = `${data.min} `;
+        guestMaxCount.textContent = ` ${data.max}`;
+        document.getElementById("gamesLabel").textContent = 'игр';
+    }
+
     function updateRecommendedGames(guests) {
         if (guests < 2) {
             guestMinCount.textContent = '';
@@ -11,13 +36,13 @@ document.addEventListener('DOMContentLoaded', function() {
             document.getElementById("gamesLabel").textContent = '';
             return;
         }
+        if (playerRanges) {
+            showGames(lookupGames(guests));
+            return;
+        }
         fetch('/calculate_games/?guests=' + guests)
             .then(response => response.json())
-            .then(data => {
-                guestMinCount.textContent = `${data.min} `;
-                guestMaxCount.textContent = ` ${data.max}`;
-                document.getElementById("gamesLabel").textContent = 'игр';
-            })
+            .then(showGames)
             .catch(error => console.error('Ошибка:', error));
     };
 
@@ -27,7 +52,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const guestValueDisplay = document.getElementById("guestValueDisplay");
         guestValueDisplay.style.display = "block";
         guestValueDisplay.innerHTML = newValue + ' <span id="guestUnit">чел</span>';
-        updateRecommendedGames(newValue); // Отправляем запрос и обновляем рекомендации
+        updateRecommendedGames(newValue); // Пересчитываем рекомендации
         const value = (guestSlider.value - guestSlider.min) / (guestSlider.max - guestSlider.min) * 100;
         guestSlider.style.setProperty('--value', `${value}%`);
     });